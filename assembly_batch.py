@@ -0,0 +1,217 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sys import argv, stdout
+
+from assembly_cache import cache_key, decode_cached
+from assembly_compiler import compile_program
+from assembly_decoder import ProgramError, decode_program
+from assembly_linker import load_linked
+from assembly_loops import accelerate_loops
+from assembly_machine import Machine
+
+# Programs decoded by this worker process, keyed by path or text hash
+_programs = dict()
+_options = dict()
+
+
+class Job:
+    """One run of a program: a path or program text plus initial state"""
+
+    def __init__(self, path=None, text=None, registers=None, memory=None, name=None):
+        if (path is None) == (text is None):
+            raise ValueError("A job needs exactly one of path or text")
+        self.path = path
+        self.text = text
+        self.registers = registers or {}
+        self.memory = memory or {}
+        self.name = name if name is not None else path
+
+
+def run_batch(jobs, workers=None, chunksize=1, ordered=True, compile=False, max_steps=None, use_cache=True):
+    """Runs jobs across a pool of worker processes, yielding one result dict
+    per job. Results come back in job order, or as they finish if ordered is
+    False. Each worker decodes (and compiles) every program once."""
+
+    jobs = list(enumerate(jobs))
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    options = {'compile': compile, 'max_steps': max_steps, 'use_cache': use_cache}
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(options,)) as executor:
+        futures = [executor.submit(_run_chunk, chunk) for chunk in chunks]
+        for future in (futures if ordered else as_completed(futures)):
+            yield from future.result()
+
+
+def _init_worker(options):
+    _programs.clear()
+    _options.clear()
+    _options.update(options)
+
+
+def _run_chunk(chunk):
+    return [run_job(job, index) for index, job in chunk]
+
+
+def _program(job):
+    """Returns the decoded program of a job, and its compiled form if asked for"""
+
+    key = _key(job)
+    if key not in _programs:
+        program = _decode(job, _options.get('use_cache', True))
+        # A compiled program always runs to the end, so a step limit needs the interpreter
+        compile = _options.get('compile') and _options.get('max_steps') is None
+        if compile:
+            _programs[key] = program, compile_program(program)
+        else:
+            _programs[key] = accelerate_loops(program), None
+    return _programs[key]
+
+
+def _key(job):
+    # Preset registers are decoded as registers even where the program
+    # never writes them, so jobs presetting other names need another decode
+    key = job.path if job.path is not None else cache_key(job.text)
+    return (key,) + tuple(sorted(job.registers))
+
+
+def _decode(job, use_cache=True):
+    """Returns the decoded program of a job"""
+    if job.path is not None:
+        return load_linked(job.path, use_cache=use_cache, written=job.registers)
+    if use_cache:
+        return decode_cached(job.text, written=job.registers)
+    return decode_program(job.text, job.registers)
+
+
+def run_job(job, index=0):
+    """Runs a single job in this process and returns its result dict"""
+
+    result = {'index': index, 'name': job.name, 'status': None, 'output': None,
+              'error': None, 'steps': 0, 'registers': None}
+    try:
+        program, compiled = _program(job)
+    except (OSError, ProgramError) as error:
+        result.update(status='error', error=str(error))
+        return result
+
+    machine = Machine(program, registers=job.registers, memory=job.memory)
+    if compiled is not None:
+        compiled.run(machine)
+    else:
+        machine.run(_options.get('max_steps'))
+
+    result.update(status=machine.status or 'timeout', output=machine.output, error=machine.error,
+                  steps=machine.steps, registers=machine.registers_dict())
+    return result
+
+
+def run_vectorized(jobs, max_steps=None, use_cache=True):
+    """Runs the jobs of each program together in this process, as the lanes
+    of one VectorMachine run, and returns their result dicts in job order.
+    Needs NumPy."""
+
+    from assembly_vector import run_lanes
+
+    jobs = list(jobs)
+    groups = dict()  # program key -> indices of its jobs
+    for index, job in enumerate(jobs):
+        groups.setdefault(_key(job), []).append(index)
+
+    results = [None] * len(jobs)
+    for indices in groups.values():
+        try:
+            program = _decode(jobs[indices[0]], use_cache)
+        except (OSError, ProgramError) as error:
+            lanes = [{'status': 'error', 'output': None, 'error': str(error), 'steps': 0, 'registers': None}] * len(indices)
+        else:
+            lanes = run_lanes(program, [(jobs[i].registers, jobs[i].memory) for i in indices], max_steps)
+        for index, lane in zip(indices, lanes):
+            results[index] = {'index': index, 'name': jobs[index].name, **lane, 'status': lane['status'] or 'timeout'}
+    return results
+
+
+def read_presets(path):
+    """Reads initial states from a JSON lines file of {"registers": {...}, "memory": {...}}"""
+    presets = []
+    with open(path) as lines:
+        for line in lines:
+            if line.strip():
+                preset = json.loads(line)
+                memory = {int(address): value for address, value in preset.get('memory', {}).items()}
+                presets.append((preset.get('registers', {}), memory))
+    return presets
+
+
+def display_help():
+    """Displays help information for the batch runner"""
+    print("Usage:")
+    print("  assembly_batch.py file.asm [file.asm ...] [options]")
+    print()
+    print("Runs every program, or every program against every preset, across a")
+    print("pool of worker processes and prints one JSON result per line.")
+    print()
+    print("Options:")
+    print("  --presets=FILE   JSON lines of initial {\"registers\": ..., \"memory\": ...}")
+    print("  --workers=N      Number of worker processes (default: CPU count)")
+    print("  --chunksize=N    Jobs sent to a worker at a time (default: 1)")
+    print("  --unordered      Print results as they finish instead of in job order")
+    print("  --max-steps=N    Stop each run after N instructions")
+    print("  -c, --compile    Compile each program before running it")
+    print("  --no-cache       Parse programs without the compiled-program cache")
+    print("  --vector         Run all presets of a program at once, as lanes of NumPy")
+    print("                   arrays in this process, instead of one job at a time")
+
+
+if __name__ == '__main__':
+    files = [arg for arg in argv[1:] if not arg.startswith('-')]
+    if not files or '-h' in argv or '--help' in argv:
+        display_help()
+        exit(0)
+
+    presets = [({}, {})]
+    options = {'workers': None, 'chunksize': 1, 'ordered': True, 'compile': False,
+               'max_steps': None, 'use_cache': True}
+    vector = False
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            continue
+        try:
+            if arg.startswith('--presets='):
+                presets = read_presets(arg.split('=', 1)[1])
+            elif arg.startswith('--workers='):
+                options['workers'] = int(arg.split('=', 1)[1])
+            elif arg.startswith('--chunksize='):
+                options['chunksize'] = int(arg.split('=', 1)[1])
+            elif arg.startswith('--max-steps='):
+                options['max_steps'] = int(arg.split('=', 1)[1])
+            elif arg == '--unordered':
+                options['ordered'] = False
+            elif arg in ['-c', '--compile']:
+                options['compile'] = True
+            elif arg == '--no-cache':
+                options['use_cache'] = False
+            elif arg == '--vector':
+                vector = True
+            else:
+                print(f"Error: Unknown option '{arg}'")
+                exit(1)
+        except (OSError, ValueError) as error:
+            print(f"Error: Invalid option '{arg}': {error}")
+            exit(1)
+
+    jobs = [Job(path=os.path.abspath(path), registers=registers, memory=memory, name=path)
+            for path in files for registers, memory in presets]
+    if vector:
+        try:
+            results = run_vectorized(jobs, options['max_steps'], options['use_cache'])
+        except ImportError as error:
+            print(f"Error: --vector needs NumPy ({error})")
+            exit(1)
+    else:
+        results = run_batch(jobs, **options)
+    failed = False
+    for result in results:
+        failed = failed or result['status'] != 'end'
+        stdout.write(json.dumps(result) + '\n')
+    exit(1 if failed else 0)
@@ -0,0 +1,214 @@
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+from sys import argv
+
+from assembly_compiler import compile_program
+from assembly_decoder import decode_program
+from assembly_machine import Machine
+from assembly_output import BufferSink
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# Whether a higher value of each metric is better, for regression checks
+METRICS = {
+    'instructions_per_second': True,
+    'parse_seconds': False,
+    'run_seconds': False,
+    'peak_memory_bytes': False,
+    'output_bytes_per_second': True,
+}
+DEFAULT_THRESHOLD = 0.10
+
+# Benchmarks that measure loading rather than execution only run interpreted
+INTERPRET_ONLY = {'parse_heavy'}
+
+
+def generate_parse_heavy(lines=200000):
+    """Returns a huge generated program that is cheap to run but slow to parse"""
+    body = []
+    for i in range(lines // 4):
+        body.append(f"label_{i}:")
+        body.append(f"    mov r{i % 16}, {i}  ; generated")
+        body.append(f"    msg 'value ', r{i % 16}, ' at {i}'")
+        body.append(f"    stw r{i % 16}, {i % 512}+4")
+    return "jmp finish\n" + '\n'.join(body) + "\nfinish:\nend\n"
+
+
+def load_corpus(directory=BENCHMARK_DIR):
+    """Returns (name, program text) for every benchmark program"""
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.asm'):
+            with open(os.path.join(directory, name)) as source:
+                corpus.append((name[:-4], source.read()))
+    corpus.append(('parse_heavy', generate_parse_heavy()))
+    return corpus
+
+
+def measure(text, mode='interpret', repeat=3, memory=True):
+    """Benchmarks one program, keeping the best of repeat runs for timings"""
+
+    parse_seconds = run_seconds = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        program = decode_program(text)
+        parse_seconds = min(parse_seconds, time.perf_counter() - start)
+
+        runner = compile_program(program) if mode == 'compile' else None
+        machine = Machine(program, output=BufferSink())
+        start = time.perf_counter()
+        if runner is not None:
+            runner.run(machine)
+        else:
+            machine.run()
+        run_seconds = min(run_seconds, time.perf_counter() - start)
+        if machine.status != 'end':
+            raise RuntimeError(machine.error)
+
+    # Memory is measured on a separate run, since tracing allocations slows it down
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            program = decode_program(text)
+            machine = Machine(program, output=BufferSink())
+            if mode == 'compile':
+                compile_program(program).run(machine)
+            else:
+                machine.run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    output_bytes = len(machine.output)
+    return {
+        'steps': machine.steps,
+        'parse_seconds': parse_seconds,
+        'run_seconds': run_seconds,
+        'instructions_per_second': machine.steps / run_seconds if run_seconds else 0.0,
+        'peak_memory_bytes': peak,
+        'output_bytes': output_bytes,
+        'output_bytes_per_second': output_bytes / run_seconds if run_seconds else 0.0,
+    }
+
+
+def run_benchmarks(names=None, modes=('interpret', 'compile'), repeat=3, memory=True):
+    """Runs the corpus and returns {"<name>/<mode>": metrics}"""
+    results = {}
+    for name, text in load_corpus():
+        if names and name not in names:
+            continue
+        for mode in modes:
+            if mode == 'compile' and name in INTERPRET_ONLY:
+                continue
+            results[f'{name}/{mode}'] = measure(text, mode, repeat, memory)
+    return results
+
+
+def save_baseline(results, path=DEFAULT_BASELINE, thresholds=None):
+    """Stores results as a JSON baseline, along with the regression thresholds"""
+    baseline = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'thresholds': thresholds or {metric: DEFAULT_THRESHOLD for metric in METRICS},
+        'results': results,
+    }
+    with open(path, 'w') as output:
+        json.dump(baseline, output, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold=None):
+    """Returns a list of regressions of results against a baseline. A metric
+    regresses when it is worse than the baseline by more than its threshold"""
+
+    thresholds = dict(baseline.get('thresholds', {}))
+    regressions = []
+    for key, metrics in results.items():
+        previous = baseline['results'].get(key)
+        if previous is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = previous.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            limit = threshold if threshold is not None else thresholds.get(metric, DEFAULT_THRESHOLD)
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > limit:
+                regressions.append((key, metric, old, new, change))
+    return regressions
+
+
+def display_results(results):
+    print(f"{'benchmark':<28}{'steps':>10}{'instr/s':>14}{'parse s':>10}{'run s':>10}{'peak KiB':>11}{'out MB/s':>10}")
+    for key, m in results.items():
+        print(f"{key:<28}{m['steps']:>10}{m['instructions_per_second']:>14,.0f}{m['parse_seconds']:>10.4f}"
+              f"{m['run_seconds']:>10.4f}{(m['peak_memory_bytes'] or 0) / 1024:>11,.0f}"
+              f"{m['output_bytes_per_second'] / 1e6:>10.2f}")
+
+
+def display_help():
+    """Displays help information for the benchmark runner"""
+    print("Usage:")
+    print("  assembly_bench.py [benchmark ...] [options]")
+    print()
+    print("Options:")
+    print("  --mode=M           interpret, compile or both (default: both)")
+    print("  --repeat=N         Runs per benchmark; the best time is kept (default: 3)")
+    print("  --save-baseline    Store the results as the baseline")
+    print("  --baseline=FILE    Baseline file (default: benchmarks/baseline.json)")
+    print("  --compare          Fail if any metric regressed against the baseline")
+    print("  --threshold=F      Allowed regression as a fraction, for every metric")
+    print("  --no-memory        Skip the peak memory measurement run")
+    print("  --json             Print the results as JSON")
+
+
+if __name__ == '__main__':
+    if '-h' in argv or '--help' in argv:
+        display_help()
+        exit(0)
+
+    names = [arg for arg in argv[1:] if not arg.startswith('-')]
+    modes, repeat, baseline_path, threshold = ('interpret', 'compile'), 3, DEFAULT_BASELINE, None
+    save, check, as_json, memory = False, False, False, True
+    for arg in argv[1:]:
+        if arg.startswith('--mode='):
+            mode = arg.split('=', 1)[1]
+            modes = ('interpret', 'compile') if mode == 'both' else (mode,)
+        elif arg.startswith('--repeat='):
+            repeat = int(arg.split('=', 1)[1])
+        elif arg.startswith('--baseline='):
+            baseline_path = arg.split('=', 1)[1]
+        elif arg.startswith('--threshold='):
+            threshold = float(arg.split('=', 1)[1])
+        elif arg == '--save-baseline':
+            save = True
+        elif arg == '--compare':
+            check = True
+        elif arg == '--json':
+            as_json = True
+        elif arg == '--no-memory':
+            memory = False
+
+    results = run_benchmarks(names, modes, repeat, memory)
+    if as_json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        display_results(results)
+
+    if save:
+        save_baseline(results, baseline_path)
+        print(f"Saved baseline to {baseline_path}")
+
+    if check:
+        with open(baseline_path) as stored:
+            regressions = compare(results, json.load(stored), threshold)
+        for key, metric, old, new, change in regressions:
+            print(f"REGRESSION {key} {metric}: {old:.6g} -> {new:.6g} ({change:+.1%})")
+        exit(1 if regressions else 0)
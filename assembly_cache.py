@@ -0,0 +1,184 @@
+import hashlib
+import marshal
+import os
+import tempfile
+from array import array
+
+from assembly_decoder import Program, decode_program, DECODER_VERSION, OPCODE_COUNT
+
+# Files are hashed and decoded in chunks of this many characters
+READ_CHUNK = 1 << 20
+
+# Programs given as text are cached as <hash>.asmc files in the cache
+# directory, and program files, one object module per file, as <hash>.asmo files
+CACHE_SUFFIX = '.asmc'
+OBJECT_SUFFIX = '.asmo'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'assembly_interpreter')
+
+# Changes whenever the layout of a cache entry changes
+CACHE_FORMAT = '3'
+
+# Mixed into every key and entry, so entries written by another decoder,
+# opcode numbering or entry layout are never read back
+CACHE_VERSION = f'{DECODER_VERSION}.{OPCODE_COUNT}.{CACHE_FORMAT}'
+
+# Entries kept in a cache directory before the least recently used are deleted
+CACHE_SIZE = 4096
+
+
+def cache_dir(directory=None):
+    """Returns the cache directory to use: the given one, $ASM_CACHE_DIR or the default"""
+    return directory or os.environ.get('ASM_CACHE_DIR') or DEFAULT_CACHE_DIR
+
+
+def cache_key(text):
+    """Returns the cache key of a program: a hash of its text and the cache version"""
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    digest.update(text.encode())
+    return digest.hexdigest()
+
+
+def file_cache_key(source):
+    """Returns the cache key of the program in an open file, read in chunks"""
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for chunk in iter(lambda: source.read(READ_CHUNK), ''):
+        digest.update(chunk.encode())
+    return digest.hexdigest()
+
+
+def read_lines(source):
+    """Yields the lines of an open file, reading it in chunks"""
+    tail = ''
+    for chunk in iter(lambda: source.read(READ_CHUNK), ''):
+        lines = (tail + chunk).split('\n')
+        tail = lines.pop()
+        yield from lines
+    yield tail
+
+
+def written_key(key, written):
+    """Returns a cache key extended with the names decoded as registers
+    because something other than the program writes them"""
+    return cache_key('\n'.join([key] + sorted(written))) if written else key
+
+
+def cache_path(text, directory=None, written=()):
+    """Returns the path a program's decoded form is cached at"""
+    return os.path.join(cache_dir(directory), written_key(cache_key(text), written) + CACHE_SUFFIX)
+
+
+def dump_program(program):
+    """Serializes a decoded program to bytes"""
+    positions = program.positions.tobytes() if program.positions is not None else None
+    return marshal.dumps((CACHE_VERSION, program.source, program.code, program.labels, program.register_names,
+                          positions))
+
+
+def undump_program(data):
+    """Rebuilds a decoded program from bytes written by dump_program, or
+    returns None if they were written for another cache version"""
+    state = marshal.loads(data)
+    if state[0] != CACHE_VERSION:
+        return None
+    version, source, code, labels, register_names, positions = state
+    if positions is not None:
+        positions = array('i', positions)
+    return Program(source, code, labels, register_names, positions=positions)
+
+
+def decode_cached(text, directory=None, written=()):
+    """Decodes a program, reusing the cached decoded form when there is one.
+    Names in written are registers, such as ones preset before the run."""
+
+    path = cache_path(text, directory, written)
+    program = read_cached(path)
+    if program is None:
+        program = decode_program(text, written)
+        write_cached(path, program)
+    return program
+
+
+def read_cached(path):
+    """Returns the program cached at path, or None if there is no usable entry"""
+    try:
+        with open(path, 'rb') as cached:
+            program = undump_program(cached.read())
+    except (OSError, ValueError, EOFError, TypeError):
+        return None  # Missing or unreadable entries are simply rebuilt
+    if program is not None:
+        touch(path)
+    return program
+
+
+def write_cached(path, program):
+    """Caches a decoded program at path, if the cache can be written"""
+    try:
+        store(path, dump_program(program))
+    except OSError:
+        pass  # An unwritable cache only costs the next run its parse
+
+
+def store(path, data):
+    """Writes a cache entry atomically, so concurrent runs never read half of one"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as entry:
+            entry.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    prune(directory)
+
+
+def touch(path):
+    """Marks a cache entry as just used, so pruning keeps it longest"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass  # A read-only cache is still read, just never pruned by use
+
+
+def prune(directory, size=CACHE_SIZE):
+    """Deletes the least recently used entries of a cache directory beyond
+    size, returning how many were removed"""
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith((CACHE_SUFFIX, OBJECT_SUFFIX))]
+    except OSError:
+        return 0
+    if len(names) <= size:
+        return 0
+
+    entries = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            entries.append((os.stat(path).st_mtime_ns, path))
+        except OSError:
+            pass  # Removed by a concurrent run
+    entries.sort()
+    removed = 0
+    for used, path in entries[:len(entries) - size]:
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def clear_cache(directory=None):
+    """Deletes every cached program and object module, returning how many were removed"""
+    directory = cache_dir(directory)
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        if name.endswith((CACHE_SUFFIX, OBJECT_SUFFIX)):
+            os.unlink(os.path.join(directory, name))
+            removed += 1
+    return removed
@@ -0,0 +1,132 @@
+import json
+import os
+import socket
+from sys import argv, stdout
+
+# Where the server listens unless told otherwise. This module only imports
+# the standard library it needs, so a client call starts as fast as Python.
+DEFAULT_SOCKET = os.environ.get('ASSEMBLY_SOCKET') or \
+    os.path.join(os.environ.get('TMPDIR', '/tmp'), f'assembly-interpreter-{os.getuid()}.sock')
+
+
+class Client:
+    """A connection to a running assembly_server. Requests are sent one at a
+    time, as JSON lines, over a single connection."""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.stream = self.socket.makefile('rwb')
+
+    def request(self, request):
+        """Sends a request dict and returns the response dict"""
+        self.stream.write(json.dumps(request).encode() + b'\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection")
+        return json.loads(line)
+
+    def run(self, path=None, text=None, registers=None, memory=None, max_steps=None, compile=False):
+        """Runs a program file or program text on the server. Returns a dict
+        with its status, output, error, steps and final registers"""
+        request = {'path': os.path.abspath(path)} if path is not None else {'text': text}
+        if registers:
+            request['registers'] = registers
+        if memory:
+            request['memory'] = memory
+        if max_steps is not None:
+            request['max_steps'] = max_steps
+        if compile:
+            request['compile'] = True
+        return self.request(request)
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def display_help():
+    """Displays help information for the client"""
+    print("Usage:")
+    print("  assembly_client.py file.asm [options]")
+    print("  assembly_client.py --stats | --stop [--socket=PATH]")
+    print()
+    print("Runs a program on a running assembly_server.py and prints its output.")
+    print()
+    print("Options:")
+    print("  --socket=PATH     Socket the server listens on (default: $ASSEMBLY_SOCKET")
+    print(f"                    or {DEFAULT_SOCKET})")
+    print("  --registers=JSON  Initial registers, as a JSON object")
+    print("  --memory=JSON     Initial memory cells, as a JSON object")
+    print("  --max-steps=N     Stop the program after N instructions")
+    print("  -c, --compile     Compile the program before running it")
+    print("  --stats           Print the server's program cache statistics")
+    print("  --stop            Shut the server down")
+
+
+if __name__ == '__main__':
+    if len(argv) < 2 or argv[1] in ['-h', '--help']:
+        display_help()
+        exit(0)
+
+    path = None
+    command = None
+    options = {}
+    socket_path = DEFAULT_SOCKET
+    for arg in argv[1:]:
+        try:
+            if not arg.startswith('-'):
+                path = arg
+            elif arg.startswith('--socket='):
+                socket_path = arg.split('=', 1)[1]
+            elif arg.startswith('--registers='):
+                options['registers'] = json.loads(arg.split('=', 1)[1])
+            elif arg.startswith('--memory='):
+                options['memory'] = json.loads(arg.split('=', 1)[1])
+            elif arg.startswith('--max-steps='):
+                options['max_steps'] = int(arg.split('=', 1)[1])
+            elif arg in ['-c', '--compile']:
+                options['compile'] = True
+            elif arg in ['--stats', '--stop']:
+                command = arg[2:]
+            else:
+                print(f"Error: Unknown option '{arg}'")
+                exit(1)
+        except ValueError as error:
+            print(f"Error: Invalid option '{arg}': {error}")
+            exit(1)
+
+    if path is None and command is None:
+        display_help()
+        exit(1)
+
+    try:
+        with Client(socket_path) as client:
+            if command is not None:
+                print(json.dumps(client.request({'command': command})))
+                exit(0)
+            result = client.run(path, **options)
+    except OSError as error:
+        print(f"Error: Cannot reach the server at {socket_path}: {error}")
+        print("Start it with: assembly_server.py")
+        exit(1)
+
+    if result['output']:
+        stdout.write(result['output'])
+    if result['status'] == 'error':
+        print(f"Error: {result['error']}")
+        exit(1)
+    if result['status'] == 'timeout':
+        print(f"Error: Stopped after {result['steps']} steps")
+        exit(1)
@@ -0,0 +1,16 @@
+# ANSI escape codes for colored terminal output, the same ones colorama
+# provides. Modules that only print the odd message use these, so importing
+# them never loads colorama; the command line calls colorama.init, which
+# translates the codes on terminals that don't understand them.
+
+
+class Fore:
+    RED = '\033[31m'
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    MAGENTA = '\033[35m'
+    CYAN = '\033[36m'
+
+
+class Style:
+    RESET_ALL = '\033[0m'
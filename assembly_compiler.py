@@ -0,0 +1,294 @@
+from assembly_decoder import *
+from assembly_fixed import WRAPPED
+from assembly_machine import Halt, MachineError
+from assembly_verifier import OP_RETURN
+
+# Conditions of the conditional jumps and calls, as Python comparisons
+CONDITIONS = {
+    OP_JE: '==', OP_JNE: '!=', OP_JG: '>', OP_JGE: '>=', OP_JL: '<', OP_JLE: '<=',
+    OP_CE: '==', OP_CNE: '!=', OP_CG: '>', OP_CGE: '>=', OP_CL: '<', OP_CLE: '<=',
+}
+CONDITIONAL_JUMPS = (OP_JE, OP_JNE, OP_JG, OP_JGE, OP_JL, OP_JLE)
+CONDITIONAL_CALLS = (OP_CE, OP_CNE, OP_CG, OP_CGE, OP_CL, OP_CLE)
+
+# Instructions that end a basic block
+TERMINATORS = {OP_END, OP_EXIT, OP_FALLOFF, OP_ERROR, OP_JMP, OP_CALL, OP_RET, OP_RETURN} \
+    | set(CONDITIONAL_JUMPS) | set(CONDITIONAL_CALLS)
+
+ARITHMETIC_OPERATORS = {
+    OP_ADD_RR: '+=', OP_ADD_RI: '+=', OP_SUB_RR: '-=', OP_SUB_RI: '-=',
+    OP_MUL_RR: '*=', OP_MUL_RI: '*=', OP_DIV_RI: '//=',
+}
+
+
+class CompiledProgram:
+    """A program transpiled to a Python function that runs a Machine"""
+
+    def __init__(self, program, source, function, lines):
+        self.program = program
+        self.source = source        # the generated Python source
+        self.function = function
+        self._lines = lines         # generated line number -> program line
+
+    def run(self, machine):
+        """Runs the machine from its current state until it ends or fails"""
+
+        if machine.status is not None:
+            return machine.status
+        try:
+            self.function(machine)
+        except Halt as halt:
+            machine.status = 'end'
+            if isinstance(halt, MachineError):
+                machine.status, machine.error = 'error', str(halt)
+                machine.pc = self._failing_line(halt.__traceback__)
+        except TypeError as error:
+            machine.pc = self._failing_line(error.__traceback__)
+            machine.status, machine.error = 'error', machine._unassigned_message(machine.pc)
+        return machine.status
+
+    def _failing_line(self, traceback):
+        """Maps the innermost frame of the generated code back to a program line"""
+        line = None
+        while traceback is not None:
+            if traceback.tb_frame.f_code is self.function.__code__:
+                line = self._lines.get(traceback.tb_lineno, line)
+            traceback = traceback.tb_next
+        return line
+
+
+def compile_program(program):
+    """Transpiles a decoded Program into a CompiledProgram"""
+
+    source, lines = generate_source(program)
+    namespace = {'Halt': Halt, 'MachineError': MachineError}
+    exec(compile(source, '<assembly>', 'exec'), namespace)
+    return CompiledProgram(program, source, namespace['run'], lines)
+
+
+def find_blocks(program):
+    """Returns the sorted start lines of the basic blocks of a program"""
+
+    code = program.code
+    leaders = {0, len(code) - 1}
+    for i, (op, a, b, c) in enumerate(code):
+        if op == OP_LABEL:
+            leaders.add(i)
+        if op in TERMINATORS and i + 1 < len(code):
+            leaders.add(i + 1)
+        if op == OP_JMP or op == OP_CALL or op in CONDITIONS:
+            leaders.add(a)
+    return sorted(leaders)
+
+
+def generate_source(program):
+    """Generates the Python source of a function running the program. Registers
+    become locals and basic blocks become branches of a state machine on pc"""
+
+    emitter = _Emitter(program)
+    register_list = ', '.join(emitter.register(slot) for slot in range(len(program.register_names)))
+
+    emitter.line(0, 'def run(machine):')
+    if register_list:
+        emitter.line(1, f'{register_list}, = machine.registers')
+    emitter.line(1, 'load = machine.memory.load')
+    emitter.line(1, 'store = machine.memory.store')
+    emitter.line(1, 'stack = machine.stack')
+    emitter.line(1, 'cmp0, cmp1 = machine.compare')
+    emitter.line(1, 'emit = machine.emit')
+    emitter.line(1, 'steps = 0')
+    emitter.line(1, 'pc = machine.pc')
+    emitter.line(1, 'try:')
+    emitter.line(2, 'while True:')
+
+    leaders = find_blocks(program)
+    emitter.dispatch(leaders, 3)
+
+    emitter.line(1, 'finally:')
+    if register_list:
+        emitter.line(2, f'machine.registers[:] = {register_list},')
+    emitter.line(2, 'machine.compare = [cmp0, cmp1]')
+    emitter.line(2, 'machine.steps += steps')
+
+    return '\n'.join(emitter.lines) + '\n', emitter.origins
+
+
+class _Emitter:
+    """Accumulates generated source lines and where each one came from"""
+
+    def __init__(self, program):
+        self.program = program
+        self.code = program.code
+        self.lines = []
+        self.origins = {}  # generated line number -> program line
+        self.blocks = None
+
+    def register(self, slot):
+        return f'r{slot}'
+
+    def line(self, indent, text, origin=None):
+        self.lines.append('    ' * indent + text)
+        if origin is not None:
+            self.origins[len(self.lines)] = origin
+
+    def dispatch(self, leaders, indent):
+        """Emits a balanced comparison tree selecting the block starting at pc"""
+
+        if len(leaders) <= 4:
+            for n, leader in enumerate(leaders):
+                self.line(indent, f"{'if' if n == 0 else 'elif'} pc == {leader}:")
+                self.block(leader, indent + 1)
+            self.line(indent, 'else:')
+            self.line(indent + 1, "raise ValueError(f'No block starts at line {pc}')")
+            return
+
+        middle = len(leaders) // 2
+        self.line(indent, f'if pc < {leaders[middle]}:')
+        self.dispatch(leaders[:middle], indent + 1)
+        self.line(indent, 'else:')
+        self.dispatch(leaders[middle:], indent + 1)
+
+    def block(self, start, indent):
+        """Emits the straight-line code of the basic block starting at start"""
+
+        code = self.code
+        end = start
+        while code[end][0] not in TERMINATORS and code[end + 1][0] != OP_LABEL:
+            end += 1
+
+        op = code[end][0]
+        counted = end - start + (0 if op in (OP_END, OP_FALLOFF, OP_ERROR) else 1)
+        if counted:
+            self.line(indent, f'steps += {counted}')
+        for i in range(start, end + 1):
+            self.instruction(i, indent)
+        if op not in TERMINATORS:
+            self.line(indent, f'pc = {end + 1}')
+
+    def instruction(self, i, indent):
+        """Emits the code of a single instruction record"""
+
+        op, a, b, c = self.code[i]
+        r = self.register
+        emit = lambda text: self.line(indent, text, i)
+
+        if op == OP_LABEL:
+            return
+        if op in (OP_END, OP_EXIT):
+            emit(f'machine.pc = {i}')
+            emit('raise Halt')
+        elif op in (OP_ERROR, OP_FALLOFF):
+            emit(f'raise MachineError({a!r})')
+        elif op == OP_MOV_RI:
+            emit(f'{r(a)} = {b!r}')
+        elif op == OP_MOV_RR:
+            self.check(b, i, indent)
+            emit(f'{r(a)} = {r(b)}')
+        elif op == OP_INC:
+            emit(f'{r(a)} += 1')
+        elif op == OP_DEC:
+            emit(f'{r(a)} -= 1')
+        elif op in (OP_ADD_RI, OP_SUB_RI, OP_MUL_RI, OP_DIV_RI):
+            emit(f'{r(a)} {ARITHMETIC_OPERATORS[op]} {b!r}')
+        elif op in (OP_ADD_RR, OP_SUB_RR, OP_MUL_RR):
+            emit(f'{r(a)} {ARITHMETIC_OPERATORS[op]} {r(b)}')
+        elif op == OP_DIV_RR:
+            emit(f'if {r(b)} == 0:')
+            self.line(indent + 1, f'raise MachineError({f"Division by zero at line {i}"!r})', i)
+            emit(f'{r(a)} //= {r(b)}')
+        elif op == OP_JMP:
+            emit(f'pc = {a}')
+        elif op == OP_CALL:
+            emit(f'stack.append({i})')
+            emit(f'pc = {a}')
+        elif op == OP_RET:
+            emit('if not stack:')
+            self.line(indent + 1, f"""raise MachineError({f"'ret' with empty call stack at line {i}"!r})""", i)
+            emit('pc = stack.pop() + 1')
+        elif op == OP_RETURN:
+            emit('pc = stack.pop() + 1')
+        elif op in (OP_CMP_RR, OP_CMP_RI, OP_CMP_IR, OP_CMP_II):
+            left = r(a) if op in (OP_CMP_RR, OP_CMP_RI) else repr(a)
+            right = r(b) if op in (OP_CMP_RR, OP_CMP_IR) else repr(b)
+            if op in (OP_CMP_RR, OP_CMP_RI):
+                self.check(a, i, indent)
+            if op in (OP_CMP_RR, OP_CMP_IR):
+                self.check(b, i, indent)
+            emit(f'cmp0, cmp1 = {left}, {right}')
+        elif op in CONDITIONAL_JUMPS:
+            emit(f'pc = {a} if cmp0 {CONDITIONS[op]} cmp1 else {i + 1}')
+        elif op in CONDITIONAL_CALLS:
+            emit(f'if cmp0 {CONDITIONS[op]} cmp1:')
+            self.line(indent + 1, f'stack.append({i})', i)
+            self.line(indent + 1, f'pc = {a}', i)
+            emit('else:')
+            self.line(indent + 1, f'pc = {i + 1}', i)
+        elif op in (OP_STW_RR, OP_STW_RC, OP_STW_IR, OP_STW_IC):
+            if op in (OP_STW_RR, OP_STW_RC):
+                self.check(a, i, indent)
+            value = r(a) if op in (OP_STW_RR, OP_STW_RC) else repr(a)
+            address = f'int({r(b)}) + {c!r}' if op in (OP_STW_RR, OP_STW_IR) else repr(b)
+            emit(f'store({address}, {value})')
+        elif op == OP_MVW_R:
+            emit(f'{r(a)} = load(int({r(b)}) + {c!r})')
+        elif op == OP_MVW_C:
+            emit(f'{r(a)} = load({b!r})')
+        elif op == OP_MSG:
+            emit(f'emit({self.message(a)})')
+        elif op in WRAPPED:
+            self.wrapping(i, indent)
+        else:
+            raise ValueError(f'Cannot compile opcode {op}')
+
+    def wrapping(self, i, indent):
+        """Emits a fixed-width instruction: the exact result, wrapped to the
+        width when it falls outside the range"""
+
+        op, a, b, c = self.code[i]
+        op, bits = WRAPPED[op]
+        half = 1 << (bits - 1)
+        r = self.register
+        target = r(a)
+        emit = lambda text: self.line(indent, text, i)
+
+        if op in (OP_INC, OP_DEC):
+            value = f"{target} {'+' if op == OP_INC else '-'} 1"
+        elif op in (OP_ADD_RI, OP_SUB_RI, OP_MUL_RI):
+            value = f'{target} {ARITHMETIC_OPERATORS[op][0]} {b!r}'
+        elif op in (OP_ADD_RR, OP_SUB_RR, OP_MUL_RR):
+            value = f'{target} {ARITHMETIC_OPERATORS[op][0]} {r(b)}'
+        elif op in (OP_DIV_RR, OP_DIV_RI):
+            divisor = r(b) if op == OP_DIV_RR else repr(b)
+            if op == OP_DIV_RR:
+                emit(f'if {divisor} == 0:')
+                self.line(indent + 1, f'raise MachineError({f"Division by zero at line {i}"!r})', i)
+            value = f'-(-{target} // {divisor}) if ({target} < 0) != ({divisor} < 0) else {target} // {divisor}'
+        elif op == OP_MVW_R:
+            value = f'load(int({r(b)}) + {c!r})'
+        else:
+            value = f'load({b!r})'
+        emit(f'{target} = {value}')
+        emit(f'if not {-half} <= {target} < {half}:')
+        self.line(indent + 1, f'{target} = (({target} + {half}) & {2 * half - 1}) - {half}', i)
+
+    def check(self, slot, i, indent):
+        """Emits a check that a register read by line i has been assigned"""
+        name = self.program.register_names[slot]
+        self.line(indent, f'if {self.register(slot)} is None:', i)
+        self.line(indent + 1, f"""raise MachineError({f"Register '{name}' used before assignment at line {i}"!r})""", i)
+
+    def message(self, segments):
+        """Returns an expression building the text of a msg, newline included"""
+
+        parts = []
+        for slot, text in segments:
+            if slot is None:
+                parts.append(repr(text))
+            else:
+                register = self.register(slot)
+                parts.append(f'({text!r} if {register} is None else str({register}))')
+
+        # Register values never end in a newline, so only a literal can
+        if not segments or segments[-1][0] is not None or not segments[-1][1].endswith('\n'):
+            parts.append(repr('\n'))
+        return ' + '.join(parts)
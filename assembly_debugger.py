@@ -0,0 +1,352 @@
+import sys
+
+from assembly_colors import Fore, Style
+from assembly_decoder import *
+from assembly_loops import OP_LOOP
+from assembly_machine import HANDLERS, Pause
+from assembly_optimizer import WRITES
+
+# Records that can change a watched memory cell
+MEMORY_WRITES = (OP_STW_RR, OP_STW_RC, OP_STW_IR, OP_STW_IC)
+
+CALLS = (OP_CALL, OP_CE, OP_CNE, OP_CG, OP_CGE, OP_CL, OP_CLE)
+
+# ANSI control sequences
+CLEAR = '\x1b[H\x1b[2J'
+CLEAR_LINE = '\x1b[K'
+CLEAR_BELOW = '\x1b[J'
+
+
+def _move(row):
+    return f'\x1b[{row + 1};1H'
+
+
+# Patched records wrap the original one: (OP_BREAK or OP_WATCH, record, debugger, None)
+
+def _op_break(machine, record, debugger, c, pc):
+    if debugger.stops_at(pc):
+        raise Pause(pc)
+    op, a, b, c = record
+    if op == OP_EXIT:
+        machine.steps += 1  # the run loop only counts the final label when it sees OP_EXIT
+    return HANDLERS[op](machine, a, b, c, pc)
+
+def _op_watch(machine, record, debugger, c, pc):
+    op, a, b, c = record
+    next_pc = HANDLERS[op](machine, a, b, c, pc)
+    if debugger.changed():
+        raise Pause(next_pc, 1)
+    return next_pc
+
+
+OP_BREAK = len(HANDLERS)
+HANDLERS.append(_op_break)
+OP_WATCH = len(HANDLERS)
+HANDLERS.append(_op_watch)
+
+
+class Debugger:
+    """Runs a machine at full speed between breakpoints and watchpoints.
+
+    Instead of checking every instruction, the debugger runs a patched copy
+    of the program: records at breakpoints are wrapped in OP_BREAK and
+    records that can write a watched register or memory cell in OP_WATCH.
+    Everything else runs through the normal dispatch loop. The program must
+    not be optimized, since fused records skip over the ones they cover."""
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.original = machine.program
+        program = self.original
+        self.code = list(program.code)
+        self.program = Program(program.source, self.code, program.labels, program.register_names,
+                               program.lines, program.positions, program.files)
+        machine.program = self.program
+        self.breakpoints = set()   # record indices
+        self.registers = dict()    # watched register slot -> last value seen
+        self.cells = dict()        # watched memory address -> last value seen
+        self.until = None          # (record index, call depth or None) of a temporary stop
+        self.reason = None         # why the machine last stopped
+
+    # Locations
+
+    def resolve(self, location):
+        """Returns the record index of a line number or label"""
+        program = self.original
+        if location in program.labels:
+            return program.labels[location]
+        try:
+            line = int(location)
+        except ValueError:
+            raise ValueError(f"Unknown line or label '{location}'")
+        if not 0 <= line < len(program):
+            raise ValueError(f"Line {line} is outside the program")
+        if program.lines is None:
+            return line
+        return next(i for i, source_line in enumerate(program.lines) if source_line >= line)
+
+    def add_breakpoint(self, location):
+        self.breakpoints.add(self.resolve(location))
+        self._patch()
+
+    def remove_breakpoint(self, location):
+        self.breakpoints.discard(self.resolve(location))
+        self._patch()
+
+    def add_watch(self, target):
+        """Watches a register by name or a memory cell given as [address]"""
+        if target.startswith('[') and target.endswith(']'):
+            try:
+                address = int(target[1:-1])
+            except ValueError:
+                raise ValueError(f"Invalid address '{target}'")
+            self.cells[address] = self.machine.memory.load(address)
+        else:
+            slot = self.original.register_slot(target)
+            if slot is None:
+                raise ValueError(f"Unknown register '{target}'")
+            self.registers[slot] = self.machine.registers[slot]
+        self._patch()
+
+    def remove_watch(self, target):
+        if target.startswith('[') and target.endswith(']'):
+            self.cells.pop(int(target[1:-1]), None)
+        else:
+            self.registers.pop(self.original.register_slot(target), None)
+        self._patch()
+
+    def _patch(self):
+        """Rebuilds the patched program from the original records"""
+
+        code = self.code
+        code[:] = self.original.code
+        stops = set(self.breakpoints)
+        if self.until is not None:
+            stops.add(self.until[0])
+
+        for i, record in enumerate(code):
+            op, a, b, c = record
+            if op == OP_LOOP and (any(a > stop > i for stop in stops) or self.registers.keys() & b.deltas.keys()):
+                # A loop run in closed form would skip a stop in its body, or
+                # step over every write to a watched register but the last
+                record = code[i] = (OP_LABEL, None, None, None)
+                op = OP_LABEL
+            if (self.registers and op in WRITES and a in self.registers) or (self.cells and op in MEMORY_WRITES):
+                code[i] = (OP_WATCH, record, self, None)
+        for i in stops:
+            if i < len(code) - 1:
+                code[i] = (OP_BREAK, code[i], self, None)
+
+    # Checks made by the patched records
+
+    def stops_at(self, pc):
+        if pc in self.breakpoints:
+            self.reason = f"Breakpoint at line {self.program.line_of(pc)}"
+            return True
+        if self.until is not None and self.until[0] == pc:
+            depth = self.until[1]
+            if depth is None or len(self.machine.stack) <= depth:
+                self.until = None
+                self._patch()
+                self.reason = f"Reached line {self.program.line_of(pc)}"
+                return True
+        return False
+
+    def changed(self):
+        """Returns whether a watched register or cell changed, noting which"""
+        machine = self.machine
+        changes = []
+        for slot, old in self.registers.items():
+            new = machine.registers[slot]
+            if new != old:
+                changes.append(f"{self.original.register_names[slot]}: {old} -> {new}")
+                self.registers[slot] = new
+        for address, old in self.cells.items():
+            new = machine.memory.load(address)
+            if new != old:
+                changes.append(f"[{address}]: {old} -> {new}")
+                self.cells[address] = new
+        if changes:
+            self.reason = "Watch " + ', '.join(changes)
+        return bool(changes)
+
+    # Commands
+
+    def step(self):
+        """Executes one instruction, label lines included"""
+        machine = self.machine
+        self.reason = None
+        machine.program = self.original
+        try:
+            machine.step()
+        finally:
+            machine.program = self.program
+        self.changed()
+        return machine.status
+
+    def resume(self):
+        """Runs until a breakpoint or watchpoint stops the machine, or it ends"""
+        machine = self.machine
+        self.step()  # off the current stop, so it doesn't trigger again
+        if machine.status is None and self.reason is None:
+            machine.run()
+        return machine.status
+
+    def run_until(self, location, depth=None):
+        """Runs until the record at location is about to run, at a call depth
+        of at most depth if given, or until an earlier stop"""
+        self.until = (self.resolve(location) if isinstance(location, str) else location, depth)
+        self._patch()
+        status = self.resume()
+        if self.until is not None:
+            self.until = None
+            self._patch()
+        return status
+
+    def step_over(self):
+        """Steps one instruction, running any call it makes to completion"""
+        machine = self.machine
+        if machine.status is None and self.original.code[machine.pc][0] in CALLS:
+            return self.run_until(machine.pc + 1, len(machine.stack))
+        return self.step()
+
+
+class Screen:
+    """Draws frames of lines in place using ANSI cursor control. Only the
+    lines that changed since the last frame are rewritten."""
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdout if stream is None else stream
+        self.lines = None
+
+    def draw(self, lines):
+        out = []
+        if self.lines is None:
+            out.append(CLEAR)
+            self.lines = []
+        for row, line in enumerate(lines):
+            if row >= len(self.lines) or self.lines[row] != line:
+                out.append(_move(row) + line + CLEAR_LINE)
+        # Leave the cursor below the frame, clearing any prompt left there
+        out.append(_move(len(lines)) + CLEAR_BELOW)
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self.lines = list(lines)
+
+    def clear(self):
+        """Clears the terminal, so the next frame is drawn in full"""
+        self.stream.write(CLEAR)
+        self.stream.flush()
+        self.lines = None
+
+
+def render_state(machine, title, reason=None, history=None, memory_items=10, output_lines=5):
+    """Returns the lines showing the state of a machine: program context,
+    registers, memory, call stack, compare values and recent output"""
+
+    program = machine.program
+    status = machine.status
+    pc = machine.pc
+    line = program.line_of(pc)
+    lines = [f"{Fore.CYAN}=== {title} ==={Style.RESET_ALL}",
+             f"{Fore.YELLOW}Program Counter: {line}{Style.RESET_ALL}"
+             + (f"   {Fore.MAGENTA}{reason}{Style.RESET_ALL}" if reason else '')]
+
+    lines.append(f"{Fore.CYAN}Program Context:{Style.RESET_ALL}")
+    for i in range(max(0, line - 5), min(len(program), line + 6)):
+        text = f"{i:04d}: {' '.join(str(x) for x in program.source[i])}"
+        lines.append(f"{Fore.GREEN}→ {text}{Style.RESET_ALL}" if i == line and status is None else f"  {text}")
+
+    lines.append(f"{Fore.CYAN}Registers:{Style.RESET_ALL}")
+    registers = machine.registers_dict()
+    if not registers:
+        lines.append("  No registers used yet")
+    for name, value in sorted(registers.items()):
+        lines.append(f"  {name}: {value}")
+
+    lines.append(f"{Fore.CYAN}Memory (showing up to {memory_items} items):{Style.RESET_ALL}")
+    cells = machine.memory.head(memory_items + 1)
+    if not cells:
+        lines.append("  No memory used yet")
+    for address, value in cells[:memory_items]:
+        lines.append(f"  {address}: {value}")
+    if len(cells) > memory_items:
+        lines.append("  ... and more locations")
+
+    lines.append(f"{Fore.CYAN}Call Stack:{Style.RESET_ALL}")
+    if not machine.stack:
+        lines.append("  Empty stack")
+    for i, address in enumerate(machine.stack):
+        lines.append(f"  {i}: line {program.line_of(address)}")
+
+    lines.append(f"{Fore.CYAN}Compare Values: {machine.compare}{Style.RESET_ALL}")
+
+    if history:
+        lines.append(f"{Fore.CYAN}Last Operations:{Style.RESET_ALL}")
+        lines.extend(f"  {entry}" for entry in history)
+
+    output = machine.output
+    if output:
+        lines.append(f"{Fore.CYAN}Output:{Style.RESET_ALL}")
+        lines.extend(f"{Fore.MAGENTA}  {text}{Style.RESET_ALL}" for text in output.splitlines()[-output_lines:])
+    return lines
+
+
+DEBUGGER_HELP = ("Commands: [Enter]/s step, n step over, c continue, u LOC run until, "
+                 "b LOC / d LOC set/delete breakpoint, w TARGET / uw TARGET watch/unwatch, q quit")
+
+
+def run_debugger(machine, breakpoints=(), watches=(), step_mode=True, screen=None):
+    """Debugs a machine interactively. LOC is a line number or label and
+    TARGET a register name or [address]. Unless step_mode is set, the
+    program first runs until it reaches a breakpoint or watchpoint."""
+
+    debugger = Debugger(machine)
+    screen = Screen() if screen is None else screen
+    for location in breakpoints:
+        debugger.add_breakpoint(location)
+    for target in watches:
+        debugger.add_watch(target)
+    if not step_mode:
+        machine.run()
+
+    message = DEBUGGER_HELP
+    while machine.status is None:
+        screen.draw(render_state(machine, f"Assembly Debugger - Step {machine.steps + 1}", debugger.reason)
+                    + ['', message])
+        try:
+            command, _, argument = input(f"{Fore.YELLOW}(debug) {Style.RESET_ALL}").strip().partition(' ')
+        except EOFError:
+            break
+        argument = argument.strip()
+        message = DEBUGGER_HELP
+        try:
+            if command in ('', 's', 'step'):
+                debugger.step()
+            elif command in ('n', 'next'):
+                debugger.step_over()
+            elif command in ('c', 'continue'):
+                debugger.resume()
+            elif command in ('u', 'until'):
+                debugger.run_until(argument)
+            elif command in ('b', 'break'):
+                debugger.add_breakpoint(argument)
+                message = f"Breakpoint set at {argument}"
+            elif command in ('d', 'delete'):
+                debugger.remove_breakpoint(argument)
+                message = f"Breakpoint at {argument} deleted"
+            elif command in ('w', 'watch'):
+                debugger.add_watch(argument)
+                message = f"Watching {argument}"
+            elif command in ('uw', 'unwatch'):
+                debugger.remove_watch(argument)
+                message = f"No longer watching {argument}"
+            elif command in ('q', 'quit'):
+                break
+            else:
+                message = f"Unknown command '{command}'. " + DEBUGGER_HELP
+        except ValueError as error:
+            message = f"{Fore.RED}Error: {error}{Style.RESET_ALL}"
+
+    machine.program = debugger.original
+    return debugger
@@ -0,0 +1,342 @@
+import gc
+from array import array
+
+from assembly_helpers import process_line, parse_int, parse_address
+from assembly_registers import RegisterFile
+
+# Opcodes of the decoded instruction stream. Every decoded instruction is a
+# record (opcode, a, b, c) whose operands have already been resolved: register
+# operands are slots into the register file, immediates are ints and jump
+# targets are indices into the decoded program.
+(
+    OP_END, OP_EXIT, OP_FALLOFF, OP_ERROR, OP_LABEL,
+    OP_MOV_RR, OP_MOV_RI, OP_INC, OP_DEC,
+    OP_ADD_RR, OP_ADD_RI, OP_SUB_RR, OP_SUB_RI,
+    OP_MUL_RR, OP_MUL_RI, OP_DIV_RR, OP_DIV_RI,
+    OP_JMP, OP_CALL, OP_RET,
+    OP_CMP_RR, OP_CMP_RI, OP_CMP_IR, OP_CMP_II,
+    OP_JE, OP_JNE, OP_JG, OP_JGE, OP_JL, OP_JLE,
+    OP_CE, OP_CNE, OP_CG, OP_CGE, OP_CL, OP_CLE,
+    OP_STW_RR, OP_STW_RC, OP_STW_IR, OP_STW_IC,
+    OP_MVW_R, OP_MVW_C,
+    OP_MSG,
+) = range(43)
+
+OPCODE_COUNT = 43
+
+# Changes whenever the decoded form of a program changes, invalidating caches
+DECODER_VERSION = '2'
+
+# Commands taking a single label operand, mapped to their opcode
+JUMPS = {
+    'jmp': OP_JMP, 'call': OP_CALL,
+    'je': OP_JE, 'jne': OP_JNE, 'jg': OP_JG, 'jge': OP_JGE, 'jl': OP_JL, 'jle': OP_JLE,
+    'ce': OP_CE, 'cne': OP_CNE, 'cg': OP_CG, 'cge': OP_CGE, 'cl': OP_CL, 'cle': OP_CLE,
+}
+
+# Arithmetic commands, mapped to their (register, immediate) opcode pair
+ARITHMETIC = {
+    'mov': (OP_MOV_RR, OP_MOV_RI),
+    'add': (OP_ADD_RR, OP_ADD_RI),
+    'sub': (OP_SUB_RR, OP_SUB_RI),
+    'mul': (OP_MUL_RR, OP_MUL_RI),
+    'div': (OP_DIV_RR, OP_DIV_RI),
+}
+
+JUMP_OPCODES = frozenset(JUMPS.values())
+
+# Commands whose first operand is the register written to
+DESTINATIONS = frozenset(('mov', 'inc', 'dec', 'add', 'sub', 'mul', 'div', 'mvw'))
+
+
+class ProgramError(Exception):
+    """Raised when a program cannot be loaded at all"""
+
+
+class Program:
+    """A decoded program: the instruction records plus the tables needed to
+    relate them back to the source"""
+
+    def __init__(self, source, code, labels, register_names, lines=None, positions=None, files=None):
+        self.source = source                  # token tuples from process_line
+        self.code = code                      # decoded records, plus a sentinel
+        self.labels = labels                  # label name -> line index
+        self.register_names = register_names  # register slot -> name
+        self.register_slots = {name: i for i, name in enumerate(register_names)}
+        self.lines = lines                    # record -> source line, if they differ
+        self.positions = positions            # source line -> line number in the file
+        self.files = files                    # (first source line, path) of each linked file, if several
+
+    def __len__(self):
+        return len(self.source)
+
+    def line_of(self, pc):
+        """Returns the source line of the record at pc"""
+        return pc if self.lines is None else self.lines[pc]
+
+    def position_of(self, pc):
+        """Returns the line number in the file of the record at pc, if known"""
+        line = self.line_of(pc)
+        if self.positions is None or line >= len(self.positions):
+            return None
+        return self.positions[line]
+
+    def file_of(self, pc):
+        """Returns the path of the file the record at pc came from, if the
+        program was linked from several files"""
+        if self.files is None:
+            return None
+        line = self.line_of(pc)
+        for start, path in reversed(self.files):
+            if line >= start:
+                return path
+        return None
+
+    def register_slot(self, name):
+        """Returns the slot of a register name, or None if the program never uses it"""
+        return self.register_slots.get(name)
+
+    def new_registers(self):
+        """Returns an empty register file laid out for this program"""
+        return RegisterFile(self.register_names, self.register_slots)
+
+
+def decode_program(program, written=()):
+    """Tokenizes and decodes the text of an assembly program. Names in
+    written are registers, such as ones preset before the program runs."""
+    return decode_stream(program.split('\n'), written)
+
+
+def decode_stream(lines, written=()):
+    """Tokenizes and decodes a program in a single pass over an iterable of
+    lines, such as an open file, so the text is never held in memory whole.
+    The line number in the file of every instruction is kept."""
+
+    return _decode(enumerate(map(process_line, lines), 1), array('i'), set(written))
+
+
+def decode_module(lines, written=()):
+    """Decodes one file of a multi-file program on its own, like
+    decode_stream. Names in written are registers, as other files write
+    them. The module needn't have an 'end', and jumps to labels it doesn't
+    define keep the label name for the linker.
+
+    Returns the Program, the names it writes and the msg words it decoded
+    as text, which a register written in another file would change."""
+
+    written, literals = set(written), set()
+    program = _decode(enumerate(map(process_line, lines), 1), array('i'), written, literals, module=True)
+    return program, written, literals
+
+
+def _decode(numbered, positions=None, written=None, literals=None, module=False):
+    """Decodes (line number, token tuple) pairs as they arrive, skipping
+    lines without tokens. The label table, the written registers and the
+    'end' check are built along the way; jumps keep their label name until
+    every label is known."""
+
+    source, code, labels = [], [], {}
+    written = set() if written is None else written
+    # msg words decoded as text, in case a later line writes them
+    literals = set() if literals is None else literals
+    has_end = False
+    slots, register_names = {}, []
+
+    def slot(name):
+        if name not in slots:
+            slots[name] = len(register_names)
+            register_names.append(name)
+        return slots[name]
+
+    def operand(token):
+        """Returns (is_register, slot or immediate) for a value operand"""
+        if token not in written:
+            number = parse_int(token)
+            if number is not None:
+                return False, number
+        return True, slot(token)
+
+    # Decoding only builds tuples of strings and numbers, which can't form
+    # cycles, so the cyclic collector's passes over them are wasted time
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        add_line, add_record = source.append, code.append
+        i = 0
+        for number, line in numbered:
+            if line is None:
+                continue
+            add_line(line)
+            if positions is not None:
+                positions.append(number)
+            command = line[0]
+            if command[-1] == ':':
+                labels[command.rstrip(':')] = i
+            elif command == 'end':
+                has_end = True
+            elif command in DESTINATIONS and len(line) > 1:
+                # A name written to anywhere in the program is a register, even
+                # if it happens to look like an integer
+                written.add(line[1])
+            try:
+                add_record(_decode_line(i, line, slot, operand, written, literals))
+            except _Malformed:
+                add_record(_malformed(i, line))
+            i += 1
+    finally:
+        if collecting:
+            gc.enable()
+
+    # Error if no end statement in the program
+    if not has_end and not module:
+        raise ProgramError("No 'end' statement found in program")
+    source = tuple(source)
+
+    # Lines that used a name as a literal before a later line wrote to it
+    late = {name for name in written if name in literals or parse_int(name) is not None}
+    if late:
+        for i, line in enumerate(source):
+            if not late.isdisjoint(line[1:]):
+                try:
+                    code[i] = _decode_line(i, line, slot, operand, written, literals)
+                except _Malformed:
+                    code[i] = _malformed(i, line)
+
+    # Resolve jumps now that every label is known. A module leaves the
+    # jumps to other modules' labels to the linker.
+    for i, (op, label, b, c) in enumerate(code):
+        if op in JUMP_OPCODES:
+            if label in labels:
+                code[i] = (op, labels[label], None, None)
+            elif not module:
+                code[i] = (OP_ERROR, f"Unknown label '{label}' at line {i}", None, None)
+
+    if module:
+        return Program(source, code, labels, register_names, positions=positions)
+
+    # Skipping a label on the last line ends the program normally, while any
+    # other instruction running past the last line is an error
+    if code[-1][0] == OP_LABEL:
+        code[-1] = (OP_EXIT, None, None, None)
+    code.append((OP_FALLOFF, "Program reached end without 'end' statement", None, None))
+
+    return Program(source, code, labels, register_names, positions=positions)
+
+
+class _Malformed(Exception):
+    """Raised while decoding a line whose operands don't fit its command"""
+
+
+def _malformed(i, line):
+    return (OP_ERROR, f"Invalid operands for '{line[0]}' at line {i}", None, None)
+
+
+def _decode_line(i, line, slot, operand, written, literals):
+    """Decodes a single tokenized line into an instruction record. Jumps
+    keep their label name until the whole program has been read"""
+
+    command, other = line[0], line[1:]
+
+    if command.endswith(':'):
+        return (OP_LABEL, None, None, None)
+
+    if command == 'end':
+        return (OP_END, None, None, None)
+
+    if command == 'ret':
+        return (OP_RET, None, None, None)
+
+    if command in ('inc', 'dec'):
+        if not other:
+            raise _Malformed
+        return (OP_INC if command == 'inc' else OP_DEC, slot(other[0]), None, None)
+
+    if command in ARITHMETIC:
+        if len(other) != 2:
+            raise _Malformed
+        register, value = other
+        is_register, value = operand(value)
+        register_op, immediate_op = ARITHMETIC[command]
+        if command == 'div' and not is_register and value == 0:
+            return (OP_ERROR, f"Division by zero at line {i}", None, None)
+        return (register_op if is_register else immediate_op, slot(register), value, None)
+
+    if command in JUMPS:
+        if not other:
+            raise _Malformed
+        return (JUMPS[command], other[0], None, None)
+
+    if command == 'cmp':
+        if len(other) != 2:
+            raise _Malformed
+        left_register, left = operand(other[0])
+        right_register, right = operand(other[1])
+        if left_register:
+            return (OP_CMP_RR if right_register else OP_CMP_RI, left, right, None)
+        return (OP_CMP_IR if right_register else OP_CMP_II, left, right, None)
+
+    if command == 'stw':
+        if len(other) != 2:
+            raise _Malformed
+        is_register, value = operand(other[0])
+        base, offset = parse_address(other[1])
+        if base is None:
+            return (OP_STW_RC if is_register else OP_STW_IC, value, offset, None)
+        return (OP_STW_RR if is_register else OP_STW_IR, value, slot(base), offset)
+
+    if command == 'mvw':
+        if len(other) != 2:
+            raise _Malformed
+        register = slot(other[0])
+        base, offset = parse_address(other[1])
+        if base is None:
+            return (OP_MVW_C, register, offset, None)
+        return (OP_MVW_R, register, slot(base), offset)
+
+    if command == 'msg':
+        return (OP_MSG, _decode_message(other, slot, written, literals), None, None)
+
+    return (OP_ERROR, f"Unknown command '{command}' at line {i}", None, None)
+
+
+def _decode_message(other, slot, written, literals):
+    """Splits msg operands into (slot, text) segments. Literal text has a slot
+    of None, register segments fall back to their name while unassigned"""
+
+    segments = []
+    i = 0
+    while i < len(other):
+        part = other[i]
+        if part.startswith("'") and not part.endswith("'"):
+            # Handle multi-part strings
+            full_str = [part[1:]]  # Remove opening quote
+            i += 1
+            while i < len(other) and not other[i].endswith("'"):
+                full_str.append(other[i])
+                i += 1
+            if i < len(other):
+                full_str.append(other[i][:-1])  # Remove closing quote
+            segments.append((None, ' '.join(full_str)))
+        elif part.startswith("'") and part.endswith("'"):
+            # Handle complete quoted strings
+            segments.append((None, part[1:-1]))
+        elif part == '\\n':
+            # Handle newlines
+            segments.append((None, '\n'))
+        elif part in written:
+            # Handle register values
+            segments.append((slot(part), part))
+        else:
+            # Handle other text
+            literals.add(part)
+            segments.append((None, part))
+        i += 1
+
+    # Merge neighbouring literals so they are joined once, at load time
+    merged = []
+    for segment in segments:
+        if merged and segment[0] is None and merged[-1][0] is None:
+            merged[-1] = (None, merged[-1][1] + segment[1])
+        else:
+            merged.append(segment)
+    return tuple(merged)
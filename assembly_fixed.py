@@ -0,0 +1,161 @@
+from operator import add, sub, mul
+
+from assembly_decoder import *
+from assembly_machine import HANDLERS, MachineError
+
+# Integer widths the fixed-width mode supports, in bits
+WIDTHS = (32, 64)
+
+# Operands of each record that are immediate values
+IMMEDIATES = {
+    OP_MOV_RI: (1,), OP_ADD_RI: (1,), OP_SUB_RI: (1,), OP_MUL_RI: (1,), OP_DIV_RI: (1,),
+    OP_CMP_RI: (1,), OP_CMP_IR: (0,), OP_CMP_II: (0, 1), OP_STW_IR: (0,), OP_STW_IC: (0,),
+}
+
+
+def wrap(value, bits):
+    """Returns value as a two's-complement integer of the given width"""
+    half = 1 << (bits - 1)
+    return ((value + half) & (2 * half - 1)) - half
+
+
+def truncate(one, two):
+    """Divides rounding toward zero, as fixed-width division does"""
+    return -(-one // two) if (one < 0) != (two < 0) else one // two
+
+
+# Instruction handlers for one width. Each computes the exact result and only
+# wraps it when it falls outside the range, which most results never do.
+
+def _wrapping_step(delta, half):
+    mask = 2 * half - 1
+    def handler(machine, register, b, c, pc):
+        registers = machine.registers
+        value = registers[register] + delta
+        if not -half <= value < half:
+            value = ((value + half) & mask) - half
+        registers[register] = value
+        return pc + 1
+    return handler
+
+def _wrapping_rr(operation, half):
+    mask = 2 * half - 1
+    def handler(machine, register, source, c, pc):
+        registers = machine.registers
+        value = operation(registers[register], registers[source])
+        if not -half <= value < half:
+            value = ((value + half) & mask) - half
+        registers[register] = value
+        return pc + 1
+    return handler
+
+def _wrapping_ri(operation, half):
+    mask = 2 * half - 1
+    def handler(machine, register, operand, c, pc):
+        registers = machine.registers
+        value = operation(registers[register], operand)
+        if not -half <= value < half:
+            value = ((value + half) & mask) - half
+        registers[register] = value
+        return pc + 1
+    return handler
+
+def _wrapping_div_rr(half):
+    mask = 2 * half - 1
+    def handler(machine, register, source, c, pc):
+        registers = machine.registers
+        divisor = registers[source]
+        if divisor == 0:
+            raise MachineError(f"Division by zero at line {machine.program.line_of(pc)}")
+        value = truncate(registers[register], divisor)
+        if not -half <= value < half:
+            value = ((value + half) & mask) - half  # only the most negative value divided by -1
+        registers[register] = value
+        return pc + 1
+    return handler
+
+def _wrapping_mvw_r(half):
+    # Memory may hold values from an image or a preset wider than the mode
+    mask = 2 * half - 1
+    def handler(machine, register, base, offset, pc):
+        registers = machine.registers
+        value = machine.memory.load(int(registers[base]) + offset)
+        if not -half <= value < half:
+            value = ((value + half) & mask) - half
+        registers[register] = value
+        return pc + 1
+    return handler
+
+def _wrapping_mvw_c(half):
+    mask = 2 * half - 1
+    def handler(machine, register, address, c, pc):
+        value = machine.memory.load(address)
+        if not -half <= value < half:
+            value = ((value + half) & mask) - half
+        machine.registers[register] = value
+        return pc + 1
+    return handler
+
+
+def _add_handlers(bits):
+    """Appends the handlers of one width to the dispatch table and returns
+    {plain opcode: wrapping opcode}"""
+    half = 1 << (bits - 1)
+    handlers = {
+        OP_INC: _wrapping_step(1, half), OP_DEC: _wrapping_step(-1, half),
+        OP_ADD_RR: _wrapping_rr(add, half), OP_ADD_RI: _wrapping_ri(add, half),
+        OP_SUB_RR: _wrapping_rr(sub, half), OP_SUB_RI: _wrapping_ri(sub, half),
+        OP_MUL_RR: _wrapping_rr(mul, half), OP_MUL_RI: _wrapping_ri(mul, half),
+        OP_DIV_RR: _wrapping_div_rr(half), OP_DIV_RI: _wrapping_ri(truncate, half),
+        OP_MVW_R: _wrapping_mvw_r(half), OP_MVW_C: _wrapping_mvw_c(half),
+    }
+    opcodes = {}
+    for op, handler in handlers.items():
+        opcodes[op] = len(HANDLERS)
+        HANDLERS.append(handler)
+    return opcodes
+
+FIXED_OPCODES = {bits: _add_handlers(bits) for bits in WIDTHS}
+
+# Wrapping opcode -> (the plain opcode it replaces, width)
+WRAPPED = {fixed: (op, bits) for bits, opcodes in FIXED_OPCODES.items() for op, fixed in opcodes.items()}
+
+
+def fixed_width(program, bits=64):
+    """Returns a copy of a decoded program that computes with bits-wide
+    two's-complement integers instead of arbitrary-precision ones.
+
+    add, sub, mul, inc and dec wrap around, div rounds toward zero, loads
+    from memory wrap to the width and immediates are wrapped once here. Every
+    value a register or memory cell is given then fits the width, so memory
+    pages stay 64-bit arrays and no step gets slower as values grow. Output,
+    errors and step counts are otherwise those of the plain program.
+    Registers preset on a Machine or restored from a snapshot are brought
+    to the width by wrap_machine."""
+
+    if bits not in FIXED_OPCODES:
+        raise ValueError(f"Unsupported integer width {bits}, expected one of {', '.join(map(str, WIDTHS))}")
+    opcodes = FIXED_OPCODES[bits]
+
+    code = []
+    for i, (op, a, b, c) in enumerate(program.code):
+        operands = [a, b, c]
+        for index in IMMEDIATES.get(op, ()):
+            operands[index] = wrap(operands[index], bits)
+        if op == OP_DIV_RI and operands[1] == 0:
+            # A divisor that is a multiple of 2**bits wraps to zero
+            code.append((OP_ERROR, f"Division by zero at line {program.line_of(i)}", None, None))
+            continue
+        code.append((opcodes.get(op, op), *operands))
+    return Program(program.source, code, program.labels, program.register_names, program.lines,
+                   program.positions, program.files)
+
+
+def wrap_machine(machine, bits):
+    """Wraps the registers and compare values a machine starts with, such as
+    preset or restored ones, to the width of its fixed-width program"""
+    registers = machine.registers
+    for slot, value in enumerate(registers):
+        if value is not None:
+            registers[slot] = wrap(value, bits)
+    machine.compare = [wrap(value, bits) for value in machine.compare]
@@ -1,32 +1,36 @@
-def get_address(address, registers):
-    """Gets the numerical address from the possible access modes allowed"""
-    
+import re
+
+# A quote in a msg line that isn't escaped with a backslash
+_QUOTE = re.compile(r"(?<!\\)'")
+
+
+def parse_address(address: str):
+    """Pre-parses an address expression into (register, offset). The register
+    is None for constant addresses, in which case offset is the address"""
+
+    base = address
     try:
-        address, offset = address.split('+')
+        base, offset = base.split('+')
         offset = int(offset)
     except ValueError:
         try:
-            address, offset = address.split('-')
+            base, offset = base.split('-')
             offset = -int(offset)
         except ValueError:
             offset = 0
 
-    if address.isdigit():
-        return int(address)
+    if base.isdigit():
+        return None, int(base)
 
-    return int(registers[address]) + offset
+    return base, offset
 
-def get_value(value: str, registers: dict):
-    """Returns a constant if value is an integer or the register value otherwise"""
+def parse_int(value: str):
+    """Returns value as an integer, or None if it is not an integer literal"""
 
-    if value in registers:
-        return registers[value]
-    
     try:
         return int(value)
     except ValueError:
-        # Improved error handling for non-numeric values
-        raise ValueError(f"Invalid value: '{value}' is not a valid integer or register name")
+        return None
 
 def process_line(line: str):
     """Removes comments and unneeded whitespace. Returns a split list of
@@ -53,38 +57,40 @@ def process_line(line: str):
     except ValueError:
         return (line,)  # Handle cases where only the command exists
 
-    # Special handling for msg command to preserve commas in quoted strings
+    # Special handling for msg command to preserve commas in quoted strings.
+    # Splitting at the quotes alternates between text outside and inside of
+    # quotes; a quote right after a backslash doesn't count.
     if command == 'msg':
         parts = [command]
-        in_quote = False
         current_part = ""
-        quote_start = -1
-        
-        for i, char in enumerate(contents):
-            if char == "'" and (i == 0 or contents[i-1] != '\\'):
-                in_quote = not in_quote
-                if in_quote:
-                    # Start of quoted string
-                    quote_start = i
-                    if current_part:
-                        parts.append(current_part.strip())
-                        current_part = ""
-                    current_part = "'"
-                else:
+        pieces = _QUOTE.split(contents) if '\\' in contents else contents.split("'")
+        last = len(pieces) - 1
+
+        for i, piece in enumerate(pieces):
+            if i % 2:
+                current_part += piece
+                if i < last:
                     # End of quoted string
-                    current_part += "'"
-                    parts.append(current_part)
+                    parts.append(current_part + "'")
                     current_part = ""
-            elif char == ',' and not in_quote:
+                continue
+
+            *fields, current = piece.split(',')
+            for field in fields:
+                current_part += field
                 if current_part:
                     parts.append(current_part.strip())
                     current_part = ""
-            else:
-                current_part += char
-        
+            current_part += current
+            if i < last:
+                # Start of quoted string
+                if current_part:
+                    parts.append(current_part.strip())
+                current_part = "'"
+
         if current_part:
             parts.append(current_part.strip())
-        
+
         return tuple(parts)
     
     # For other commands, split by comma
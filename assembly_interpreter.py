@@ -1,398 +1,241 @@
-from assembly_helpers import *
-import colorama
-from colorama import Fore, Back, Style
+from assembly_decoder import Program, decode_program, ProgramError, OP_END, OP_EXIT, OP_FALLOFF, OP_LABEL
+from assembly_machine import Machine
+from assembly_memory import open_image
+from assembly_output import StreamSink, open_sink
+from assembly_loops import accelerate_loops
+from assembly_colors import Fore, Style
 import time
-import os
-from collections import deque
 from sys import argv
 
-# Initialize colorama for cross-platform color support
-colorama.init(autoreset=True)
+# The compiler, optimizer, profiler, debugger and other optional stages are
+# imported where they are used, so running a program as a library call only
+# loads what that run needs. colorama is only initialized by the command line.
 
-def assembler_interpreter(program, DEBUG=False, STEP_MODE=False, DELAY=0.3):
+def assembler_interpreter(program, DEBUG=False, STEP_MODE=False, DELAY=0.3, COMPILE=False, TRACE=None,
+                          MEMORY=None, SAVE_MEMORY=None, OUTPUT=None, PROFILE=False, PROFILE_COLLAPSED=None,
+                          OPTIMIZE=False, VERIFY_OPT=False, FAST_LOOPS=True, VERIFY=False, JIT=False, MEMO=False,
+                          SNAPSHOT_AT=None, SAVE_SNAPSHOT=None, RESUME=None, BREAKPOINTS=(), WATCHES=(), BITS=None):
     """Interprets lines of assembly program and returns a set return code"""
 
-    # Tokenize the lines and filter out whitespace
-    program = filter(None, map(process_line, program.split('\n')))
+    # Tokenize and decode the program into instruction records
+    if not isinstance(program, Program):
+        try:
+            program = decode_program(program)
+        except ProgramError as error:
+            print(f"{Fore.RED}Error: {error}{Style.RESET_ALL}")
+            return -1
 
-    # Convert to a tuple for indexing w/ the line counter
-    program = tuple(program)
+    # Reject broken programs before they run, dropping the checks that makes redundant
+    if VERIFY:
+        from assembly_verifier import VerificationError, verify
+        try:
+            program = verify(program)
+        except VerificationError as error:
+            for problem in error.problems:
+                print(f"{Fore.RED}Error: {problem}{Style.RESET_ALL}")
+            return -1
 
-    # Error if no end statement in the program
-    if all(line[0] != 'end' for line in program):
-        print(f"{Fore.RED}Error: No 'end' statement found in program{Style.RESET_ALL}")
-        return -1
+    # Every later stage sees the fixed-width records in place of the plain ones
+    if BITS is not None:
+        from assembly_fixed import fixed_width
+        try:
+            program = fixed_width(program, BITS)
+        except ValueError as error:
+            print(f"{Fore.RED}Error: {error}{Style.RESET_ALL}")
+            return -1
 
-    # Find all functions/routines for line jumping
-    label_lines = {line[0].rstrip(':'): i for i, line in enumerate(program) if line[0][-1] == ':'}
+    # Pre-seed memory from an image file
+    try:
+        memory = open_image(MEMORY) if MEMORY is not None else None
+    except (OSError, ValueError) as error:
+        print(f"{Fore.RED}Error: Cannot load memory image: {error}{Style.RESET_ALL}")
+        return -1
 
-    # Setting auxiliary variables for the language
-    memory = dict()
-    registers, line_counter = dict(), 0
-    prev_lines, return_code = deque(), str()
-    compare = [0, 0]  # Initialize compare to avoid UnboundLocalError
-    
-    # For execution history
-    execution_history = []
-    
-    step_counter = 0
-    
-    while line_counter < len(program) and program[line_counter][0] != 'end':
-        step_counter += 1
-        current_line = program[line_counter]
-        command = current_line[0]
-        
-        # Skip label lines - this is the key fix
-        if command.endswith(':'):
-            line_counter += 1
-            continue
-            
-        other = current_line[1:] if len(current_line) > 1 else []
-        
-        if STEP_MODE or DEBUG:
-            clear_screen()
-            print(f"{Fore.CYAN}=== Assembly Interpreter - Step {step_counter} ==={Style.RESET_ALL}")
-            print(f"{Fore.YELLOW}Program Counter: {line_counter}{Style.RESET_ALL}")
-            
-            # Show execution context (5 lines before and after current line)
-            print(f"\n{Fore.CYAN}Program Context:{Style.RESET_ALL}")
-            for i in range(max(0, line_counter - 5), min(len(program), line_counter + 6)):
-                if i == line_counter:
-                    print(f"{Fore.GREEN}→ {i:04d}: {' '.join(str(x) for x in program[i])}{Style.RESET_ALL}")
-                else:
-                    print(f"  {i:04d}: {' '.join(str(x) for x in program[i])}")
-            
-            # Show registers
-            print(f"\n{Fore.CYAN}Registers:{Style.RESET_ALL}")
-            if not registers:
-                print("  No registers used yet")
-            else:
-                for reg_name, reg_value in sorted(registers.items()):
-                    print(f"  {reg_name}: {reg_value}")
-            
-            # Show memory
-            print(f"\n{Fore.CYAN}Memory (showing up to 10 items):{Style.RESET_ALL}")
-            if not memory:
-                print("  No memory used yet")
-            else:
-                for i, (addr, value) in enumerate(sorted(memory.items())):
-                    print(f"  {addr}: {value}")
-                    if i >= 9:  # Show only 10 memory locations max
-                        remaining = len(memory) - 10
-                        if remaining > 0:
-                            print(f"  ... and {remaining} more locations")
-                        break
-            
-            # Show call stack
-            print(f"\n{Fore.CYAN}Call Stack:{Style.RESET_ALL}")
-            if not prev_lines:
-                print("  Empty stack")
-            else:
-                for i, addr in enumerate(prev_lines):
-                    print(f"  {i}: line {addr}")
-            
-            # Show compare values
-            print(f"\n{Fore.CYAN}Compare Values: {compare}{Style.RESET_ALL}")
-            
-            # Show current command to be executed
-            print(f"\n{Fore.GREEN}Executing: {' '.join(str(x) for x in current_line)}{Style.RESET_ALL}")
-            
-            # Show last 5 operations
-            if execution_history:
-                print(f"\n{Fore.CYAN}Last Operations:{Style.RESET_ALL}")
-                for hist in execution_history[-5:]:
-                    print(f"  {hist}")
-            
-            if STEP_MODE:
-                input(f"{Fore.YELLOW}Press Enter to continue...{Style.RESET_ALL}")
-            else:
-                time.sleep(DELAY)
-
-        # Record command in history
-        execution_history.append(f"Step {step_counter:04d}: " + ' '.join(str(x) for x in current_line))
-
-        # mov command moves either a constant or register value to a register
-        if command == 'mov':
-            register, value = other
-            registers[register] = get_value(value, registers)
-
-        # inc increments the value of a register by 1
-        elif command == 'inc':
-            register = other[0]
-            registers[register] += 1
-
-        # dec decrements the value of a register by 1
-        elif command == 'dec':
-            register = other[0]
-            registers[register] -= 1
-
-        # add adds the contents of a register and a register or constant
-        elif command == 'add':
-            register, value = other
-            registers[register] += get_value(value, registers)
-
-        # sub subtracts the contents of a register and a register or constant
-        elif command == 'sub':
-            register, value = other
-            registers[register] -= get_value(value, registers)
-
-        # mul multiplies the contents of a register and a register or constant
-        elif command == 'mul':
-            register, value = other
-            registers[register] *= get_value(value, registers)
-
-        # div integer divides the contents of a register and a register or constant
-        elif command == 'div':
-            register, value = other
-            divisor = get_value(value, registers)
-            if divisor == 0:
-                print(f"{Fore.RED}Error: Division by zero at line {line_counter}{Style.RESET_ALL}")
+    # The compiler does its own optimization and runs the decoded program as is
+    if FAST_LOOPS and not COMPILE:
+        program = accelerate_loops(program)
+    # Fused records would step over breakpoints, so the debugger runs the plain program
+    interactive = STEP_MODE or BREAKPOINTS or WATCHES
+    # Stages that can't run together are skipped, so say which flags are ignored
+    overriding = '-c' if COMPILE else 'the debugger' if interactive else None
+    warn_ignored((('--jit', JIT), ('--memo', MEMO)), overriding)
+    warn_ignored((('-O', OPTIMIZE), ('--verify-opt', VERIFY_OPT)),
+                 overriding or ('--jit' if JIT else '--memo' if MEMO else None))
+    # Memoization and traces work on plain records, so they also run the unoptimized program
+    memo = None
+    if MEMO and not (COMPILE or interactive):
+        from assembly_memo import Memo
+        memo = Memo(program)
+        program = memo.program
+    if JIT and not (COMPILE or interactive):
+        from assembly_jit import enable_jit
+        program = enable_jit(program)
+    elif (OPTIMIZE or VERIFY_OPT) and not (COMPILE or interactive or memo):
+        from assembly_optimizer import optimize_program, verify_optimization
+        optimized = optimize_program(program)
+        if VERIFY_OPT:
+            differences = verify_optimization(program, optimized, memory=memory)
+            for difference in differences:
+                print(f"{Fore.RED}Optimization changed {difference}{Style.RESET_ALL}")
+            if differences:
                 return -1
-            registers[register] //= divisor
+        program = optimized
+
+    if RESUME is not None:
+        from assembly_snapshot import open_snapshot
+        try:
+            machine = open_snapshot(RESUME).restore(program, OUTPUT)
+        except (OSError, ValueError) as error:
+            print(f"{Fore.RED}Error: Cannot resume from snapshot: {error}{Style.RESET_ALL}")
+            return -1
+    else:
+        machine = Machine(program, memory=memory, output=OUTPUT)
+    if BITS is not None:
+        from assembly_fixed import wrap_machine
+        wrap_machine(machine, BITS)
+
+    # Run the common prefix and capture the state it leaves behind
+    if SAVE_SNAPSHOT is not None:
+        from assembly_snapshot import take_snapshot
+        machine.run(SNAPSHOT_AT)
+        try:
+            take_snapshot(machine).save(SAVE_SNAPSHOT)
+        except OSError as error:
+            print(f"{Fore.RED}Error: Cannot save snapshot: {error}{Style.RESET_ALL}")
+            return -1
 
-        # jmp jumps the line counter to the function/routine provided without storing the old location
-        elif command == 'jmp':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            line_counter = label_lines[label]
-            continue  # Skip incrementing line_counter
-
-        # call jumps the line counter to the function/routine provided while storing the previous one
-        elif command == 'call':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            prev_lines.append(line_counter)
-            line_counter = label_lines[label]
-            continue  # Skip incrementing line_counter
-
-        # ret returns the line counter to the previous line before a routine was called
-        elif command == 'ret':
-            if not prev_lines:
-                print(f"{Fore.RED}Error: 'ret' with empty call stack at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            line_counter = prev_lines.pop()
-
-        # cmp stores both values for the next jump comparison
-        elif command == 'cmp':
-            one, two = other
-            compare = [get_value(one, registers),
-                      get_value(two, registers)]
-
-        # je jumps to function/routine if the comparison is ==
-        elif command == 'je':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] == compare[1]:
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # ce call to function/routine if the comparison is ==
-        elif command == 'ce':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] == compare[1]:
-                prev_lines.append(line_counter)
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # jne jumps to function/routine if the comparison is !=
-        elif command == 'jne':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] != compare[1]:
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # cne call to function/routine if the comparison is !=
-        elif command == 'cne':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] != compare[1]:
-                prev_lines.append(line_counter)
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # jge jumps to function/routine if the the comparison is >=
-        elif command == 'jge':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] >= compare[1]:
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # cne call to function/routine if the comparison is >=
-        elif command == 'cge':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] >= compare[1]:
-                prev_lines.append(line_counter)
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # jg jumps to function/routine if the the comparison is >
-        elif command == 'jg':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] > compare[1]:
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # cne call to function/routine if the comparison is >
-        elif command == 'cg':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] > compare[1]:
-                prev_lines.append(line_counter)
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # jle jumps to function/routine if the comparison is <=
-        elif command == 'jle':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] <= compare[1]:
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # cne call to function/routine if the comparison is <=
-        elif command == 'cle':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] <= compare[1]:
-                prev_lines.append(line_counter)
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # jl jumps to function/routine if the comparison is <
-        elif command == 'jl':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] < compare[1]:
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # cne call to function/routine if the comparison is <
-        elif command == 'cl':
-            label = other[0]
-            if label not in label_lines:
-                print(f"{Fore.RED}Error: Unknown label '{label}' at line {line_counter}{Style.RESET_ALL}")
-                return -1
-            if compare[0] < compare[1]:
-                prev_lines.append(line_counter)
-                line_counter = label_lines[label]
-                continue  # Skip incrementing line_counter
-
-        # stw stores a value at a memory address
-        elif command == 'stw':
-            value, address = other
-            address = get_address(address, registers)
-            memory[address] = get_value(value, registers)
-
-        # mvw takes a value from a memory address and stores it in a register
-        elif command == 'mvw':
-            register, address = other
-            address = get_address(address, registers)
-            registers[register] = memory.get(address, 0)  # Default to 0 if address not in memory
-
-        # msg stores the return output of the program
-        elif command == 'msg':
-            parts = []
-            i = 0
-            while i < len(other):
-                part = other[i]
-                if part.startswith("'") and not part.endswith("'"):
-                    # Handle multi-part strings
-                    full_str = [part[1:]]  # Remove opening quote
-                    i += 1
-                    while i < len(other) and not other[i].endswith("'"):
-                        full_str.append(other[i])
-                        i += 1
-                    if i < len(other):
-                        full_str.append(other[i][:-1])  # Remove closing quote
-                    parts.append(' '.join(full_str))
-                elif part.startswith("'") and part.endswith("'"):
-                    # Handle complete quoted strings
-                    parts.append(part[1:-1])
-                elif part == '\\n':
-                    # Handle newlines
-                    parts.append('\n')
-                elif part in registers:
-                    # Handle register values
-                    parts.append(str(registers[part]))
-                else:
-                    # Handle other text
-                    parts.append(part)
-                i += 1
-            
-            message = ''.join(parts)
-            return_code += message
-            
-            if not message.endswith('\n'):
-                return_code += '\n'  # Ensure each msg ends with a newline
+    # Only the debug view, profiling and an explicit trace file pay for tracing
+    profiling = PROFILE or PROFILE_COLLAPSED is not None
+    if profiling:
+        from assembly_profiler import Profiler
+        machine.tracer = Profiler(machine)
+    elif TRACE is not None:
+        from assembly_tracing import open_trace
+        machine.tracer = open_trace(program, TRACE)
+    elif DEBUG and not interactive:
+        from assembly_tracing import ExecutionTrace
+        machine.tracer = ExecutionTrace(program)
 
-            # Display message immediately in step mode
-            if STEP_MODE or DEBUG:
-                print(f"\n{Fore.MAGENTA}Output: {message}{Style.RESET_ALL}")
-        
+    try:
+        if interactive:
+            from assembly_debugger import run_debugger
+            try:
+                run_debugger(machine, BREAKPOINTS, WATCHES, STEP_MODE)
+            except ValueError as error:
+                print(f"{Fore.RED}Error: {error}{Style.RESET_ALL}")
+                return -1
+        elif DEBUG:
+            run_debug(machine, DELAY)
+        elif COMPILE and machine.tracer is None and machine.pc == 0 and machine.status is None:
+            from assembly_compiler import compile_program
+            compile_program(program).run(machine)
         else:
-            print(f"{Fore.RED}Error: Unknown command '{command}' at line {line_counter}{Style.RESET_ALL}")
-            return -1
+            machine.run()
+    finally:
+        if machine.tracer is not None:
+            machine.tracer.close()
+        machine.output_sink.close()
+
+    if profiling:
+        report_profile(machine.tracer, PROFILE, PROFILE_COLLAPSED)
+
+    if memo is not None:
+        stats = memo.stats()
+        print(f"{Fore.CYAN}Memoized calls: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} hit rate), {stats['evictions']} evictions{Style.RESET_ALL}")
+
+    if machine.status is None:
+        # Only quitting the debugger leaves a program unfinished
+        print(f"{Fore.YELLOW}Program execution aborted at line {program.line_of(machine.pc)}{Style.RESET_ALL}")
+        return -1
 
-        line_counter += 1
+    if machine.status == 'error':
+        position = machine.program.position_of(machine.pc)
+        where = f" (file line {position})" if position is not None else ""
+        path = machine.program.file_of(machine.pc)
+        if position is not None and path is not None and path != machine.program.files[0][1] \
+                and not machine.error.endswith(f" of {path}"):
+            where = f" (file line {position} of {path})"
+        print(f"{Fore.RED}Error: {machine.error}{where}{Style.RESET_ALL}")
+        return -1
 
-        # Catches programs that terminate incorrectly
-        if line_counter >= len(program):
-            print(f"{Fore.RED}Error: Program reached end without 'end' statement{Style.RESET_ALL}")
+    if SAVE_MEMORY is not None:
+        try:
+            machine.memory.save_image(SAVE_MEMORY)
+        except (OSError, ValueError) as error:
+            print(f"{Fore.RED}Error: Cannot save memory image: {error}{Style.RESET_ALL}")
             return -1
 
     # Final program state
-    if STEP_MODE or DEBUG:
+    if DEBUG or interactive:
         clear_screen()
         print(f"{Fore.GREEN}=== Program Execution Complete ==={Style.RESET_ALL}")
         print(f"\n{Fore.CYAN}Final Register Values:{Style.RESET_ALL}")
-        for reg_name, reg_value in sorted(registers.items()):
+        for reg_name, reg_value in sorted(machine.registers_dict().items()):
             print(f"  {reg_name}: {reg_value}")
         
         print(f"\n{Fore.CYAN}Final Output:{Style.RESET_ALL}")
-        print(f"{return_code}")
+        print(f"{machine.output}")
         
-        print(f"\n{Fore.YELLOW}Program executed in {step_counter} steps{Style.RESET_ALL}")
+        print(f"\n{Fore.YELLOW}Program executed in {machine.steps} steps{Style.RESET_ALL}")
         
         if STEP_MODE:
             input(f"{Fore.YELLOW}Press Enter to exit...{Style.RESET_ALL}")
 
-    return return_code
+    return machine.output
+
+
+def warn_ignored(flags, reason):
+    """Warns that the given (flag, given) flags are ignored because of reason, if any"""
+    names = [flag for flag, given in flags if given]
+    if names and reason is not None:
+        verb = 'is' if len(names) == 1 else 'are'
+        print(f"{Fore.YELLOW}Warning: {' and '.join(names)} {verb} ignored with {reason}{Style.RESET_ALL}")
+
+
+def report_profile(profiler, PROFILE=True, PROFILE_COLLAPSED=None):
+    """Prints the profile of a run and writes its collapsed stacks to a file"""
+
+    if PROFILE:
+        print(f"{Fore.CYAN}=== Profile ==={Style.RESET_ALL}")
+        print(profiler.report())
+        print(f"\n{Fore.CYAN}Annotated source (count, time ms):{Style.RESET_ALL}")
+        print(profiler.annotate())
+        print()
+
+    if PROFILE_COLLAPSED is not None:
+        with open(PROFILE_COLLAPSED, 'w') as collapsed:
+            collapsed.write(profiler.collapsed() + '\n')
+
+
+def run_debug(machine, DELAY=0.3, screen=None):
+    """Runs a machine one instruction at a time, redrawing its state before each one"""
+
+    from assembly_debugger import Screen, render_state
+    from assembly_tracing import ExecutionTrace
+
+    program = machine.program
+    screen = Screen() if screen is None else screen
+
+    while machine.status is None:
+        record = program.code[machine.pc]
+
+        # Label lines and the end of the program are passed without stopping
+        if record[0] in (OP_LABEL, OP_END, OP_EXIT, OP_FALLOFF):
+            machine.step()
+            continue
+
+        # Show the last 5 operations along with the state
+        history = machine.tracer.history(5) if isinstance(machine.tracer, ExecutionTrace) else None
+        screen.draw(render_state(machine, f"Assembly Interpreter - Step {machine.steps + 1}", history=history))
+        time.sleep(DELAY)
+        machine.step()
 
 
 def clear_screen():
     """Clears the terminal screen"""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    from assembly_debugger import CLEAR
+    print(CLEAR, end='', flush=True)
 
 
 def display_help():
@@ -404,8 +247,32 @@ def display_help():
     print(f"\n{Fore.YELLOW}Options:{Style.RESET_ALL}")
     print("  -h, --help     Show this help message")
     print("  -d, --debug    Run in debug mode (shows program state)")
-    print("  -s, --step     Run in step mode (pause after each instruction)")
+    print("  -s, --step     Debug interactively, starting at the first instruction")
     print("  --delay=N      Set delay between instructions in debug mode (seconds)")
+    print("  -c, --compile  Compile the program to Python code before running it")
+    print("  -O, --optimize Fold constants and fuse compare-and-branch instructions")
+    print("  --verify-opt   Check the optimized program against the plain one first")
+    print("  --no-fast-loops  Run counted loops one instruction at a time")
+    print("  --verify       Check the whole program for errors before running it")
+    print("  --jit          Compile hot loops to Python as the program runs")
+    print("  --memo         Cache calls to subroutines that never print")
+    print("  --bits=N       Use N-bit integers that wrap around (32 or 64)")
+    print("  --save-snapshot=FILE  Save the machine state to FILE, then keep running")
+    print("  --snapshot-at=N  Take the snapshot after N instructions (default: at the end)")
+    print("  --resume=FILE  Start from a saved snapshot instead of the beginning")
+    print("  --break=LOC    Stop at a line number or label (repeatable; runs the debugger)")
+    print("  --watch=TARGET Stop when a register or [address] changes (repeatable)")
+    print("  --trace=FILE   Write a trace of every executed instruction to FILE")
+    print("  --memory=FILE  Load memory from an image file before running")
+    print("  --save-memory=FILE  Save memory to an image file after running")
+    print("  --profile      Print per-line and per-label counts, times and the call graph")
+    print("  --profile-collapsed=FILE  Write collapsed call stacks for flame graph tools")
+    print("  --stream       Print output as the program produces it")
+    print("  --output=FILE  Write the program output to FILE as it is produced")
+    print("  --no-cache     Parse the program without using the compiled-program cache")
+    print("  --cache-dir=D  Keep compiled programs in directory D")
+    print("  --warm-cache   Compile the program and its includes into the cache without running it")
+    print("  --clear-cache  Delete every compiled program from the cache")
     
     print(f"\n{Fore.YELLOW}Commands:{Style.RESET_ALL}")
     print("  mov reg, val    Move value to register")
@@ -429,6 +296,7 @@ def display_help():
     print("  mvw reg, addr   Move value from memory to register")
     print("  msg ...         Output message")
     print("  end             End program")
+    print("  include file    Link in another .asm file, found next to this one")
     
     print(f"\n{Fore.YELLOW}Examples:{Style.RESET_ALL}")
     print("  assembly_interpreter.py test.asm")
@@ -438,12 +306,21 @@ def display_help():
 
 if __name__ == '__main__':
     # Initialize colorama for cross-platform color support
+    import colorama
     colorama.init(autoreset=True)
+    from assembly_cache import clear_cache
+    from assembly_linker import load_linked, warm_objects
     
     # Parse command line arguments
     if len(argv) < 2 or argv[1] in ['-h', '--help']:
         display_help()
         exit(0)
+
+    if argv[1] == '--clear-cache':
+        cache_dirs = [arg.split('=', 1)[1] for arg in argv[2:] if arg.startswith('--cache-dir=')]
+        removed = clear_cache(cache_dirs[-1] if cache_dirs else None)
+        print(f"{Fore.GREEN}Removed {removed} cached programs{Style.RESET_ALL}")
+        exit(0)
     
     assembly_file = argv[1]
     
@@ -451,12 +328,89 @@ if __name__ == '__main__':
     DEBUG = False
     STEP_MODE = False
     DELAY = 0.3
+    COMPILE = False
+    TRACE = None
+    MEMORY = None
+    SAVE_MEMORY = None
+    USE_CACHE = True
+    CACHE_DIR = None
+    WARM_CACHE = False
+    STREAM = False
+    OUTPUT_FILE = None
+    PROFILE = False
+    PROFILE_COLLAPSED = None
+    OPTIMIZE = False
+    VERIFY_OPT = False
+    FAST_LOOPS = True
+    VERIFY = False
+    JIT = False
+    MEMO = False
+    BITS = None
+    SNAPSHOT_AT = None
+    SAVE_SNAPSHOT = None
+    RESUME = None
+    BREAKPOINTS = []
+    WATCHES = []
     
     for arg in argv[2:]:
         if arg in ['-d', '--debug']:
             DEBUG = True
         elif arg in ['-s', '--step']:
             STEP_MODE = True
+        elif arg in ['-c', '--compile']:
+            COMPILE = True
+        elif arg in ['-O', '--optimize']:
+            OPTIMIZE = True
+        elif arg == '--verify-opt':
+            VERIFY_OPT = True
+        elif arg == '--no-fast-loops':
+            FAST_LOOPS = False
+        elif arg == '--verify':
+            VERIFY = True
+        elif arg == '--jit':
+            JIT = True
+        elif arg == '--memo':
+            MEMO = True
+        elif arg.startswith('--save-snapshot='):
+            SAVE_SNAPSHOT = arg.split('=', 1)[1]
+        elif arg.startswith('--break='):
+            BREAKPOINTS.append(arg.split('=', 1)[1])
+        elif arg.startswith('--watch='):
+            WATCHES.append(arg.split('=', 1)[1])
+        elif arg.startswith('--resume='):
+            RESUME = arg.split('=', 1)[1]
+        elif arg.startswith('--snapshot-at='):
+            try:
+                SNAPSHOT_AT = int(arg.split('=', 1)[1])
+            except ValueError:
+                print(f"{Fore.RED}Error: Invalid snapshot step count{Style.RESET_ALL}")
+                exit(1)
+        elif arg.startswith('--trace='):
+            TRACE = arg.split('=', 1)[1]
+        elif arg == '--profile':
+            PROFILE = True
+        elif arg.startswith('--profile-collapsed='):
+            PROFILE_COLLAPSED = arg.split('=', 1)[1]
+        elif arg == '--stream':
+            STREAM = True
+        elif arg.startswith('--output='):
+            OUTPUT_FILE = arg.split('=', 1)[1]
+        elif arg == '--no-cache':
+            USE_CACHE = False
+        elif arg.startswith('--cache-dir='):
+            CACHE_DIR = arg.split('=', 1)[1]
+        elif arg == '--warm-cache':
+            WARM_CACHE = True
+        elif arg.startswith('--memory='):
+            MEMORY = arg.split('=', 1)[1]
+        elif arg.startswith('--save-memory='):
+            SAVE_MEMORY = arg.split('=', 1)[1]
+        elif arg.startswith('--bits='):
+            try:
+                BITS = int(arg.split('=', 1)[1])
+            except ValueError:
+                print(f"{Fore.RED}Error: Invalid integer width{Style.RESET_ALL}")
+                exit(1)
         elif arg.startswith('--delay='):
             try:
                 DELAY = float(arg.split('=')[1])
@@ -465,17 +419,50 @@ if __name__ == '__main__':
                 exit(1)
     
     try:
-        with open(assembly_file) as program:
-            print(f"{Fore.GREEN}Loading program: {assembly_file}{Style.RESET_ALL}")
-            output = assembler_interpreter(program.read(), DEBUG=DEBUG, STEP_MODE=STEP_MODE, DELAY=DELAY)
-            
-            if output == -1:
-                print(f"{Fore.RED}Program execution failed{Style.RESET_ALL}")
+        if WARM_CACHE:
+            try:
+                compiled = warm_objects([assembly_file], CACHE_DIR)
+            except ProgramError as error:
+                print(f"{Fore.RED}Error: {error}{Style.RESET_ALL}")
                 exit(1)
-            
-            if not (DEBUG or STEP_MODE):
-                print(f"{Fore.GREEN}Program Output:{Style.RESET_ALL}")
-                print(output)
+            for path in compiled:
+                print(f"{Fore.GREEN}Cached {path}{Style.RESET_ALL}")
+            exit(0)
+
+        print(f"{Fore.GREEN}Loading program: {assembly_file}{Style.RESET_ALL}")
+        try:
+            program = load_linked(assembly_file, CACHE_DIR, USE_CACHE)
+        except ProgramError as error:
+            print(f"{Fore.RED}Error: {error}{Style.RESET_ALL}")
+            print(f"{Fore.RED}Program execution failed{Style.RESET_ALL}")
+            exit(1)
+
+        OUTPUT = None
+        if OUTPUT_FILE is not None:
+            OUTPUT = open_sink(OUTPUT_FILE)
+        elif STREAM and not (DEBUG or STEP_MODE):
+            print(f"{Fore.GREEN}Program Output:{Style.RESET_ALL}")
+            OUTPUT = StreamSink()
+
+        try:
+            output = assembler_interpreter(program, DEBUG=DEBUG, STEP_MODE=STEP_MODE, DELAY=DELAY, COMPILE=COMPILE, TRACE=TRACE,
+                                           MEMORY=MEMORY, SAVE_MEMORY=SAVE_MEMORY, OUTPUT=OUTPUT,
+                                           PROFILE=PROFILE, PROFILE_COLLAPSED=PROFILE_COLLAPSED,
+                                           OPTIMIZE=OPTIMIZE, VERIFY_OPT=VERIFY_OPT, FAST_LOOPS=FAST_LOOPS,
+                                           VERIFY=VERIFY, JIT=JIT, MEMO=MEMO,
+                                           SNAPSHOT_AT=SNAPSHOT_AT, SAVE_SNAPSHOT=SAVE_SNAPSHOT, RESUME=RESUME,
+                                           BREAKPOINTS=BREAKPOINTS, WATCHES=WATCHES, BITS=BITS)
+        finally:
+            if OUTPUT_FILE is not None:
+                OUTPUT.stream.close()
+        
+        if output == -1:
+            print(f"{Fore.RED}Program execution failed{Style.RESET_ALL}")
+            exit(1)
+        
+        if not (DEBUG or STEP_MODE or BREAKPOINTS or WATCHES or OUTPUT):
+            print(f"{Fore.GREEN}Program Output:{Style.RESET_ALL}")
+            print(output)
             
     except FileNotFoundError:
         print(f"{Fore.RED}Error: File '{assembly_file}' not found.{Style.RESET_ALL}")
@@ -0,0 +1,174 @@
+from assembly_compiler import CONDITIONS, CONDITIONAL_JUMPS, CompiledProgram, _Emitter
+from assembly_decoder import *
+from assembly_fixed import WRAPPED
+from assembly_machine import HANDLERS, Halt, MachineError
+
+# Times a loop head must run before the loop is traced
+HOT_THRESHOLD = 50
+
+# Longest path a trace may record, in records
+MAX_TRACE = 1000
+
+# Failed recordings of a loop before its head stops counting
+MAX_ABORTS = 3
+
+# Records a trace may contain. Calls, returns and anything that ends the
+# program leave the loop, so recording stops at them.
+TRACEABLE = frozenset((
+    OP_LABEL, OP_MOV_RR, OP_MOV_RI, OP_INC, OP_DEC,
+    OP_ADD_RR, OP_ADD_RI, OP_SUB_RR, OP_SUB_RI, OP_MUL_RR, OP_MUL_RI, OP_DIV_RR, OP_DIV_RI,
+    OP_CMP_RR, OP_CMP_RI, OP_CMP_IR, OP_CMP_II, OP_JMP,
+    OP_STW_RR, OP_STW_RC, OP_STW_IR, OP_STW_IC, OP_MVW_R, OP_MVW_C, OP_MSG,
+)) | frozenset(CONDITIONAL_JUMPS) | frozenset(WRAPPED)
+
+
+class Trace(CompiledProgram):
+    """One iteration of a hot loop compiled to a Python function. The
+    function repeats the recorded path with registers in locals, and leaves
+    through a guard as soon as a branch goes the other way."""
+
+    def __init__(self, program, source, function, lines, path):
+        super().__init__(program, source, function, lines)
+        self.path = path  # the recorded lines, starting at the loop head
+
+    def run(self, machine):
+        """Runs the trace from the loop head. Returns the line to continue at"""
+        try:
+            return self.function(machine)
+        except (MachineError, TypeError) as error:
+            # Nothing was written by the failing record, so the interpreter
+            # runs it again and reports the error itself
+            pc = self._failing_line(error.__traceback__)
+            if pc is None:
+                raise
+            machine.steps += self.path.index(pc)
+            return pc
+
+
+def compile_trace(program, path):
+    """Compiles a recorded loop path into a Trace"""
+
+    emitter = _Emitter(program)
+    register_list = ', '.join(emitter.register(slot) for slot in range(len(program.register_names)))
+
+    emitter.line(0, 'def trace(machine):')
+    if register_list:
+        emitter.line(1, f'{register_list}, = machine.registers')
+    emitter.line(1, 'load = machine.memory.load')
+    emitter.line(1, 'store = machine.memory.store')
+    emitter.line(1, 'cmp0, cmp1 = machine.compare')
+    emitter.line(1, 'emit = machine.emit')
+    emitter.line(1, 'steps = 0')
+    emitter.line(1, 'try:')
+    emitter.line(2, 'while True:')
+
+    code = program.code
+    for index, pc in enumerate(path):
+        op, target = code[pc][:2]
+        if op in CONDITIONAL_JUMPS:
+            if target == pc + 1:
+                continue
+            # Guard the direction the branch took while recording
+            taken = path[(index + 1) % len(path)] == target
+            test = f'cmp0 {CONDITIONS[op]} cmp1'
+            emitter.line(3, f'if not ({test}):' if taken else f'if {test}:', pc)
+            emitter.line(4, f'steps += {index + 1}')
+            emitter.line(4, f'return {pc + 1 if taken else target}')
+        elif op != OP_JMP:
+            emitter.instruction(pc, 3)
+    emitter.line(3, f'steps += {len(path)}')
+
+    # The dispatch loop counts the loop head record itself
+    emitter.line(1, 'finally:')
+    if register_list:
+        emitter.line(2, f'machine.registers[:] = {register_list},')
+    emitter.line(2, 'machine.compare = [cmp0, cmp1]')
+    emitter.line(2, 'machine.steps += steps - 1')
+
+    source = '\n'.join(emitter.lines) + '\n'
+    namespace = {'Halt': Halt, 'MachineError': MachineError}
+    exec(compile(source, '<trace>', 'exec'), namespace)
+    return Trace(program, source, namespace['trace'], emitter.origins, path)
+
+
+class TracingJit:
+    """Runs a program in the interpreter, counting how often each loop head
+    runs. When a loop gets hot, the path one iteration takes is recorded and
+    compiled into a Trace, which then runs in place of the loop head.
+
+    Loop heads are labels that a jump later in the program jumps back to.
+    The JIT works on a patched copy of the program, so cold code runs
+    exactly as before."""
+
+    def __init__(self, program, threshold=HOT_THRESHOLD):
+        self.original = program
+        self.code = list(program.code)
+        self.program = Program(program.source, self.code, program.labels, program.register_names,
+                               program.lines, program.positions, program.files)
+        self.threshold = threshold
+        self.counts = dict()   # loop head -> times run since its last recording
+        self.aborts = dict()   # loop head -> failed recordings
+        self.traces = dict()   # loop head -> Trace
+
+        for i, (op, target, b, c) in enumerate(self.code):
+            if (op == OP_JMP or op in CONDITIONAL_JUMPS) and target <= i and self.code[target][0] == OP_LABEL:
+                self.code[target] = (OP_HOT, self, None, None)
+
+    def record(self, machine, head):
+        """Runs one iteration of the loop at head in the interpreter, noting
+        each line it runs, and compiles it if it comes back to head. Returns
+        the line to continue at"""
+
+        code = self.original.code
+        path, seen = [], set()
+        pc = head
+        try:
+            while code[pc][0] in TRACEABLE and pc not in seen and len(path) < MAX_TRACE:
+                path.append(pc)
+                seen.add(pc)
+                op, a, b, c = code[pc]
+                pc = HANDLERS[op](machine, a, b, c, pc)
+                if pc == head:
+                    break
+        except (MachineError, TypeError):
+            # The failing record runs again in the interpreter, which reports the error
+            path.pop()
+
+        # The dispatch loop counts the loop head record itself
+        machine.steps += len(path) - 1
+        if pc == head:
+            trace = self.traces[head] = compile_trace(self.original, path)
+            self.code[head] = (OP_TRACE, trace, None, None)
+        else:
+            self.counts[head] = 0
+            self.aborts[head] = self.aborts.get(head, 0) + 1
+            if self.aborts[head] >= MAX_ABORTS:
+                self.code[head] = code[head]
+        return pc
+
+
+def _op_hot(machine, jit, b, c, pc):
+    # Traced and step-limited runs execute every instruction
+    if machine.tracer is None and machine.step_limit is None:
+        count = jit.counts[pc] = jit.counts.get(pc, 0) + 1
+        if count >= jit.threshold:
+            return jit.record(machine, pc)
+    return pc + 1
+
+def _op_trace(machine, trace, b, c, pc):
+    if machine.tracer is None and machine.step_limit is None:
+        return trace.run(machine)
+    return pc + 1
+
+
+OP_HOT = len(HANDLERS)
+HANDLERS.append(_op_hot)
+OP_TRACE = len(HANDLERS)
+HANDLERS.append(_op_trace)
+
+
+def enable_jit(program, threshold=HOT_THRESHOLD):
+    """Returns a copy of a decoded program whose hot loops are traced and
+    compiled as it runs. The program must not be optimized, since traces
+    are built from plain instruction records."""
+    return TracingJit(program, threshold).program
@@ -0,0 +1,232 @@
+import marshal
+import os
+from array import array
+
+from assembly_cache import OBJECT_SUFFIX, cache_dir, dump_program, file_cache_key, read_lines, store, touch, \
+    undump_program, written_key
+from assembly_decoder import *
+from assembly_helpers import parse_int, process_line
+
+# Operands of each record that are register slots, renumbered when linking
+REGISTERS = {
+    OP_MOV_RR: (0, 1), OP_MOV_RI: (0,), OP_INC: (0,), OP_DEC: (0,),
+    OP_ADD_RR: (0, 1), OP_ADD_RI: (0,), OP_SUB_RR: (0, 1), OP_SUB_RI: (0,),
+    OP_MUL_RR: (0, 1), OP_MUL_RI: (0,), OP_DIV_RR: (0, 1), OP_DIV_RI: (0,),
+    OP_CMP_RR: (0, 1), OP_CMP_RI: (0,), OP_CMP_IR: (1,),
+    OP_STW_RR: (0, 1), OP_STW_RC: (0,), OP_STW_IR: (1,), OP_MVW_R: (0, 1), OP_MVW_C: (0,),
+}
+
+
+class ObjectModule:
+    """One .asm file decoded on its own, to be linked with the files it
+    includes. Its records use the module's own register slots and lines.
+    Jumps to its own labels are listed in relocations, jumps to labels it
+    doesn't define keep the label name and are listed in imports."""
+
+    def __init__(self, path, program, includes, written, literals, relocations, imports):
+        self.path = path
+        self.program = program
+        self.includes = includes        # included file names, relative to this file
+        self.written = written          # register names the module writes
+        self.literals = literals        # msg words decoded as text
+        self.relocations = relocations  # lines of jumps to the module's own labels
+        self.imports = imports          # (line, label) of jumps to other modules
+
+    @property
+    def exports(self):
+        """The labels the module defines, by name"""
+        return self.program.labels
+
+
+def compile_module(path, directory=None, use_cache=True, written=()):
+    """Decodes a single .asm file into an ObjectModule, through the object
+    cache unless use_cache is False. Names in written are decoded as
+    registers, as other modules write them."""
+
+    with open(path) as source:
+        if use_cache:
+            key = written_key(file_cache_key(source), written)
+            entry = os.path.join(cache_dir(directory), key + OBJECT_SUFFIX)
+            module = read_object(entry, path)
+            if module is not None:
+                return module
+            source.seek(0)
+        includes = []
+        program, names, literals = decode_module(_strip_includes(read_lines(source), includes, path), written)
+
+    code = program.code
+    jumps = [i for i, record in enumerate(code) if record[0] in JUMP_OPCODES]
+    module = ObjectModule(path, program, tuple(includes), frozenset(names), frozenset(literals),
+                          tuple(i for i in jumps if type(code[i][1]) is int),
+                          tuple((i, code[i][1]) for i in jumps if type(code[i][1]) is str))
+    if use_cache:
+        try:
+            store(entry, dump_object(module))
+        except OSError:
+            pass  # An unwritable cache only costs the next run its parse
+    return module
+
+
+def _strip_includes(lines, includes, path):
+    """Passes lines through, blanking 'include file' lines and noting the files"""
+    for number, line in enumerate(lines, 1):
+        if 'include' in line:
+            tokens = process_line(line)
+            if tokens is not None and tokens[0] == 'include':
+                if len(tokens) != 2:
+                    raise ProgramError(f"Invalid include at line {number} of {path}")
+                includes.append(tokens[1].strip("'\""))
+                line = ''
+        yield line
+
+
+def dump_object(module):
+    """Serializes an object module to bytes"""
+    return marshal.dumps((dump_program(module.program), module.includes, tuple(module.written),
+                          tuple(module.literals), module.relocations, module.imports))
+
+
+def read_object(entry, path):
+    """Returns the object module of the file at path cached at entry, or
+    None if there is no usable one"""
+    try:
+        with open(entry, 'rb') as cached:
+            program, includes, written, literals, relocations, imports = marshal.loads(cached.read())
+        program = undump_program(program)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None  # Missing or unreadable entries are simply rebuilt
+    if program is None:
+        return None
+    touch(entry)
+    return ObjectModule(path, program, includes, frozenset(written), frozenset(literals), relocations, imports)
+
+
+def load_modules(path, directory=None, use_cache=True):
+    """Returns the object modules of a file and of every file it includes,
+    directly or not, each once, in the order they are first included. Only
+    files that changed since they were last cached are decoded."""
+
+    modules, seen = [], set()
+    pending = [(os.path.abspath(path), None)]  # (file, module including it)
+    while pending:
+        path, parent = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            module = compile_module(path, directory, use_cache)
+        except OSError as error:
+            if parent is None:
+                raise
+            raise ProgramError(f"Cannot include '{path}' from {parent.path}: {error.strerror}")
+        modules.append(module)
+        directory_of = os.path.dirname(path)
+        pending.extend((os.path.join(directory_of, name), module) for name in reversed(module.includes))
+    return modules
+
+
+def link(modules, directory=None, use_cache=True, written=()):
+    """Combines object modules into one Program, laid out in order, so the
+    first module is where execution starts. Jumps to a label defined in the
+    same module stay there; jumps to other modules go to the only module
+    that defines the label. Registers are shared by name across modules, and
+    names in written are registers too, such as ones preset before the run.
+    Modules that must be decoded again go through the cache in directory."""
+
+    # A msg word or integer-looking operand is a register in every module if
+    # any module writes to it, so modules that guessed otherwise are redone
+    modules = list(modules)
+    written = frozenset(written).union(*(module.written for module in modules))
+    for n, module in enumerate(modules):
+        external = {name for name in written - module.written
+                    if name in module.literals or parse_int(name) is not None}
+        if external:
+            modules[n] = compile_module(module.path, directory, use_cache, external)
+
+    bases, base = [], 0
+    for module in modules:
+        bases.append(base)
+        base += len(module.program)
+    definitions = dict()  # label -> lines defining it, in link order
+    for module, base in zip(modules, bases):
+        for label, line in module.exports.items():
+            definitions.setdefault(label, []).append(base + line)
+
+    source, code, slots = [], [], dict()
+    positions = array('i')
+    for module, base in zip(modules, bases):
+        program = module.program
+        mapping = [slots.setdefault(name, len(slots)) for name in program.register_names]
+        records = _relocate(program.code, base, mapping, module.relocations)
+        for i, label in module.imports:
+            targets = definitions.get(label, ())
+            if len(targets) == 1:
+                records[i] = (records[i][0], targets[0], None, None)
+            elif targets:
+                records[i] = (OP_ERROR, f"Label '{label}' is defined in several modules at line {base + i}", None, None)
+            else:
+                records[i] = (OP_ERROR, f"Unknown label '{label}' at line {base + i}", None, None)
+        if module is not modules[0]:
+            # Errors found in an included file name the file
+            for i, (op, message, b, c) in enumerate(records):
+                if op == OP_ERROR:
+                    records[i] = (op, f"{message} of {module.path}", b, c)
+        source.extend(program.source)
+        code.extend(records)
+        if program.positions is not None:
+            positions.extend(program.positions)
+
+    if not any(record[0] == OP_END for record in code):
+        raise ProgramError("No 'end' statement found in program")
+
+    # Skipping a label on the last line ends the program normally, while any
+    # other instruction running past the last line is an error
+    if code[-1][0] == OP_LABEL:
+        code[-1] = (OP_EXIT, None, None, None)
+    code.append((OP_FALLOFF, "Program reached end without 'end' statement", None, None))
+
+    labels = {label: lines[0] for label, lines in definitions.items()}
+    files = tuple((base, module.path) for module, base in zip(modules, bases))
+    return Program(tuple(source), code, labels, list(slots), positions=positions, files=files)
+
+
+def _relocate(code, base, mapping, relocations):
+    """Returns a module's records with its lines moved by base and its
+    register slots renumbered through mapping"""
+
+    records = list(code)
+    if mapping != list(range(len(mapping))):
+        for i, (op, a, b, c) in enumerate(records):
+            indices = REGISTERS.get(op)
+            if indices is not None:
+                operands = [a, b, c]
+                for index in indices:
+                    operands[index] = mapping[operands[index]]
+                records[i] = (op, *operands)
+            elif op == OP_MSG:
+                segments = tuple((None if slot is None else mapping[slot], text) for slot, text in a)
+                records[i] = (op, segments, b, c)
+    if base:
+        for i in relocations:
+            op, target, b, c = records[i]
+            records[i] = (op, target + base, b, c)
+        # Errors found while decoding name the module's own line
+        for i, (op, message, b, c) in enumerate(records):
+            if op == OP_ERROR:
+                records[i] = (op, message.replace(f" at line {i}", f" at line {base + i}", 1), b, c)
+    return records
+
+
+def load_linked(path, directory=None, use_cache=True, written=()):
+    """Reads an assembly file and the files it includes, and links them.
+    Names in written are registers, such as ones preset before the run."""
+    return link(load_modules(path, directory, use_cache), directory, use_cache, written)
+
+
+def warm_objects(paths, directory=None):
+    """Compiles the given assembly files and everything they include into
+    the object cache, returning the files compiled"""
+    compiled = []
+    for path in paths:
+        compiled.extend(module.path for module in load_modules(path, directory))
+    return compiled
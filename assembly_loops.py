@@ -0,0 +1,186 @@
+from assembly_decoder import *
+from assembly_machine import HANDLERS
+
+# Body instructions a counted loop may contain, all of the form reg += delta
+LINEAR = (OP_INC, OP_DEC, OP_ADD_RI, OP_SUB_RI, OP_ADD_RR, OP_SUB_RR, OP_LABEL)
+
+# Conditional jumps that can close a counted loop
+BACK_EDGES = (OP_JE, OP_JNE, OP_JG, OP_JGE, OP_JL, OP_JLE)
+
+
+class CountedLoop:
+    """A loop of the form
+
+        head:
+            <inc, dec, add and sub of registers by constants or by registers
+             the loop never writes>
+            cmp counter, limit
+            jcc head
+
+    whose iterations can be computed in closed form. Every register the body
+    writes changes by the same amount on every iteration."""
+
+    def __init__(self, length, deltas, sources, counter, limit, limit_is_register, jump):
+        self.length = length                        # records per iteration, head and jump included
+        self.deltas = deltas                        # register -> constant change per iteration
+        self.sources = sources                      # register -> ((source, sign), ...) added per iteration
+        self.counter = counter
+        self.limit = limit
+        self.limit_is_register = limit_is_register
+        self.jump = jump
+
+    def iterations(self, start, step, limit):
+        """Returns how many iterations run when the counter starts at start and
+        changes by step each time, or None if the loop never exits"""
+
+        jump = self.jump
+        # The body always runs once before the first comparison
+        if not _holds(jump, start + step, limit):
+            return 1
+        if jump == OP_JE:
+            return 2  # step is never 0, so two iterations can't both hit limit
+        if jump == OP_JNE:
+            distance = limit - start
+            if distance % step or distance // step < 1:
+                return None
+            return distance // step
+        if jump == OP_JL and step > 0:
+            return -((start - limit) // step)
+        if jump == OP_JLE and step > 0:
+            return (limit - start) // step + 1
+        if jump == OP_JG and step < 0:
+            return -((limit - start) // -step)
+        if jump == OP_JGE and step < 0:
+            return (start - limit) // -step + 1
+        return None  # the counter moves away from the exit
+
+    def run(self, machine):
+        """Runs every iteration at once. Returns False, leaving the machine
+        untouched, if a register is unset or not an integer"""
+
+        registers = machine.registers
+        values = {}
+        for register in self.deltas:
+            value = registers[register]
+            if type(value) is not int:
+                return False
+            values[register] = value
+
+        steps = dict(self.deltas)
+        for register, sources in self.sources.items():
+            for source, sign in sources:
+                value = registers[source]
+                if type(value) is not int:
+                    return False
+                steps[register] += sign * value
+
+        limit = registers[self.limit] if self.limit_is_register else self.limit
+        if type(limit) is not int:
+            return False
+        step = steps[self.counter]
+        if not step:
+            return False
+        count = self.iterations(values[self.counter], step, limit)
+        if count is None:
+            return False
+
+        for register, value in values.items():
+            registers[register] = value + count * steps[register]
+        machine.compare = [registers[self.counter], limit]
+        # The run loop counts the head itself
+        machine.steps += count * self.length - 1
+        return True
+
+
+def _holds(jump, one, two):
+    if jump == OP_JE:
+        return one == two
+    if jump == OP_JNE:
+        return one != two
+    if jump == OP_JG:
+        return one > two
+    if jump == OP_JGE:
+        return one >= two
+    if jump == OP_JL:
+        return one < two
+    return one <= two
+
+
+def _op_loop(machine, exit, loop, c, pc):
+    # Traced and step-limited runs execute every instruction, so traces stay
+    # complete and a run pauses exactly where it was asked to
+    if machine.tracer is None and machine.step_limit is None and loop.run(machine):
+        return exit
+    return pc + 1
+
+
+OP_LOOP = len(HANDLERS)
+HANDLERS.append(_op_loop)
+
+
+def find_loop(code, head):
+    """Returns the CountedLoop whose head label is at index head, or None"""
+
+    deltas, sources = {}, {}
+    jump = head + 1
+    while jump < len(code) and code[jump][0] in LINEAR:
+        op, register, value = code[jump][:3]
+        if op != OP_LABEL:
+            deltas.setdefault(register, 0)
+            sources.setdefault(register, ())
+            if op == OP_INC:
+                deltas[register] += 1
+            elif op == OP_DEC:
+                deltas[register] -= 1
+            elif op == OP_ADD_RI:
+                deltas[register] += value
+            elif op == OP_SUB_RI:
+                deltas[register] -= value
+            else:
+                sources[register] += ((value, 1 if op == OP_ADD_RR else -1),)
+        jump += 1
+
+    # The loop must close with cmp counter, limit; jcc head
+    compare = jump
+    jump += 1
+    if jump >= len(code) or code[compare][0] not in (OP_CMP_RI, OP_CMP_RR):
+        return None
+    if code[jump][0] not in BACK_EDGES or code[jump][1] != head:
+        return None
+    op, counter, limit = code[compare][:3]
+    if counter not in deltas:
+        return None
+    limit_is_register = op == OP_CMP_RR
+
+    # Added registers and a register limit must stay fixed for the whole loop
+    used = {source for added in sources.values() for source, sign in added}
+    if limit_is_register:
+        used.add(limit)
+    if used & deltas.keys():
+        return None
+
+    sources = {register: added for register, added in sources.items() if added}
+    return CountedLoop(jump - head + 1, deltas, sources, counter, limit, limit_is_register, code[jump][0])
+
+
+def accelerate_loops(program):
+    """Returns a copy of a decoded program whose counted loops run in closed
+    form. Their head labels become OP_LOOP records, which fall back to
+    running the loop normally whenever the closed form does not apply.
+    Output, registers, memory and step counts are unchanged."""
+
+    code = list(program.code)
+    heads = {target for op, target, b, c in code if op in BACK_EDGES}
+    loops = 0
+    for head in sorted(heads):
+        if code[head][0] != OP_LABEL:
+            continue
+        loop = find_loop(code, head)
+        if loop is not None:
+            exit = head + loop.length
+            code[head] = (OP_LOOP, exit, loop, None)
+            loops += 1
+    if not loops:
+        return program
+    return Program(program.source, code, program.labels, program.register_names, program.lines,
+                   program.positions, program.files)
@@ -0,0 +1,437 @@
+from assembly_decoder import *
+from assembly_memory import PagedMemory
+from assembly_output import BufferSink
+from itertools import repeat
+
+
+class Halt(Exception):
+    """Raised by an instruction to stop the machine"""
+
+
+class MachineError(Halt):
+    """Raised by an instruction when the program fails at run time"""
+
+
+class Pause(Exception):
+    """Raised by an instruction to stop a run early. The machine resumes at
+    pc, and steps instructions are counted as run before stopping"""
+
+    def __init__(self, pc, steps=0):
+        super().__init__(pc, steps)
+        self.pc = pc
+        self.steps = steps
+
+
+class Machine:
+    """Executes a decoded Program through the opcode dispatch table"""
+
+    def __init__(self, program, registers=None, memory=None, output=None):
+        self.program = program
+        self.register_file = program.new_registers()
+        self.registers = self.register_file.values  # the flat buffer instructions use
+        if registers:
+            self.register_file.load(registers)
+        self.memory = memory if isinstance(memory, PagedMemory) else PagedMemory(memory)
+        self.stack = []
+        self.compare = [0, 0]
+        self.output_sink = BufferSink() if output is None else output
+        self.emit = self.output_sink.write  # called with each message
+        self.pc = 0
+        self.steps = 0
+        self.status = None  # None while running, then 'end' or 'error'
+        self.error = None
+        self.tracer = None  # an ExecutionTrace recording every instruction run
+        self.step_limit = None  # the max_steps of the current run
+
+    @property
+    def output(self):
+        """The output collected so far, if the sink keeps it"""
+        return self.output_sink.getvalue()
+
+    def registers_dict(self):
+        """Returns the assigned registers by name"""
+        return self.register_file.dump()
+
+    def render_message(self, segments):
+        """Builds the text of a msg instruction from its decoded segments"""
+        registers = self.registers
+        parts = []
+        for slot, text in segments:
+            if slot is None:
+                parts.append(text)
+            else:
+                value = registers[slot]
+                parts.append(text if value is None else str(value))
+        return ''.join(parts)
+
+    def run(self, max_steps=None):
+        """Runs the program until it ends or fails, or for at most max_steps
+        instructions. Returns the status, which is None if it can resume"""
+
+        if self.status is not None:
+            return self.status
+        if self.tracer is not None:
+            return self._run_traced(max_steps)
+
+        self.step_limit = max_steps
+        code = self.program.code
+        handlers = HANDLERS
+        pc = self.pc
+        steps = 0
+        try:
+            for _ in repeat(None) if max_steps is None else repeat(None, max_steps):
+                op, a, b, c = code[pc]
+                pc = handlers[op](self, a, b, c, pc)
+                steps += 1
+            self.pc = pc
+        except Pause as pause:
+            self.pc = pause.pc
+            steps += pause.steps
+        except Halt as halt:
+            if code[pc][0] == OP_EXIT:
+                steps += 1  # Skipping the final label still counts as a step
+            self._halt(halt, pc)
+        except TypeError:
+            self._halt(MachineError(self._unassigned_message(pc)), pc)
+        finally:
+            self.steps += steps
+        return self.status
+
+    def _run_traced(self, max_steps=None):
+        """Same as run, recording each instruction other than labels in the tracer"""
+
+        if self.status is not None:
+            return self.status
+        self.step_limit = max_steps
+        code = self.program.code
+        handlers = HANDLERS
+        record = self.tracer.record
+        pc = self.pc
+        steps = self.steps
+        try:
+            for _ in repeat(None) if max_steps is None else repeat(None, max_steps):
+                op, a, b, c = code[pc]
+                if op != OP_LABEL:
+                    record(steps + 1, pc)
+                pc = handlers[op](self, a, b, c, pc)
+                steps += 1
+            self.pc = pc
+        except Pause as pause:
+            self.pc = pause.pc
+            steps += pause.steps
+        except Halt as halt:
+            if code[pc][0] == OP_EXIT:
+                steps += 1  # Skipping the final label still counts as a step
+            self._halt(halt, pc)
+        except TypeError:
+            self._halt(MachineError(self._unassigned_message(pc)), pc)
+        finally:
+            self.steps = steps
+        return self.status
+
+    def step(self):
+        """Executes a single instruction"""
+
+        if self.status is not None:
+            return self.status
+        self.step_limit = 1
+        pc = self.pc
+        op, a, b, c = self.program.code[pc]
+        if self.tracer is not None and op != OP_LABEL:
+            self.tracer.record(self.steps + 1, pc)
+        try:
+            self.pc = HANDLERS[op](self, a, b, c, pc)
+            self.steps += 1
+        except Pause as pause:
+            self.pc = pause.pc
+            self.steps += pause.steps
+        except Halt as halt:
+            if op == OP_EXIT:
+                self.steps += 1
+            self._halt(halt, pc)
+        except TypeError:
+            self._halt(MachineError(self._unassigned_message(pc)), pc)
+        return self.status
+
+    def _halt(self, halt, pc):
+        self.pc = pc
+        if isinstance(halt, MachineError):
+            self.status, self.error = 'error', str(halt)
+        else:
+            self.status = 'end'
+
+    def _unassigned_message(self, pc):
+        """Names the register that made the instruction at pc fail"""
+        slots = self.program.register_slots
+        line = self.program.line_of(pc)
+        for token in self.program.source[line][1:]:
+            if token in slots and self.registers[slots[token]] is None:
+                return f"Register '{token}' used before assignment at line {line}"
+        return f"Invalid operands for '{self.program.source[line][0]}' at line {line}"
+
+
+def _unassigned(machine, slot, pc):
+    line = machine.program.line_of(pc)
+    return MachineError(f"Register '{machine.program.register_names[slot]}' used before assignment at line {line}")
+
+
+# Instruction handlers. Each takes the machine, the three operands of the
+# record and the current line, and returns the next line to execute.
+
+def _op_end(machine, a, b, c, pc):
+    raise Halt
+
+def _op_error(machine, message, b, c, pc):
+    raise MachineError(message)
+
+def _op_label(machine, a, b, c, pc):
+    return pc + 1
+
+def _op_mov_rr(machine, register, source, c, pc):
+    value = machine.registers[source]
+    if value is None:
+        raise _unassigned(machine, source, pc)
+    machine.registers[register] = value
+    return pc + 1
+
+def _op_mov_ri(machine, register, value, c, pc):
+    machine.registers[register] = value
+    return pc + 1
+
+def _op_inc(machine, register, b, c, pc):
+    machine.registers[register] += 1
+    return pc + 1
+
+def _op_dec(machine, register, b, c, pc):
+    machine.registers[register] -= 1
+    return pc + 1
+
+def _op_add_rr(machine, register, source, c, pc):
+    registers = machine.registers
+    registers[register] += registers[source]
+    return pc + 1
+
+def _op_add_ri(machine, register, value, c, pc):
+    machine.registers[register] += value
+    return pc + 1
+
+def _op_sub_rr(machine, register, source, c, pc):
+    registers = machine.registers
+    registers[register] -= registers[source]
+    return pc + 1
+
+def _op_sub_ri(machine, register, value, c, pc):
+    machine.registers[register] -= value
+    return pc + 1
+
+def _op_mul_rr(machine, register, source, c, pc):
+    registers = machine.registers
+    registers[register] *= registers[source]
+    return pc + 1
+
+def _op_mul_ri(machine, register, value, c, pc):
+    machine.registers[register] *= value
+    return pc + 1
+
+def _op_div_rr(machine, register, source, c, pc):
+    registers = machine.registers
+    divisor = registers[source]
+    if divisor == 0:
+        raise MachineError(f"Division by zero at line {machine.program.line_of(pc)}")
+    registers[register] //= divisor
+    return pc + 1
+
+def _op_div_ri(machine, register, value, c, pc):
+    machine.registers[register] //= value
+    return pc + 1
+
+def _op_jmp(machine, target, b, c, pc):
+    return target
+
+def _op_call(machine, target, b, c, pc):
+    machine.stack.append(pc)
+    return target
+
+def _op_ret(machine, a, b, c, pc):
+    if not machine.stack:
+        raise MachineError(f"'ret' with empty call stack at line {machine.program.line_of(pc)}")
+    return machine.stack.pop() + 1
+
+def _op_cmp_rr(machine, left, right, c, pc):
+    registers = machine.registers
+    one, two = registers[left], registers[right]
+    if one is None:
+        raise _unassigned(machine, left, pc)
+    if two is None:
+        raise _unassigned(machine, right, pc)
+    machine.compare = [one, two]
+    return pc + 1
+
+def _op_cmp_ri(machine, left, right, c, pc):
+    one = machine.registers[left]
+    if one is None:
+        raise _unassigned(machine, left, pc)
+    machine.compare = [one, right]
+    return pc + 1
+
+def _op_cmp_ir(machine, left, right, c, pc):
+    two = machine.registers[right]
+    if two is None:
+        raise _unassigned(machine, right, pc)
+    machine.compare = [left, two]
+    return pc + 1
+
+def _op_cmp_ii(machine, left, right, c, pc):
+    machine.compare = [left, right]
+    return pc + 1
+
+def _op_je(machine, target, b, c, pc):
+    one, two = machine.compare
+    return target if one == two else pc + 1
+
+def _op_jne(machine, target, b, c, pc):
+    one, two = machine.compare
+    return target if one != two else pc + 1
+
+def _op_jg(machine, target, b, c, pc):
+    one, two = machine.compare
+    return target if one > two else pc + 1
+
+def _op_jge(machine, target, b, c, pc):
+    one, two = machine.compare
+    return target if one >= two else pc + 1
+
+def _op_jl(machine, target, b, c, pc):
+    one, two = machine.compare
+    return target if one < two else pc + 1
+
+def _op_jle(machine, target, b, c, pc):
+    one, two = machine.compare
+    return target if one <= two else pc + 1
+
+def _op_ce(machine, target, b, c, pc):
+    one, two = machine.compare
+    if one == two:
+        machine.stack.append(pc)
+        return target
+    return pc + 1
+
+def _op_cne(machine, target, b, c, pc):
+    one, two = machine.compare
+    if one != two:
+        machine.stack.append(pc)
+        return target
+    return pc + 1
+
+def _op_cg(machine, target, b, c, pc):
+    one, two = machine.compare
+    if one > two:
+        machine.stack.append(pc)
+        return target
+    return pc + 1
+
+def _op_cge(machine, target, b, c, pc):
+    one, two = machine.compare
+    if one >= two:
+        machine.stack.append(pc)
+        return target
+    return pc + 1
+
+def _op_cl(machine, target, b, c, pc):
+    one, two = machine.compare
+    if one < two:
+        machine.stack.append(pc)
+        return target
+    return pc + 1
+
+def _op_cle(machine, target, b, c, pc):
+    one, two = machine.compare
+    if one <= two:
+        machine.stack.append(pc)
+        return target
+    return pc + 1
+
+def _op_stw_rr(machine, source, base, offset, pc):
+    registers = machine.registers
+    value = registers[source]
+    if value is None:
+        raise _unassigned(machine, source, pc)
+    machine.memory.store(int(registers[base]) + offset, value)
+    return pc + 1
+
+def _op_stw_rc(machine, source, address, c, pc):
+    value = machine.registers[source]
+    if value is None:
+        raise _unassigned(machine, source, pc)
+    machine.memory.store(address, value)
+    return pc + 1
+
+def _op_stw_ir(machine, value, base, offset, pc):
+    machine.memory.store(int(machine.registers[base]) + offset, value)
+    return pc + 1
+
+def _op_stw_ic(machine, value, address, c, pc):
+    machine.memory.store(address, value)
+    return pc + 1
+
+def _op_mvw_r(machine, register, base, offset, pc):
+    registers = machine.registers
+    registers[register] = machine.memory.load(int(registers[base]) + offset)
+    return pc + 1
+
+def _op_mvw_c(machine, register, address, c, pc):
+    machine.registers[register] = machine.memory.load(address)
+    return pc + 1
+
+def _op_msg(machine, segments, b, c, pc):
+    message = machine.render_message(segments)
+    if not message.endswith('\n'):
+        message += '\n'  # Ensure each msg ends with a newline
+    machine.emit(message)
+    return pc + 1
+
+
+HANDLERS = [None] * OPCODE_COUNT
+HANDLERS[OP_END] = _op_end
+HANDLERS[OP_EXIT] = _op_end
+HANDLERS[OP_FALLOFF] = _op_error
+HANDLERS[OP_ERROR] = _op_error
+HANDLERS[OP_LABEL] = _op_label
+HANDLERS[OP_MOV_RR] = _op_mov_rr
+HANDLERS[OP_MOV_RI] = _op_mov_ri
+HANDLERS[OP_INC] = _op_inc
+HANDLERS[OP_DEC] = _op_dec
+HANDLERS[OP_ADD_RR] = _op_add_rr
+HANDLERS[OP_ADD_RI] = _op_add_ri
+HANDLERS[OP_SUB_RR] = _op_sub_rr
+HANDLERS[OP_SUB_RI] = _op_sub_ri
+HANDLERS[OP_MUL_RR] = _op_mul_rr
+HANDLERS[OP_MUL_RI] = _op_mul_ri
+HANDLERS[OP_DIV_RR] = _op_div_rr
+HANDLERS[OP_DIV_RI] = _op_div_ri
+HANDLERS[OP_JMP] = _op_jmp
+HANDLERS[OP_CALL] = _op_call
+HANDLERS[OP_RET] = _op_ret
+HANDLERS[OP_CMP_RR] = _op_cmp_rr
+HANDLERS[OP_CMP_RI] = _op_cmp_ri
+HANDLERS[OP_CMP_IR] = _op_cmp_ir
+HANDLERS[OP_CMP_II] = _op_cmp_ii
+HANDLERS[OP_JE] = _op_je
+HANDLERS[OP_JNE] = _op_jne
+HANDLERS[OP_JG] = _op_jg
+HANDLERS[OP_JGE] = _op_jge
+HANDLERS[OP_JL] = _op_jl
+HANDLERS[OP_JLE] = _op_jle
+HANDLERS[OP_CE] = _op_ce
+HANDLERS[OP_CNE] = _op_cne
+HANDLERS[OP_CG] = _op_cg
+HANDLERS[OP_CGE] = _op_cge
+HANDLERS[OP_CL] = _op_cl
+HANDLERS[OP_CLE] = _op_cle
+HANDLERS[OP_STW_RR] = _op_stw_rr
+HANDLERS[OP_STW_RC] = _op_stw_rc
+HANDLERS[OP_STW_IR] = _op_stw_ir
+HANDLERS[OP_STW_IC] = _op_stw_ic
+HANDLERS[OP_MVW_R] = _op_mvw_r
+HANDLERS[OP_MVW_C] = _op_mvw_c
+HANDLERS[OP_MSG] = _op_msg
@@ -0,0 +1,270 @@
+from collections import OrderedDict
+from operator import eq, ne, gt, ge, lt, le
+
+from assembly_decoder import *
+from assembly_fixed import WRAPPED
+from assembly_loops import OP_LOOP
+from assembly_machine import HANDLERS, Halt
+from assembly_verifier import OP_RETURN
+
+# Cached calls kept before the least recently used one is evicted
+MEMO_SIZE = 4096
+
+# Memoized calls that may be in progress inside each other. Deeper calls
+# run as plain calls, so deep recursion doesn't exhaust the Python stack.
+MAX_NESTING = 100
+
+# Conditional calls and the comparison each one tests
+CALL_TESTS = {OP_CE: eq, OP_CNE: ne, OP_CG: gt, OP_CGE: ge, OP_CL: lt, OP_CLE: le}
+CALLS = (OP_CALL,) + tuple(CALL_TESTS)
+BRANCHES = (OP_JE, OP_JNE, OP_JG, OP_JGE, OP_JL, OP_JLE)
+
+# Which operands of each record are registers read and written
+READS = {
+    OP_MOV_RR: (1,), OP_INC: (0,), OP_DEC: (0,),
+    OP_ADD_RR: (0, 1), OP_ADD_RI: (0,), OP_SUB_RR: (0, 1), OP_SUB_RI: (0,),
+    OP_MUL_RR: (0, 1), OP_MUL_RI: (0,), OP_DIV_RR: (0, 1), OP_DIV_RI: (0,),
+    OP_CMP_RR: (0, 1), OP_CMP_RI: (0,), OP_CMP_IR: (1,),
+    OP_STW_RR: (0, 1), OP_STW_RC: (0,), OP_STW_IR: (1,), OP_MVW_R: (1,),
+}
+WRITES = {
+    OP_MOV_RR: (0,), OP_MOV_RI: (0,), OP_INC: (0,), OP_DEC: (0,),
+    OP_ADD_RR: (0,), OP_ADD_RI: (0,), OP_SUB_RR: (0,), OP_SUB_RI: (0,),
+    OP_MUL_RR: (0,), OP_MUL_RI: (0,), OP_DIV_RR: (0,), OP_DIV_RI: (0,),
+    OP_MVW_R: (0,), OP_MVW_C: (0,),
+}
+# Fixed-width records use the operands of the records they replace
+READS.update({op: READS[plain] for op, (plain, bits) in WRAPPED.items() if plain in READS})
+WRITES.update({op: WRITES[plain] for op, (plain, bits) in WRAPPED.items()})
+
+# Records that use the compare values, and ones that only pass control on
+COMPARES = (OP_CMP_RR, OP_CMP_RI, OP_CMP_IR, OP_CMP_II, OP_LOOP) + BRANCHES + tuple(CALL_TESTS)
+MEMORY = (OP_STW_RR, OP_STW_RC, OP_STW_IR, OP_STW_IC, OP_MVW_R, OP_MVW_C)
+PLAIN = (OP_LABEL, OP_JMP, OP_CALL, OP_RET, OP_RETURN, OP_END, OP_EXIT, OP_ERROR, OP_FALLOFF)
+
+
+class Routine:
+    """What a subroutine, and everything it calls, can read and write.
+
+    A routine is pure if it never prints. Its result then only depends on
+    the registers it touches, the compare values if it uses them, and the
+    memory cells it reads, so a call can be cached on those and replayed."""
+
+    def __init__(self, entry, reads, writes, compare, memory, impure=None):
+        self.entry = entry        # line of the routine's label
+        self.reads = reads        # register slots it may read
+        self.writes = writes      # register slots it may write
+        self.compare = compare    # whether it uses or sets the compare values
+        self.memory = memory      # whether it loads or stores memory
+        self.impure = impure      # why it can't be memoized, or None
+        self.slots = tuple(sorted(reads | writes))
+
+    @property
+    def pure(self):
+        return self.impure is None
+
+    def key(self, machine):
+        """Returns the values a call's result depends on, other than memory"""
+        registers = machine.registers
+        values = tuple([registers[slot] for slot in self.slots])
+        if self.compare:
+            return values + tuple(machine.compare)
+        return values
+
+
+def analyze_routine(program, entry):
+    """Returns the Routine starting at the line entry, following every path
+    through it and through whatever it calls up to each ret"""
+
+    code = program.code
+    reads, writes = set(), set()
+    compare = memory = False
+    impure = None
+    seen = set()
+    pending = [entry]
+    while pending:
+        pc = pending.pop()
+        if pc in seen:
+            continue
+        seen.add(pc)
+        op, a, b, c = code[pc]
+        operands = (a, b, c)
+
+        if op == OP_MSG:
+            impure = impure or f"prints at line {program.line_of(pc)}"
+        elif op == OP_LOOP:
+            reads.update(b.deltas)
+            reads.update(source for added in b.sources.values() for source, sign in added)
+            if b.limit_is_register:
+                reads.add(b.limit)
+            writes.update(b.deltas)
+        elif op not in READS and op not in WRITES and op not in COMPARES and op not in MEMORY \
+                and op not in PLAIN:
+            impure = impure or f"has an unsupported record at line {program.line_of(pc)}"
+            continue
+        reads.update(operands[i] for i in READS.get(op, ()))
+        writes.update(operands[i] for i in WRITES.get(op, ()))
+        compare = compare or op in COMPARES
+        memory = memory or op in MEMORY
+
+        if op in (OP_RET, OP_RETURN, OP_END, OP_EXIT, OP_ERROR, OP_FALLOFF):
+            continue
+        if op == OP_JMP:
+            pending.append(a)
+            continue
+        if op in CALLS or op in BRANCHES or op == OP_LOOP:
+            pending.append(a)
+        pending.append(pc + 1)
+
+    return Routine(entry, reads, writes, compare, memory, impure)
+
+
+def analyze_routines(program):
+    """Returns the Routine of every line the program calls, by line"""
+    entries = {a for op, a, b, c in program.code if op in CALLS}
+    return {entry: analyze_routine(program, entry) for entry in sorted(entries)}
+
+
+class _RecordingMemory:
+    """Passes loads and stores through to the machine's memory during a
+    cached call, noting the cells it read before writing and its writes"""
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.reads = {}
+        self.writes = {}
+
+    def load(self, address):
+        if address in self.writes:
+            return self.writes[address]
+        value = self.memory.load(address)
+        self.reads.setdefault(address, value)
+        return value
+
+    def store(self, address, value):
+        self.memory.store(address, value)
+        self.writes[address] = value
+
+
+class Memo:
+    """Caches calls to pure subroutines in a bounded LRU cache.
+
+    A call is keyed on the routine and the values of the registers and
+    compare values it touches. The first call runs normally, noting the
+    memory cells it read and the ones it wrote. A later call with the same
+    key whose memory cells still hold the same values skips the routine:
+    its registers, compare values and memory writes are replayed and its
+    step count is added, so the machine ends up exactly as if it had run.
+    Calls that fail or end the program are never cached."""
+
+    def __init__(self, program, size=MEMO_SIZE):
+        self.original = program
+        self.size = size
+        self.routines = analyze_routines(program)
+        self.cache = OrderedDict()  # (entry, key) -> (reads, registers, compare, writes, steps)
+        self.nesting = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        code = list(program.code)
+        for i, (op, target, b, c) in enumerate(code):
+            if op in CALLS and self.routines[target].pure:
+                code[i] = (OP_MEMO_CALL, target, self, op)
+        self.program = Program(program.source, code, program.labels, program.register_names,
+                               program.lines, program.positions, program.files)
+
+    def stats(self):
+        """Returns the cache hits, misses, evictions, size and hit rate"""
+        calls = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.cache), 'hit_rate': self.hits / calls if calls else 0.0}
+
+    def call(self, machine, routine, pc):
+        """Runs the call at pc to routine from the cache, or runs it and
+        caches it. Returns the line to continue at"""
+
+        key = (routine.entry, routine.key(machine))
+        entry = self.cache.get(key)
+        if entry is not None:
+            reads, registers, compare, writes, steps = entry
+            memory = machine.memory
+            if all(memory.load(address) == value for address, value in reads):
+                self.cache.move_to_end(key)
+                self.hits += 1
+                values = machine.registers
+                for slot, value in zip(routine.slots, registers):
+                    values[slot] = value
+                if compare is not None:
+                    machine.compare = list(compare)
+                for address, value in writes:
+                    memory.store(address, value)
+                # The dispatch loop counts the call itself
+                machine.steps += steps - 1
+                return pc + 1
+
+        self.misses += 1
+        return self._record(machine, routine, pc, key)
+
+    def _record(self, machine, routine, pc, key):
+        """Runs a call in a dispatch loop of its own until it returns"""
+
+        stack = machine.stack
+        depth = len(stack)
+        stack.append(pc)
+        code = machine.program.code
+        handlers = HANDLERS
+        memory = machine.memory = _RecordingMemory(machine.memory)
+        skipped = machine.steps  # steps handlers add on top of the ones run here
+        steps = 1  # the call
+        next_pc = routine.entry
+        self.nesting += 1
+        try:
+            while len(stack) > depth:
+                op, a, b, c = code[next_pc]
+                next_pc = handlers[op](machine, a, b, c, next_pc)
+                steps += 1
+        except (Halt, TypeError):
+            # Nothing was written by the failing record, so the dispatch loop
+            # runs it again and reports the error or end itself
+            machine.steps += steps - 1
+            return next_pc
+        finally:
+            self.nesting -= 1
+            # A call nested in another one is recorded by both, since its
+            # loads and stores go through the outer call's recording memory
+            machine.memory = memory.memory
+
+        steps += machine.steps - skipped
+        registers = machine.registers
+        compare = tuple(machine.compare) if routine.compare else None
+        self.cache[key] = (tuple(memory.reads.items()), tuple([registers[slot] for slot in routine.slots]),
+                           compare, tuple(memory.writes.items()), steps)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+        machine.steps = skipped + steps - 1
+        return next_pc
+
+
+def _op_memo_call(machine, target, memo, op, pc):
+    if op != OP_CALL:
+        one, two = machine.compare
+        if not CALL_TESTS[op](one, two):
+            return pc + 1
+    # Traced and step-limited runs execute every instruction
+    if machine.tracer is not None or machine.step_limit is not None or memo.nesting >= MAX_NESTING:
+        machine.stack.append(pc)
+        return target
+    return memo.call(machine, memo.routines[target], pc)
+
+
+OP_MEMO_CALL = len(HANDLERS)
+HANDLERS.append(_op_memo_call)
+
+
+def enable_memo(program, size=MEMO_SIZE):
+    """Returns a Memo for a decoded, unoptimized program. Its program
+    attribute is the copy whose calls to pure subroutines are cached."""
+    return Memo(program, size)
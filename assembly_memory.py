@@ -0,0 +1,165 @@
+import mmap
+import struct
+import sys
+from array import array
+
+# Memory is split into pages of PAGE_SIZE cells, each allocated on first touch
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+# Memory images start with this header, followed by the index of every page
+# and then the cells of every page, all as little-endian 64-bit integers
+IMAGE_MAGIC = b'ASMMEM01'
+IMAGE_HEADER = struct.Struct('<8sqq')  # magic, page bits, page count
+
+
+class PagedMemory:
+    """Word-addressed memory made of pages of 64-bit cells. Untouched cells
+    read as 0. A page holding a value too wide for 64 bits is widened to a
+    list, so arbitrary-precision values still round-trip exactly."""
+
+    def __init__(self, cells=None):
+        self.pages = dict()   # page index -> array('q') or list
+        self._image = None    # an mmap'd image whose pages load on first touch
+        self._image_pages = dict()
+        if cells:
+            for address, value in cells.items():
+                self.store(address, value)
+
+    def load(self, address):
+        """Returns the value stored at an address"""
+        page = self.pages.get(address >> PAGE_BITS)
+        if page is None:
+            page = self._page_from_image(address >> PAGE_BITS)
+            if page is None:
+                return 0
+        return page[address & PAGE_MASK]
+
+    def store(self, address, value):
+        """Stores a value at an address"""
+        index = address >> PAGE_BITS
+        page = self.pages.get(index)
+        if page is None:
+            page = self.new_page(index)
+        try:
+            page[address & PAGE_MASK] = value
+        except OverflowError:
+            page = self.pages[index] = list(page)
+            page[address & PAGE_MASK] = value
+
+    def new_page(self, index):
+        """Allocates the page with the given index, filled from the image if it has it"""
+        page = self._page_from_image(index)
+        if page is None:
+            page = self.pages[index] = array('q', bytes(8 * PAGE_SIZE))
+        return page
+
+    def _page_from_image(self, index):
+        offset = self._image_pages.pop(index, None)
+        if offset is None:
+            return None
+        page = array('q')
+        page.frombytes(self._image[offset:offset + 8 * PAGE_SIZE])
+        if sys.byteorder == 'big':
+            page.byteswap()
+        self.pages[index] = page
+        return page
+
+    def _materialize(self):
+        """Loads every page still only present in the image"""
+        for index in list(self._image_pages):
+            self._page_from_image(index)
+
+    def items(self):
+        """Returns the non-zero cells as sorted (address, value) pairs"""
+        self._materialize()
+        cells = []
+        for index in sorted(self.pages):
+            base = index << PAGE_BITS
+            cells.extend((base + i, value) for i, value in enumerate(self.pages[index]) if value)
+        return cells
+
+    def head(self, count):
+        """Returns the first count non-zero cells as (address, value) pairs,
+        only reading pages up to the last one needed"""
+        cells = []
+        for index in sorted(self.pages.keys() | self._image_pages.keys()):
+            page = self.pages.get(index)
+            if page is None:
+                page = self._page_from_image(index)
+            base = index << PAGE_BITS
+            for i, value in enumerate(page):
+                if value:
+                    cells.append((base + i, value))
+                    if len(cells) == count:
+                        return cells
+        return cells
+
+    def __len__(self):
+        return len(self.items())
+
+    def __bool__(self):
+        return bool(self._image_pages) or any(any(page) for page in self.pages.values())
+
+    def copy(self):
+        """Returns an independent copy of the memory"""
+        self._materialize()
+        memory = PagedMemory()
+        memory.pages = {index: page[:] for index, page in self.pages.items()}
+        return memory
+
+    def save_image(self, path):
+        """Writes every allocated page to a binary memory image"""
+
+        self._materialize()
+        indices = sorted(self.pages)
+        for index in indices:
+            if isinstance(self.pages[index], list):
+                raise ValueError(f"Memory page {index} holds values wider than 64 bits")
+
+        with open(path, 'wb') as image:
+            image.write(IMAGE_HEADER.pack(IMAGE_MAGIC, PAGE_BITS, len(indices)))
+            table = array('q', indices)
+            if sys.byteorder == 'big':
+                table.byteswap()
+            image.write(table.tobytes())
+            for index in indices:
+                page = self.pages[index]
+                if sys.byteorder == 'big':
+                    page = page[:]
+                    page.byteswap()
+                image.write(page.tobytes())
+
+    def load_image(self, path):
+        """Maps a binary memory image. Its pages replace the ones already
+        allocated and are only copied in when the program first touches them"""
+
+        with open(path, 'rb') as image:
+            size = image.seek(0, 2)
+            if size < IMAGE_HEADER.size:
+                raise ValueError(f"'{path}' is not a memory image")
+            self._image = mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, page_bits, count = IMAGE_HEADER.unpack_from(self._image)
+        if magic != IMAGE_MAGIC or page_bits != PAGE_BITS:
+            raise ValueError(f"'{path}' is not a memory image")
+        if size != IMAGE_HEADER.size + 8 * count * (1 + PAGE_SIZE):
+            raise ValueError(f"Memory image '{path}' is truncated")
+
+        table = array('q')
+        table.frombytes(self._image[IMAGE_HEADER.size:IMAGE_HEADER.size + 8 * count])
+        if sys.byteorder == 'big':
+            table.byteswap()
+
+        data = IMAGE_HEADER.size + 8 * count
+        for n, index in enumerate(table):
+            self.pages.pop(index, None)
+            self._image_pages[index] = data + 8 * PAGE_SIZE * n
+
+
+def open_image(path):
+    """Returns a PagedMemory backed by a memory image file"""
+    memory = PagedMemory()
+    memory.load_image(path)
+    return memory
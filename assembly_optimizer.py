@@ -0,0 +1,241 @@
+from operator import eq, ne, gt, ge, lt, le
+
+from assembly_decoder import *
+from assembly_fixed import WRAPPED
+from assembly_loops import OP_LOOP
+from assembly_machine import HANDLERS, Machine, _unassigned
+from assembly_memory import PagedMemory
+from assembly_output import BufferSink
+from assembly_verifier import OP_RETURN
+
+# Conditional jumps and the comparison each one tests
+CONDITIONS = {OP_JE: eq, OP_JNE: ne, OP_JG: gt, OP_JGE: ge, OP_JL: lt, OP_JLE: le}
+
+# Instructions that write the register in their first operand
+WRITES = (OP_MOV_RR, OP_MOV_RI, OP_INC, OP_DEC, OP_ADD_RR, OP_ADD_RI, OP_SUB_RR, OP_SUB_RI,
+          OP_MUL_RR, OP_MUL_RI, OP_DIV_RR, OP_DIV_RI, OP_MVW_R, OP_MVW_C) + tuple(WRAPPED)
+
+# Instructions that may leave straight-line execution
+CONTROL = (OP_END, OP_EXIT, OP_FALLOFF, OP_ERROR, OP_LABEL, OP_LOOP, OP_JMP, OP_CALL, OP_RET,
+           OP_RETURN) + tuple(JUMPS.values())
+
+# Instructions whose first operand is a jump target
+TARGETS = tuple(JUMPS.values()) + (OP_LOOP,)
+
+# Arithmetic with a register operand, mapped to its immediate form
+IMMEDIATE_FORMS = {OP_ADD_RR: OP_ADD_RI, OP_SUB_RR: OP_SUB_RI, OP_MUL_RR: OP_MUL_RI, OP_DIV_RR: OP_DIV_RI}
+
+
+# Superinstructions. A fused record replaces the first of the records it
+# covers, which stay in place behind it so that jumps into the middle of a
+# fused sequence still land on the original instruction.
+
+def _compare_jump_rr(test):
+    # cmp reg, reg; jcc target -> (op, left, right, target)
+    def handler(machine, left, right, target, pc):
+        registers = machine.registers
+        one, two = registers[left], registers[right]
+        if one is None:
+            raise _unassigned(machine, left, pc)
+        if two is None:
+            raise _unassigned(machine, right, pc)
+        machine.compare = [one, two]
+        return target if test(one, two) else pc + 2
+    return handler
+
+def _compare_jump_ri(test):
+    # cmp reg, imm; jcc target -> (op, left, right, target)
+    def handler(machine, left, right, target, pc):
+        one = machine.registers[left]
+        if one is None:
+            raise _unassigned(machine, left, pc)
+        machine.compare = [one, right]
+        return target if test(one, right) else pc + 2
+    return handler
+
+def _step_jump(delta, test):
+    # inc/dec reg; cmp reg, imm; jcc target -> (op, reg, imm, target)
+    def handler(machine, register, right, target, pc):
+        registers = machine.registers
+        one = registers[register] + delta
+        registers[register] = one
+        machine.compare = [one, right]
+        return target if test(one, right) else pc + 3
+    return handler
+
+
+def _add_superinstructions(factory):
+    """Appends one handler per condition to the dispatch table and returns
+    {conditional jump opcode: fused opcode}"""
+    opcodes = {}
+    for jump, test in CONDITIONS.items():
+        opcodes[jump] = len(HANDLERS)
+        HANDLERS.append(factory(test))
+    return opcodes
+
+CMP_RR_JUMPS = _add_superinstructions(_compare_jump_rr)
+CMP_RI_JUMPS = _add_superinstructions(_compare_jump_ri)
+INC_JUMPS = _add_superinstructions(lambda test: _step_jump(1, test))
+DEC_JUMPS = _add_superinstructions(lambda test: _step_jump(-1, test))
+
+
+def optimize_program(program):
+    """Returns a copy of a decoded program rewritten for the interpreter:
+    constant registers are folded into their uses, label records are
+    dropped and common compare-and-branch sequences are fused. Output,
+    registers and memory are unchanged; the step count is lower since fewer
+    records run. The result maps its records back to source lines for error
+    messages, but only the interpreter can run it, not the compiler."""
+
+    code = propagate_constants(program)
+    code, labels, lines = drop_labels(program, code)
+    code = fuse(code)
+    return Program(program.source, code, labels, program.register_names, lines, program.positions, program.files)
+
+
+def propagate_constants(program):
+    """Returns the records with constant registers replaced by immediates.
+
+    A register is constant if its only write is a mov of an immediate that
+    runs before the first label or jump. Records after that mov always see
+    its value; records before it run once, before the register is set, so
+    they keep reading the register."""
+
+    code = list(program.code)
+    writes = [0] * len(program.register_names)
+    for op, a, b, c in code:
+        if op in WRITES:
+            writes[a] += 1
+
+    definitions = {}  # line of each constant's mov -> (register, value)
+    for i, (op, a, b, c) in enumerate(code):
+        if op in CONTROL:
+            break
+        if op == OP_MOV_RI and writes[a] == 1:
+            definitions[i] = (a, b)
+    if not definitions:
+        return code
+
+    constants = {}
+    for i, record in enumerate(code):
+        if constants:
+            code[i] = _fold(record, constants)
+        if i in definitions:
+            register, value = definitions[i]
+            constants[register] = value
+    return code
+
+
+def _fold(record, constants):
+    """Rewrites one record to use the values of constant registers"""
+
+    op, a, b, c = record
+    if op in IMMEDIATE_FORMS and b in constants:
+        # Division by a constant zero keeps failing at run time
+        if op != OP_DIV_RR or constants[b] != 0:
+            return (IMMEDIATE_FORMS[op], a, constants[b], c)
+    elif op == OP_MOV_RR and b in constants:
+        return (OP_MOV_RI, a, constants[b], c)
+    elif op in (OP_CMP_RR, OP_CMP_RI, OP_CMP_IR):
+        left_register, right_register = op in (OP_CMP_RR, OP_CMP_RI), op in (OP_CMP_RR, OP_CMP_IR)
+        if left_register and a in constants:
+            a, left_register = constants[a], False
+        if right_register and b in constants:
+            b, right_register = constants[b], False
+        forms = {(True, True): OP_CMP_RR, (True, False): OP_CMP_RI,
+                 (False, True): OP_CMP_IR, (False, False): OP_CMP_II}
+        return (forms[left_register, right_register], a, b, c)
+    elif op in (OP_STW_RR, OP_STW_RC, OP_STW_IR):
+        value_register, base_register = op in (OP_STW_RR, OP_STW_RC), op in (OP_STW_RR, OP_STW_IR)
+        if value_register and a in constants:
+            a, value_register = constants[a], False
+        if base_register and b in constants:
+            b, c, base_register = int(constants[b]) + c, None, False
+        forms = {(True, True): OP_STW_RR, (True, False): OP_STW_RC,
+                 (False, True): OP_STW_IR, (False, False): OP_STW_IC}
+        return (forms[value_register, base_register], a, b, c)
+    elif op == OP_MVW_R and b in constants:
+        return (OP_MVW_C, a, int(constants[b]) + c, None)
+    elif op == OP_MSG:
+        segments = []
+        for slot, text in a:
+            if slot in constants:
+                slot, text = None, str(constants[slot])
+            if slot is None and segments and segments[-1][0] is None:
+                segments[-1] = (None, segments[-1][1] + text)
+            else:
+                segments.append((slot, text))
+        return (op, tuple(segments), b, c)
+    return record
+
+
+def drop_labels(program, code):
+    """Removes label records, which only advance to the next line.
+
+    Returns the remaining records with their jump targets moved along, the
+    label table for the new indices and the source line of every record."""
+
+    index, kept = [], []
+    for old, record in enumerate(code):
+        index.append(len(kept))
+        if record[0] != OP_LABEL:
+            kept.append(old)
+
+    # A label now stands for the first record after it, which is never a label
+    # since the sentinel closes the program
+    new_code = []
+    for old in kept:
+        op, a, b, c = code[old]
+        if op in TARGETS:
+            a = index[a]
+        new_code.append((op, a, b, c))
+    labels = {name: index[line] for name, line in program.labels.items()}
+    return new_code, labels, tuple(kept)
+
+
+def fuse(code):
+    """Replaces compare-and-branch sequences with superinstructions"""
+
+    fused = list(code)
+    for i in range(len(code) - 1):
+        op, a, b, c = code[i]
+        jump = code[i + 1][0]
+        if jump not in CONDITIONS:
+            continue
+        target = code[i + 1][1]
+        if op == OP_CMP_RR:
+            fused[i] = (CMP_RR_JUMPS[jump], a, b, target)
+        elif op == OP_CMP_RI:
+            fused[i] = (CMP_RI_JUMPS[jump], a, b, target)
+
+    # Loop back-edges: a counter stepped, compared and branched on
+    for i in range(len(code) - 2):
+        op, register = code[i][:2]
+        compare, left, right = code[i + 1][:3]
+        jump, target = code[i + 2][:2]
+        if op in (OP_INC, OP_DEC) and compare == OP_CMP_RI and left == register and jump in CONDITIONS:
+            fused[i] = ((INC_JUMPS if op == OP_INC else DEC_JUMPS)[jump], register, right, target)
+    return fused
+
+
+def verify_optimization(program, optimized=None, registers=None, memory=None):
+    """Runs a program with and without optimization and returns a list of
+    the differences in status, error, output, registers and memory"""
+
+    if optimized is None:
+        optimized = optimize_program(program)
+    results = []
+    for candidate in (program, optimized):
+        cells = memory.copy() if isinstance(memory, PagedMemory) else dict(memory or {})
+        machine = Machine(candidate, registers=registers, memory=cells, output=BufferSink())
+        machine.run()
+        results.append({
+            'status': machine.status,
+            'error': machine.error,
+            'output': machine.output,
+            'registers': machine.registers_dict(),
+            'memory': dict(machine.memory.items()),
+        })
+
+    plain, fast = results
+    return [f"{key}: {plain[key]!r} != {fast[key]!r}" for key in plain if plain[key] != fast[key]]
@@ -0,0 +1,86 @@
+import sys
+from collections import deque
+
+
+class BufferSink:
+    """Collects program output in memory. Chunks are joined once, on demand,
+    so building the output takes linear time however many msg lines run."""
+
+    def __init__(self):
+        self.chunks = []
+        self.write = self.chunks.append
+
+    def getvalue(self):
+        """Returns all the output written so far"""
+        if len(self.chunks) > 1:
+            self.chunks[:] = [''.join(self.chunks)]
+        return self.chunks[0] if self.chunks else ''
+
+    def close(self):
+        pass
+
+
+class StreamSink:
+    """Writes program output to a file or stream as it is produced.
+
+    flush is 'line' to flush after every message, 'never' to leave it to the
+    stream's own buffering, or a number of messages between flushes."""
+
+    def __init__(self, stream=None, flush='line'):
+        self.stream = sys.stdout if stream is None else stream
+        self.flush = flush
+        self.count = 0
+        if flush == 'never':
+            self.write = self.stream.write
+
+    def write(self, text):
+        self.stream.write(text)
+        self.count += 1
+        if self.flush == 'line' or self.count % self.flush == 0:
+            self.stream.flush()
+
+    def getvalue(self):
+        return ''
+
+    def close(self):
+        self.stream.flush()
+
+
+class CallbackSink:
+    """Passes each message, newline included, to a callback"""
+
+    def __init__(self, callback):
+        self.write = callback
+
+    def getvalue(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+def open_sink(path, flush='never'):
+    """Returns a StreamSink writing program output to a file"""
+    return StreamSink(open(path, 'w'), flush)
+
+
+def iter_output(machine, quantum=10000):
+    """Runs a machine, yielding each message as soon as the slice of at most
+    quantum instructions that produced it finishes. The machine's own sink
+    still receives every message."""
+
+    pending = deque()
+    write = machine.emit
+
+    def emit(text):
+        write(text)
+        pending.append(text)
+
+    machine.emit = emit
+    try:
+        while machine.status is None:
+            machine.run(quantum)
+            while pending:
+                yield pending.popleft()
+    finally:
+        machine.emit = write
@@ -0,0 +1,184 @@
+from collections import Counter
+from time import perf_counter_ns
+
+MAIN = '<main>'
+
+
+class Profiler:
+    """Collects execution counts and time per line, per label and per call
+    stack of a running machine. Attach it as the machine's tracer.
+
+    Each instruction is charged the time until the next one starts. Calls and
+    returns are seen as changes in the depth of the machine's call stack."""
+
+    def __init__(self, machine):
+        self.machine = machine
+        program = machine.program
+        self.program = program
+        size = len(program.code)
+        self.line_counts = [0] * size
+        self.line_times = [0] * size          # nanoseconds
+        self.calls = Counter()                # (caller, callee) -> calls
+        self.inclusive_times = Counter()      # label -> nanoseconds, callees included
+        self.stack_counts = Counter()         # stack node -> instructions
+        self.stack_times = Counter()          # stack node -> nanoseconds
+
+        # Call stacks are nodes of a tree, so entering and leaving a call
+        # costs the same however deep the stack is
+        self._nodes = [(None, MAIN)]          # node -> (parent node, label)
+        self._children = dict()               # (parent node, label) -> node
+
+        # The label each line belongs to, and the name of each label line
+        names = {line: name for name, line in program.labels.items()}
+        self.owners = []
+        owner = MAIN
+        for line in range(size):
+            owner = names.get(line, owner)
+            self.owners.append(owner)
+        self._names = names
+
+        self._frames = [(MAIN, perf_counter_ns())]
+        self._active = Counter()  # label -> frames of it on the stack
+        self._key = 0
+        self._depth = len(machine.stack)
+        self._last = None
+        self._time = None
+
+    def record(self, step, line):
+        """Called by the machine before each instruction other than labels"""
+
+        now = perf_counter_ns()
+        last = self._last
+        if last is not None:
+            elapsed = now - self._time
+            self.line_times[last] += elapsed
+            self.stack_times[self._key] += elapsed
+            self.stack_counts[self._key] += 1
+
+        depth = len(self.machine.stack)
+        if depth > self._depth:
+            self._enter(self._names.get(self.program.code[last][1], MAIN), now)
+        elif depth < self._depth and len(self._frames) > 1:
+            self._leave(now)
+        self._depth = depth
+
+        self.line_counts[line] += 1
+        self._last = line
+        self._time = now
+
+    def _enter(self, callee, now):
+        self.calls[(self._frames[-1][0], callee)] += 1
+        self._frames.append((callee, now))
+        self._active[callee] += 1
+        node = self._children.get((self._key, callee))
+        if node is None:
+            node = self._children[(self._key, callee)] = len(self._nodes)
+            self._nodes.append((self._key, callee))
+        self._key = node
+
+    def _leave(self, now):
+        callee, entered = self._frames.pop()
+        self._active[callee] -= 1
+        # Recursive frames are only timed once, at the outermost call
+        if not self._active[callee]:
+            self.inclusive_times[callee] += now - entered
+        self._key = self._nodes[self._key][0]
+
+    def close(self):
+        """Charges the final instruction and closes every open frame"""
+        now = perf_counter_ns()
+        if self._last is not None:
+            elapsed = now - self._time
+            self.line_times[self._last] += elapsed
+            self.stack_times[self._key] += elapsed
+            self.stack_counts[self._key] += 1
+            self._last = None
+        while len(self._frames) > 1:
+            self._leave(now)
+        self.inclusive_times[MAIN] = now - self._frames[0][1]
+
+    def label_stats(self):
+        """Returns {label: (instructions, self nanoseconds)} over the lines of each label"""
+        stats = {}
+        for line, owner in enumerate(self.owners):
+            count, time = stats.get(owner, (0, 0))
+            stats[owner] = (count + self.line_counts[line], time + self.line_times[line])
+        return {label: totals for label, totals in stats.items() if totals[0]}
+
+    def hotspots(self, count=10):
+        """Returns the count lines with the most time as (line, instructions, nanoseconds)"""
+        lines = [(line, self.line_counts[line], self.line_times[line])
+                 for line in range(len(self.line_counts)) if self.line_counts[line]]
+        return sorted(lines, key=lambda entry: entry[2], reverse=True)[:count]
+
+    def report(self, count=10):
+        """Returns the hot-spot report: hottest lines, labels and the call graph"""
+
+        total = sum(self.line_times) or 1
+        lines = [f"Hot lines (of {sum(self.line_counts)} instructions):",
+                 f"  {'line':>6}  {'count':>10}  {'time ms':>10}  {'%':>6}  source"]
+        for line, hits, time in self.hotspots(count):
+            lines.append(f"  {line:>6}  {hits:>10}  {time / 1e6:>10.3f}  {100 * time / total:>6.1f}  "
+                         + self._source(line))
+
+        lines.append("")
+        lines.append("Labels:")
+        lines.append(f"  {'label':<24}  {'count':>10}  {'self ms':>10}  {'total ms':>10}")
+        stats = sorted(self.label_stats().items(), key=lambda entry: entry[1][1], reverse=True)
+        for label, (hits, time) in stats:
+            inclusive = self.inclusive_times.get(label)
+            inclusive = f"{inclusive / 1e6:>10.3f}" if inclusive is not None else f"{'':>10}"
+            lines.append(f"  {label:<24}  {hits:>10}  {time / 1e6:>10.3f}  {inclusive}")
+
+        if self.calls:
+            lines.append("")
+            lines.append("Call graph:")
+            for (caller, callee), calls in self.calls.most_common():
+                lines.append(f"  {caller} -> {callee}: {calls} calls")
+        return '\n'.join(lines)
+
+    def annotate(self):
+        """Returns the program source with the count and time of every line"""
+        lines = []
+        for line in range(len(self.program.code) - 1):
+            hits, time = self.line_counts[line], self.line_times[line]
+            prefix = f"{hits:>10} {time / 1e6:>10.3f}" if hits else f"{'':>10} {'':>10}"
+            lines.append(f"{prefix}  {self.program.line_of(line):04d}: {self._source(line)}")
+        return '\n'.join(lines)
+
+    def collapsed(self, metric='count'):
+        """Returns the call stacks in the collapsed format flame graph tools
+        read: one 'main;caller;callee value' line per stack. The value is the
+        number of instructions, or microseconds if metric is 'time'."""
+        if metric == 'time':
+            values = {node: time // 1000 for node, time in self.stack_times.items()}
+        else:
+            values = self.stack_counts
+        stacks = sorted((self.stack_name(node), value) for node, value in values.items() if value)
+        return '\n'.join(f"{stack} {value}" for stack, value in stacks)
+
+    def stack_name(self, node):
+        """Returns the 'main;caller;callee' name of a call stack node"""
+        labels = []
+        while node is not None:
+            node, label = self._nodes[node]
+            labels.append(label)
+        return ';'.join(reversed(labels))
+
+    def _source(self, line):
+        line = self.program.line_of(line)
+        if line >= len(self.program.source):
+            return '<end of program>'
+        return ' '.join(str(x) for x in self.program.source[line])
+
+
+def profile(machine):
+    """Runs a machine under a new Profiler and returns the profiler"""
+    profiler = Profiler(machine)
+    machine.tracer = profiler
+    try:
+        machine.run()
+    finally:
+        machine.tracer = None
+        profiler.close()
+    return profiler
@@ -0,0 +1,39 @@
+class RegisterFile:
+    """Register values stored in one flat buffer indexed by the slots assigned
+    when the program was decoded. Unassigned registers hold None."""
+
+    def __init__(self, names, slots=None, values=None):
+        self.names = names
+        self.slots = {name: i for i, name in enumerate(names)} if slots is None else slots
+        self.values = [None] * len(names) if values is None else values
+
+    def __len__(self):
+        return len(self.values)
+
+    def slot(self, name):
+        """Returns the slot of a register, or None if the program never uses it"""
+        return self.slots.get(name)
+
+    def get(self, name, default=None):
+        """Returns the value of a register by name"""
+        slot = self.slot(name)
+        if slot is None or self.values[slot] is None:
+            return default
+        return self.values[slot]
+
+    def dump(self):
+        """Returns the assigned registers by name"""
+        names = self.names
+        return {names[i]: value for i, value in enumerate(self.values) if value is not None}
+
+    def load(self, registers):
+        """Assigns registers from a name -> value mapping. Names the program
+        never uses are ignored, since no instruction could read them"""
+        for name, value in registers.items():
+            slot = self.slot(name)
+            if slot is not None:
+                self.values[slot] = value
+
+    def copy(self):
+        """Returns an independent register file with the same values"""
+        return RegisterFile(self.names, self.slots, self.values[:])
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from sys import argv, stdout
+
+from assembly_decoder import ProgramError
+from assembly_linker import load_linked
+from assembly_machine import Machine
+
+DEFAULT_QUANTUM = 1000
+
+
+async def run_async(machine, quantum=DEFAULT_QUANTUM, budget=None, deadline=None):
+    """Runs a machine on the event loop in slices of at most quantum
+    instructions, yielding to other tasks between slices.
+
+    budget limits the instructions run by this call and deadline the
+    wall-clock seconds it may take. Returns the machine's final status, or
+    'budget' or 'deadline' if it was stopped early; a stopped machine is only
+    paused and can be run again."""
+
+    loop = asyncio.get_running_loop()
+    stop_at = None if deadline is None else loop.time() + deadline
+    limit = None if budget is None else machine.steps + budget
+
+    while machine.status is None:
+        steps = quantum if limit is None else min(quantum, limit - machine.steps)
+        if steps <= 0:
+            return 'budget'
+        machine.run(steps)
+        if machine.status is not None:
+            break
+        if stop_at is not None and loop.time() >= stop_at:
+            return 'deadline'
+        # Ready tasks run in turn, so every machine gets one slice per round
+        await asyncio.sleep(0)
+    return machine.status
+
+
+class Scheduler:
+    """Interleaves many machines on one event loop. Each gets a quantum of
+    instructions per turn, and its own instruction budget and deadline."""
+
+    def __init__(self, quantum=DEFAULT_QUANTUM, budget=None, deadline=None):
+        self.quantum = quantum
+        self.budget = budget
+        self.deadline = deadline
+        self.tasks = []  # (name, machine, asyncio task)
+
+    def spawn(self, machine, name=None, budget=None, deadline=None):
+        """Starts running a machine and returns its asyncio task"""
+        budget = self.budget if budget is None else budget
+        deadline = self.deadline if deadline is None else deadline
+        task = asyncio.ensure_future(run_async(machine, self.quantum, budget, deadline))
+        self.tasks.append((name, machine, task))
+        return task
+
+    async def join(self):
+        """Waits for every spawned machine, returning (name, machine, status) for each"""
+        statuses = await asyncio.gather(*(task for name, machine, task in self.tasks))
+        return [(name, machine, status) for (name, machine, task), status in zip(self.tasks, statuses)]
+
+
+def run_many(machines, quantum=DEFAULT_QUANTUM, budget=None, deadline=None):
+    """Runs machines concurrently on a new event loop and returns their statuses"""
+
+    async def main():
+        scheduler = Scheduler(quantum, budget, deadline)
+        for machine in machines:
+            scheduler.spawn(machine)
+        return [status for name, machine, status in await scheduler.join()]
+
+    return asyncio.run(main())
+
+
+def display_help():
+    """Displays help information for the scheduler"""
+    print("Usage:")
+    print("  assembly_scheduler.py file.asm [file.asm ...] [options]")
+    print()
+    print("Runs every program concurrently on one event loop, interleaving them")
+    print("a slice at a time, and prints one JSON result per line.")
+    print()
+    print("Options:")
+    print(f"  --quantum=N     Instructions per slice (default: {DEFAULT_QUANTUM})")
+    print("  --budget=N      Stop each program after N instructions")
+    print("  --deadline=S    Stop each program after S seconds")
+
+
+if __name__ == '__main__':
+    files = [arg for arg in argv[1:] if not arg.startswith('-')]
+    if not files or '-h' in argv or '--help' in argv:
+        display_help()
+        exit(0)
+
+    options = {'quantum': DEFAULT_QUANTUM, 'budget': None, 'deadline': None}
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            continue
+        try:
+            if arg.startswith('--quantum='):
+                options['quantum'] = int(arg.split('=', 1)[1])
+            elif arg.startswith('--budget='):
+                options['budget'] = int(arg.split('=', 1)[1])
+            elif arg.startswith('--deadline='):
+                options['deadline'] = float(arg.split('=', 1)[1])
+            else:
+                print(f"Error: Unknown option '{arg}'")
+                exit(1)
+        except ValueError as error:
+            print(f"Error: Invalid option '{arg}': {error}")
+            exit(1)
+
+    machines = []
+    for path in files:
+        try:
+            machines.append(Machine(load_linked(path)))
+        except (OSError, ProgramError) as error:
+            print(f"Error: Cannot load '{path}': {error}")
+            exit(1)
+
+    statuses = run_many(machines, **options)
+    for path, machine, status in zip(files, machines, statuses):
+        result = {'name': path, 'status': status, 'output': machine.output, 'error': machine.error,
+                  'steps': machine.steps, 'registers': machine.registers_dict()}
+        stdout.write(json.dumps(result) + '\n')
+    exit(0 if all(status == 'end' for status in statuses) else 1)
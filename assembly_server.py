@@ -0,0 +1,253 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from sys import argv
+
+from assembly_cache import cache_key, decode_cached
+from assembly_client import DEFAULT_SOCKET
+from assembly_compiler import compile_program
+from assembly_decoder import ProgramError, decode_program
+from assembly_linker import link, load_modules
+from assembly_loops import accelerate_loops
+from assembly_machine import Machine
+
+# Decoded programs kept in memory before the least recently used one is dropped
+PROGRAM_CACHE_SIZE = 256
+
+
+class ProgramCache:
+    """Decoded programs kept in memory between requests, least recently used
+    first out. Text is keyed by its hash, files by their path. A file is
+    decoded and linked again when it or any file it includes has changed
+    size or modification time."""
+
+    def __init__(self, size=PROGRAM_CACHE_SIZE, use_cache=True):
+        self.size = size
+        self.use_cache = use_cache  # whether misses go through the on-disk cache
+        self.programs = OrderedDict()  # key -> [decoded program, with fast loops, compiled, file stamps]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path=None, text=None, compile=False, written=()):
+        """Returns [decoded program, program with fast loops, compiled program
+        or None, file stamps], compiling the program first if asked for.
+        Names in written are decoded as registers, as the request presets them."""
+
+        key = (path if path is not None else cache_key(text),) + tuple(sorted(written))
+        with self.lock:
+            entry = self.programs.get(key)
+            if entry is not None and _unchanged(entry[3]):
+                self.programs.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry is None:
+            if path is not None:
+                modules = load_modules(path, use_cache=self.use_cache)
+                program = link(modules, use_cache=self.use_cache, written=written)
+                stamps = tuple(_stamp(module.path) for module in modules)
+            else:
+                program = decode_cached(text, written=written) if self.use_cache else decode_program(text, written)
+                stamps = ()
+            entry = [program, accelerate_loops(program), None, stamps]
+            with self.lock:
+                self.programs[key] = entry
+                if len(self.programs) > self.size:
+                    self.programs.popitem(last=False)
+
+        if compile and entry[2] is None:
+            entry[2] = compile_program(entry[0])
+        return entry
+
+    def stats(self):
+        """Returns the cache hits, misses and size"""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.programs), 'size': self.size}
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def _unchanged(stamps):
+    try:
+        return all(_stamp(stamp[0]) == stamp for stamp in stamps)
+    except OSError:
+        return False
+
+
+def run_request(request, programs):
+    """Runs one request dict, with a program path or text and optionally
+    registers, memory, max_steps and compile, and returns its response dict"""
+
+    response = {'status': None, 'output': None, 'error': None, 'steps': 0, 'registers': None}
+    try:
+        path, text = request.get('path'), request.get('text')
+        if (path is None) == (text is None):
+            raise ValueError("A request needs exactly one of path or text")
+        registers = _integers(request.get('registers'), 'registers', str)
+        memory = _integers(request.get('memory'), 'memory', int)
+        max_steps = _step_limit(request.get('max_steps'))
+        # A compiled program always runs to the end, so a step limit needs the interpreter
+        compile = request.get('compile', False) and max_steps is None
+        program, fast, compiled = programs.get(path, text, compile, registers)[:3]
+        machine = Machine(program if compile else fast, registers=registers, memory=memory)
+    except (OSError, ProgramError, ValueError, TypeError, AttributeError) as error:
+        response.update(status='error', error=str(error))
+        return response
+
+    if compile:
+        compiled.run(machine)
+    else:
+        machine.run(max_steps)
+
+    response.update(status=machine.status or 'timeout', output=machine.output, error=machine.error,
+                    steps=machine.steps, registers=machine.registers_dict())
+    return response
+
+
+def _integers(values, name, key):
+    """Returns a request's registers or memory as a dict of integers, with
+    memory addresses converted to integers, or raises ValueError"""
+    if values is None:
+        return {}
+    if not isinstance(values, dict):
+        raise ValueError(f"'{name}' must be a JSON object")
+    result = {}
+    for item, value in values.items():
+        if type(value) is not int:
+            raise ValueError(f"'{name}' value for '{item}' must be an integer, not {value!r}")
+        try:
+            result[key(item)] = value
+        except ValueError:
+            raise ValueError(f"'{name}' has an invalid address '{item}'")
+    return result
+
+
+def _step_limit(value):
+    """Returns a request's max_steps, None when it has none, or raises ValueError"""
+    if value is not None and (type(value) is not int or value < 0):
+        raise ValueError(f"'max_steps' must be a non-negative integer, not {value!r}")
+    return value
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers each JSON line read from a connection with a JSON line"""
+
+    def handle(self):
+        server = self.server
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as error:
+                response = {'status': 'error', 'error': f"Invalid request: {error}"}
+            else:
+                command = request.get('command')
+                if command == 'stats':
+                    response = server.programs.stats()
+                elif command == 'stop':
+                    response = {'status': 'stopping'}
+                    threading.Thread(target=server.shutdown).start()
+                elif command is not None:
+                    response = {'status': 'error', 'error': f"Unknown command '{command}'"}
+                else:
+                    response = run_request(request, server.programs)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class AssemblyServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Runs programs sent over a Unix socket, one thread per connection, so
+    the cost of starting Python and decoding each program is paid once"""
+
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET, size=PROGRAM_CACHE_SIZE, use_cache=True):
+        self.path = path
+        self.programs = ProgramCache(size, use_cache)
+        _remove_stale_socket(path)
+        super().__init__(path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale_socket(path):
+    """Removes a socket file left behind by a server that is gone, or raises
+    OSError if a server is still listening on it"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"A server is already listening on {path}")
+
+
+def serve(path=DEFAULT_SOCKET, size=PROGRAM_CACHE_SIZE, use_cache=True):
+    """Serves requests on a Unix socket until stopped"""
+    with AssemblyServer(path, size, use_cache) as server:
+        print(f"Listening on {path}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def display_help():
+    """Displays help information for the server"""
+    print("Usage:")
+    print("  assembly_server.py [options]")
+    print()
+    print("Keeps an interpreter running on a Unix socket. Each request is a JSON line")
+    print("with a program \"path\" or \"text\", and optionally \"registers\", \"memory\",")
+    print("\"max_steps\" and \"compile\"; each response is a JSON line with the status,")
+    print("output, error, steps and registers. Run programs with assembly_client.py.")
+    print()
+    print("Options:")
+    print(f"  --socket=PATH     Socket to listen on (default: {DEFAULT_SOCKET})")
+    print(f"  --cache-size=N    Decoded programs kept in memory (default: {PROGRAM_CACHE_SIZE})")
+    print("  --no-cache        Parse programs without the compiled-program cache")
+
+
+if __name__ == '__main__':
+    if '-h' in argv or '--help' in argv:
+        display_help()
+        exit(0)
+
+    options = {'path': DEFAULT_SOCKET, 'size': PROGRAM_CACHE_SIZE, 'use_cache': True}
+    for arg in argv[1:]:
+        try:
+            if arg.startswith('--socket='):
+                options['path'] = arg.split('=', 1)[1]
+            elif arg.startswith('--cache-size='):
+                options['size'] = int(arg.split('=', 1)[1])
+            elif arg == '--no-cache':
+                options['use_cache'] = False
+            else:
+                print(f"Error: Unknown option '{arg}'")
+                exit(1)
+        except ValueError as error:
+            print(f"Error: Invalid option '{arg}': {error}")
+            exit(1)
+
+    try:
+        serve(**options)
+    except OSError as error:
+        print(f"Error: {error}")
+        exit(1)
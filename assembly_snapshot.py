@@ -0,0 +1,113 @@
+import hashlib
+import marshal
+import sys
+import zlib
+from array import array
+
+from assembly_machine import Machine
+
+# Snapshot files hold this tag, then the zlib-compressed marshal of the state
+SNAPSHOT_MAGIC = b'ASMSNAP1'
+
+
+def program_key(program):
+    """Returns a hash identifying a program and the layout of its records,
+    which a snapshot's line counter and call stack refer to"""
+    return hashlib.sha256(marshal.dumps((program.source, program.lines, len(program.code)))).hexdigest()
+
+
+class Snapshot:
+    """The complete state of a paused machine: registers, memory, call
+    stack, compare values, line counter, output and step count. Restoring
+    copies it, so one snapshot can start any number of independent runs."""
+
+    def __init__(self, key, registers, pages, stack, compare, pc, steps, output, status=None, error=None):
+        self.key = key              # program_key of the program it was taken from
+        self.registers = registers  # flat register values by slot
+        self.pages = pages          # memory page index -> array('q') or list
+        self.stack = stack
+        self.compare = compare
+        self.pc = pc
+        self.steps = steps
+        self.output = output
+        self.status = status
+        self.error = error
+
+    def restore(self, program, output=None):
+        """Returns a new machine for program in the captured state. Output
+        captured so far is written to the new machine's sink first"""
+
+        self.check(program)
+        return self._restore(program, output)
+
+    def check(self, program):
+        """Raises ValueError unless the snapshot was taken from program"""
+        if program_key(program) != self.key:
+            raise ValueError("Snapshot was taken from a different program")
+
+    def _restore(self, program, output=None):
+        machine = Machine(program, output=output)
+        machine.registers[:] = self.registers
+        machine.memory.pages = {index: page[:] for index, page in self.pages.items()}
+        machine.stack = self.stack[:]
+        machine.compare = self.compare[:]
+        machine.pc = self.pc
+        machine.steps = self.steps
+        machine.status = self.status
+        machine.error = self.error
+        if self.output:
+            machine.emit(self.output)
+        return machine
+
+    def fork(self, program, count):
+        """Returns count independent machines restored from the snapshot"""
+        self.check(program)
+        return [self._restore(program) for _ in range(count)]
+
+    def save(self, path):
+        """Writes the snapshot to a file"""
+
+        pages = {}
+        for index, page in self.pages.items():
+            if isinstance(page, array):
+                if sys.byteorder == 'big':
+                    page = page[:]
+                    page.byteswap()
+                page = page.tobytes()
+            pages[index] = page
+        state = (self.key, self.registers, pages, self.stack, self.compare, self.pc,
+                 self.steps, self.output, self.status, self.error)
+        with open(path, 'wb') as snapshot:
+            snapshot.write(SNAPSHOT_MAGIC + zlib.compress(marshal.dumps(state), 1))
+
+
+def take_snapshot(machine):
+    """Captures the state of a machine that is paused, finished or not yet started"""
+
+    memory = machine.memory.copy()
+    return Snapshot(program_key(machine.program), machine.registers[:], memory.pages, machine.stack[:],
+                    list(machine.compare), machine.pc, machine.steps, machine.output,
+                    machine.status, machine.error)
+
+
+def open_snapshot(path):
+    """Reads a snapshot written by Snapshot.save"""
+
+    with open(path, 'rb') as snapshot:
+        data = snapshot.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError(f"'{path}' is not a snapshot")
+    try:
+        state = marshal.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]))
+        key, registers, pages, stack, compare, pc, steps, output, status, error = state
+    except (zlib.error, EOFError, TypeError, ValueError):
+        raise ValueError(f"Snapshot '{path}' is corrupt")
+
+    for index, page in pages.items():
+        if isinstance(page, bytes):
+            cells = array('q')
+            cells.frombytes(page)
+            if sys.byteorder == 'big':
+                cells.byteswap()
+            pages[index] = cells
+    return Snapshot(key, registers, pages, stack, compare, pc, steps, output, status, error)
@@ -0,0 +1,53 @@
+class ExecutionTrace:
+    """Records executed instructions as raw (step, line) pairs.
+
+    The most recent `size` records are kept in a fixed-size ring buffer and
+    only formatted when asked for. If a stream is given, every record is also
+    written to it as it happens, giving a full trace of the run."""
+
+    def __init__(self, program, size=5, stream=None):
+        self.program = program
+        self.size = size
+        self.stream = stream
+        self.count = 0
+        self._steps = [0] * size
+        self._lines = [0] * size
+
+    def record(self, step, line):
+        """Records that the instruction at line was executed as the given step"""
+        if self.size:
+            slot = self.count % self.size
+            self._steps[slot] = step
+            self._lines[slot] = line
+        self.count += 1
+        if self.stream is not None:
+            self.stream.write(self.format(step, line) + '\n')
+
+    def records(self, count=None):
+        """Returns up to count of the most recent (step, line) records, oldest first"""
+        kept = min(self.count, self.size)
+        if count is not None:
+            kept = min(kept, count)
+        start = self.count - kept
+        return [(self._steps[i % self.size], self._lines[i % self.size]) for i in range(start, self.count)]
+
+    def history(self, count=None):
+        """Returns the most recent records formatted for display"""
+        return [self.format(step, line) for step, line in self.records(count)]
+
+    def format(self, step, line):
+        line = self.program.line_of(line)
+        if line >= len(self.program.source):
+            return f"Step {step:04d}: <end of program>"  # the sentinel after the last line
+        return f"Step {step:04d}: " + ' '.join(str(x) for x in self.program.source[line])
+
+    def close(self):
+        """Flushes and closes the trace stream, if any"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def open_trace(program, path, size=5):
+    """Returns an ExecutionTrace streaming the full trace of a program to a file"""
+    return ExecutionTrace(program, size, open(path, 'w', buffering=1 << 16))
@@ -0,0 +1,496 @@
+from operator import add, sub, mul, floordiv, eq, ne, gt, ge, lt, le
+
+import numpy as np
+
+from assembly_decoder import *
+from assembly_machine import HANDLERS, Machine, MachineError
+from assembly_verifier import OP_RETURN
+
+# Range of an int64 lane. A value outside it widens every array to Python ints.
+INT_MIN, INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+# Selects every live lane
+ALL = slice(None)
+
+# Conditions of the conditional jumps and calls
+TESTS = {
+    OP_JE: eq, OP_JNE: ne, OP_JG: gt, OP_JGE: ge, OP_JL: lt, OP_JLE: le,
+    OP_CE: eq, OP_CNE: ne, OP_CG: gt, OP_CGE: ge, OP_CL: lt, OP_CLE: le,
+}
+CONDITIONAL_JUMPS = (OP_JE, OP_JNE, OP_JG, OP_JGE, OP_JL, OP_JLE)
+CONDITIONAL_CALLS = (OP_CE, OP_CNE, OP_CG, OP_CGE, OP_CL, OP_CLE)
+
+ARITHMETIC = {
+    OP_ADD_RR: add, OP_ADD_RI: add, OP_SUB_RR: sub, OP_SUB_RI: sub,
+    OP_MUL_RR: mul, OP_MUL_RI: mul, OP_DIV_RR: floordiv, OP_DIV_RI: floordiv,
+}
+
+
+class VectorMachine:
+    """Runs one decoded program over many lanes at once, each with its own
+    registers, memory, compare values and call stack.
+
+    Every register is a NumPy array with one value per lane. Each step runs
+    the lowest line any lane is at, for all the lanes at that line, so lanes
+    that took different branches wait for each other and run together again
+    once they reach the same line. Lanes that end or fail are set aside and
+    the arrays are compacted to the lanes still running.
+
+    Values are int64 until one would overflow, then every array is widened
+    to Python ints, so each lane ends exactly as a Machine running it alone
+    would: same output, registers, steps and errors."""
+
+    def __init__(self, program, presets):
+        self.program = program
+        self.handlers = self._handlers()
+        for op, a, b, c in program.code:
+            if op not in self.handlers:
+                raise ValueError(f'Cannot vectorize opcode {op}')
+
+        presets = list(presets)
+        count = len(presets)
+        self.results = [None] * count
+        self.outputs = [[] for _ in range(count)]
+        self.lanes = np.arange(count)     # live lane -> lane index
+        self.everyone = np.arange(count)  # live lane -> itself
+        self.common = 0                   # the line every live lane is at, or None
+        self.pc = None                    # the line of each live lane, once they part
+        self.steps = np.zeros(count, dtype=np.int64)
+        self.base = 0                     # steps every live lane has run on top of steps
+        self.done = np.zeros(count, dtype=bool)
+        self.finished = False             # whether done marks any lane
+
+        # Immediates and initial values decide whether int64 is wide enough
+        columns = [[registers.get(name) for registers, memory in presets] for name in program.register_names]
+        cells = dict()
+        for lane, (registers, memory) in enumerate(presets):
+            for address, value in memory.items():
+                cells.setdefault(address, [0] * count)[lane] = value
+        initial = [value for column in columns for value in column if value is not None]
+        initial += [value for column in cells.values() for value in column]
+        initial += [value for record in program.code for value in record[1:] if type(value) is int]
+        self.wide = not all(type(value) is int and INT_MIN <= value <= INT_MAX for value in initial)
+        self.dtype = object if self.wide else np.int64
+
+        self.values = [np.array([0 if value is None else value for value in column], dtype=self.dtype)
+                       for column in columns]
+        self.assigned = [np.array([value is not None for value in column], dtype=bool) for column in columns]
+        self.full = {slot for slot, assigned in enumerate(self.assigned) if assigned.all()}
+        self.memory = {address: np.array(column, dtype=self.dtype) for address, column in cells.items()}
+        self.cmp0 = np.zeros(count, dtype=self.dtype)
+        self.cmp1 = np.zeros(count, dtype=self.dtype)
+        self.stack = np.zeros((16, count), dtype=np.int64)
+        self.depth = np.zeros(count, dtype=np.int64)
+
+    def run(self, max_steps=None):
+        """Runs every lane until it ends or fails, or for at most max_steps
+        instructions. Returns one result dict per lane, in preset order"""
+
+        code = self.program.code
+        handlers = self.handlers
+        if max_steps is not None and max_steps <= 0:
+            self._finish(self.everyone, None)
+            self._compact()
+
+        while len(self.lanes):
+            if self.common is not None:
+                pc, sel = self.common, ALL
+            else:
+                pc = int(self.pc.min())
+                here = self.pc == pc
+                if here.all():
+                    self.common, self.pc, sel = pc, None, ALL
+                else:
+                    sel = np.flatnonzero(here)
+
+            op, a, b, c = code[pc]
+            next_pc = handlers[op](sel, a, b, c, pc)
+
+            if sel is ALL:
+                self.base += 1
+                if isinstance(next_pc, np.ndarray):
+                    self.common, self.pc = None, next_pc
+                else:
+                    self.common = next_pc
+            else:
+                self.steps[sel] += 1
+                self.pc[sel] = next_pc
+
+            if max_steps is not None:
+                over = np.flatnonzero((self.steps + self.base >= max_steps) & ~self.done)
+                if len(over):
+                    self._finish(over, None)
+            if self.finished:
+                self._compact()
+
+        return self.results
+
+    def _handlers(self):
+        handlers = {
+            OP_END: self._end, OP_EXIT: self._exit, OP_FALLOFF: self._error, OP_ERROR: self._error,
+            OP_LABEL: self._label, OP_MOV_RR: self._mov_rr, OP_MOV_RI: self._mov_ri,
+            OP_INC: self._inc, OP_DEC: self._dec,
+            OP_JMP: self._jmp, OP_CALL: self._call, OP_RET: self._ret, OP_RETURN: self._return,
+            OP_CMP_RR: self._cmp_rr, OP_CMP_RI: self._cmp_ri, OP_CMP_IR: self._cmp_ir, OP_CMP_II: self._cmp_ii,
+            OP_STW_RR: self._stw_rr, OP_STW_RC: self._stw_rc, OP_STW_IR: self._stw_ir, OP_STW_IC: self._stw_ic,
+            OP_MVW_R: self._mvw_r, OP_MVW_C: self._mvw_c, OP_MSG: self._msg,
+        }
+        handlers.update(dict.fromkeys((OP_ADD_RR, OP_SUB_RR, OP_MUL_RR, OP_DIV_RR), self._arithmetic_rr))
+        handlers.update(dict.fromkeys((OP_ADD_RI, OP_SUB_RI, OP_MUL_RI, OP_DIV_RI), self._arithmetic_ri))
+        handlers.update(dict.fromkeys(CONDITIONAL_JUMPS, self._branch))
+        handlers.update(dict.fromkeys(CONDITIONAL_CALLS, self._conditional_call))
+        return handlers
+
+    # Lane bookkeeping
+
+    def _indices(self, sel):
+        return self.everyone if sel is ALL else sel
+
+    def _check(self, sel, pc, *slots):
+        """Fails the selected lanes that read a register before assigning it"""
+        bad = None
+        for slot in slots:
+            if slot not in self.full:
+                missing = ~self.assigned[slot][sel]
+                bad = missing if bad is None else bad | missing
+        if bad is not None and bad.any():
+            self._fail(self._indices(sel)[bad], pc)
+
+    def _fail(self, indices, pc):
+        """Ends lanes with the error a Machine would report for the record at pc"""
+        self._finish(indices, 'error', [self._error_message(i, pc) for i in indices.tolist()])
+
+    def _error_message(self, i, pc):
+        machine = Machine(self.program)
+        machine.registers[:] = self._lane_registers([i])[0]
+        op, a, b, c = self.program.code[pc]
+        try:
+            HANDLERS[op](machine, a, b, c, pc)
+        except MachineError as error:
+            return str(error)
+        except TypeError:
+            return machine._unassigned_message(pc)
+        raise ValueError(f"Lane {self.lanes[i]} did not fail at line {pc}")
+
+    def _lane_registers(self, indices):
+        """Returns the register values of lanes, None where unassigned"""
+        registers = [[] for _ in indices]
+        for slot, values in enumerate(self.values):
+            column = values[indices].tolist()
+            if slot not in self.full:
+                assigned = self.assigned[slot][indices].tolist()
+                column = [value if flag else None for value, flag in zip(column, assigned)]
+            for lane, value in zip(registers, column):
+                lane.append(value)
+        return registers
+
+    def _finish(self, indices, status, errors=None, extra=0):
+        """Records the results of lanes that stopped, to be compacted away"""
+        names = self.program.register_names
+        steps = (self.steps[indices] + (self.base + extra)).tolist()
+        registers = self._lane_registers(indices)
+        for n, lane in enumerate(self.lanes[indices].tolist()):
+            self.results[lane] = {
+                'status': status,
+                'output': ''.join(self.outputs[lane]),
+                'error': errors[n] if isinstance(errors, list) else errors,
+                'steps': steps[n],
+                'registers': {names[slot]: value for slot, value in enumerate(registers[n]) if value is not None},
+            }
+            self.outputs[lane] = None
+        self.done[indices] = True
+        self.finished = True
+
+    def _compact(self):
+        """Drops the lanes that stopped from every array"""
+        keep = ~self.done
+        self.lanes = self.lanes[keep]
+        self.everyone = np.arange(len(self.lanes))
+        if self.pc is not None:
+            self.pc = self.pc[keep]
+        self.steps = self.steps[keep]
+        self.done = self.done[keep]
+        self.finished = False
+        self.values = [values[keep] for values in self.values]
+        self.assigned = [assigned[keep] for assigned in self.assigned]
+        self.memory = {address: cell[keep] for address, cell in self.memory.items()}
+        self.cmp0, self.cmp1 = self.cmp0[keep], self.cmp1[keep]
+        self.stack = self.stack[:, keep]
+        self.depth = self.depth[keep]
+
+    def _widen(self):
+        """Switches every array to Python ints once int64 would overflow"""
+        self.wide = True
+        self.dtype = object
+        self.values = [values.astype(object) for values in self.values]
+        self.memory = {address: cell.astype(object) for address, cell in self.memory.items()}
+        self.cmp0, self.cmp1 = self.cmp0.astype(object), self.cmp1.astype(object)
+
+    def _apply(self, operator, x, y):
+        """Applies an arithmetic operator lane by lane, widening first if
+        int64 would overflow"""
+        if not self.wide:
+            result, overflow = _checked(operator, x, y)
+            if not overflow:
+                return result
+            self._widen()
+            x = x.astype(object)
+            if isinstance(y, np.ndarray):
+                y = y.astype(object)
+        return operator(x, y)
+
+    def _write(self, slot, sel, values):
+        self.values[slot][sel] = values
+        if slot not in self.full:
+            assigned = self.assigned[slot]
+            assigned[sel] = True
+            if sel is ALL or assigned.all():
+                self.full.add(slot)
+
+    def _targets(self, lines):
+        """Returns the next line of the selected lanes, as an int if they agree"""
+        first = lines[0]
+        return int(first) if (lines == first).all() else lines
+
+    # Memory
+
+    def _cell(self, address):
+        cell = self.memory.get(address)
+        if cell is None:
+            cell = self.memory[address] = np.zeros(len(self.lanes), dtype=self.dtype)
+        return cell
+
+    def _addresses(self, sel, base, offset):
+        addresses = self.values[base][sel]
+        return self._apply(add, addresses, offset) if offset else addresses
+
+    def _store(self, sel, addresses, values):
+        """Stores values, or one value, at the address of each selected lane"""
+        first = int(addresses[0])
+        if (addresses == first).all():
+            self._cell(first)[sel] = values
+            return
+        indices = self._indices(sel)
+        for address in np.unique(addresses).tolist():
+            here = addresses == address
+            self._cell(address)[indices[here]] = values[here] if isinstance(values, np.ndarray) else values
+
+    def _load(self, sel, addresses):
+        """Returns the values at the address of each selected lane"""
+        first = int(addresses[0])
+        if (addresses == first).all():
+            cell = self.memory.get(first)
+            return np.zeros(len(addresses), dtype=self.dtype) if cell is None else cell[sel]
+        indices = self._indices(sel)
+        values = np.zeros(len(addresses), dtype=self.dtype)
+        for address in np.unique(addresses).tolist():
+            cell = self.memory.get(address)
+            if cell is not None:
+                here = addresses == address
+                values[here] = cell[indices[here]]
+        return values
+
+    # Call stack
+
+    def _push(self, indices, pc):
+        depth = self.depth[indices]
+        if depth.max() >= len(self.stack):
+            grown = np.zeros((2 * len(self.stack), len(self.lanes)), dtype=np.int64)
+            grown[:len(self.stack)] = self.stack
+            self.stack = grown
+        self.stack[depth, indices] = pc
+        self.depth[indices] = depth + 1
+
+    def _pop(self, sel):
+        indices = self._indices(sel)
+        depth = self.depth[indices] - 1
+        self.depth[indices] = depth
+        return self._targets(self.stack[depth, indices] + 1)
+
+    # Instruction handlers. Each takes the selected lanes, the three operands
+    # of the record and its line, and returns the next line of those lanes.
+
+    def _end(self, sel, a, b, c, pc):
+        self._finish(self._indices(sel), 'end')
+        return pc
+
+    def _exit(self, sel, a, b, c, pc):
+        # Skipping the final label still counts as a step
+        self._finish(self._indices(sel), 'end', extra=1)
+        return pc
+
+    def _error(self, sel, message, b, c, pc):
+        self._finish(self._indices(sel), 'error', message)
+        return pc
+
+    def _label(self, sel, a, b, c, pc):
+        return pc + 1
+
+    def _mov_rr(self, sel, register, source, c, pc):
+        self._check(sel, pc, source)
+        self._write(register, sel, self.values[source][sel])
+        return pc + 1
+
+    def _mov_ri(self, sel, register, value, c, pc):
+        self._write(register, sel, value)
+        return pc + 1
+
+    def _inc(self, sel, register, b, c, pc):
+        self._check(sel, pc, register)
+        self._write(register, sel, self._apply(add, self.values[register][sel], 1))
+        return pc + 1
+
+    def _dec(self, sel, register, b, c, pc):
+        self._check(sel, pc, register)
+        self._write(register, sel, self._apply(sub, self.values[register][sel], 1))
+        return pc + 1
+
+    def _arithmetic_rr(self, sel, register, source, c, pc):
+        op = self.program.code[pc][0]
+        self._check(sel, pc, register, source)
+        divisor = self.values[source][sel]
+        if op == OP_DIV_RR:
+            zero = divisor == 0
+            if zero.any():
+                self._fail(self._indices(sel)[zero & ~self.done[sel]], pc)
+                divisor = np.where(zero, 1, divisor)
+        self._write(register, sel, self._apply(ARITHMETIC[op], self.values[register][sel], divisor))
+        return pc + 1
+
+    def _arithmetic_ri(self, sel, register, value, c, pc):
+        self._check(sel, pc, register)
+        operator = ARITHMETIC[self.program.code[pc][0]]
+        self._write(register, sel, self._apply(operator, self.values[register][sel], value))
+        return pc + 1
+
+    def _jmp(self, sel, target, b, c, pc):
+        return target
+
+    def _call(self, sel, target, b, c, pc):
+        self._push(self._indices(sel), pc)
+        return target
+
+    def _ret(self, sel, a, b, c, pc):
+        empty = self.depth[sel] == 0
+        if empty.any():
+            indices = self._indices(sel)
+            self._fail(indices[empty], pc)
+            # Failed lanes are compacted away, so they may return anywhere
+            self.depth[indices[empty]] = 1
+        return self._pop(sel)
+
+    def _return(self, sel, a, b, c, pc):
+        return self._pop(sel)
+
+    def _cmp_rr(self, sel, left, right, c, pc):
+        self._check(sel, pc, left, right)
+        self.cmp0[sel] = self.values[left][sel]
+        self.cmp1[sel] = self.values[right][sel]
+        return pc + 1
+
+    def _cmp_ri(self, sel, left, right, c, pc):
+        self._check(sel, pc, left)
+        self.cmp0[sel] = self.values[left][sel]
+        self.cmp1[sel] = right
+        return pc + 1
+
+    def _cmp_ir(self, sel, left, right, c, pc):
+        self._check(sel, pc, right)
+        self.cmp0[sel] = left
+        self.cmp1[sel] = self.values[right][sel]
+        return pc + 1
+
+    def _cmp_ii(self, sel, left, right, c, pc):
+        self.cmp0[sel] = left
+        self.cmp1[sel] = right
+        return pc + 1
+
+    def _branch(self, sel, target, b, c, pc):
+        taken = np.asarray(TESTS[self.program.code[pc][0]](self.cmp0[sel], self.cmp1[sel]), dtype=bool)
+        if taken.all():
+            return target
+        if not taken.any():
+            return pc + 1
+        return np.where(taken, target, pc + 1)
+
+    def _conditional_call(self, sel, target, b, c, pc):
+        taken = np.asarray(TESTS[self.program.code[pc][0]](self.cmp0[sel], self.cmp1[sel]), dtype=bool)
+        if taken.all():
+            return self._call(sel, target, b, c, pc)
+        if not taken.any():
+            return pc + 1
+        self._push(self._indices(sel)[taken], pc)
+        return np.where(taken, target, pc + 1)
+
+    def _stw_rr(self, sel, source, base, offset, pc):
+        self._check(sel, pc, source, base)
+        self._store(sel, self._addresses(sel, base, offset), self.values[source][sel])
+        return pc + 1
+
+    def _stw_rc(self, sel, source, address, c, pc):
+        self._check(sel, pc, source)
+        self._cell(address)[sel] = self.values[source][sel]
+        return pc + 1
+
+    def _stw_ir(self, sel, value, base, offset, pc):
+        self._check(sel, pc, base)
+        self._store(sel, self._addresses(sel, base, offset), value)
+        return pc + 1
+
+    def _stw_ic(self, sel, value, address, c, pc):
+        self._cell(address)[sel] = value
+        return pc + 1
+
+    def _mvw_r(self, sel, register, base, offset, pc):
+        self._check(sel, pc, base)
+        self._write(register, sel, self._load(sel, self._addresses(sel, base, offset)))
+        return pc + 1
+
+    def _mvw_c(self, sel, register, address, c, pc):
+        cell = self.memory.get(address)
+        self._write(register, sel, 0 if cell is None else cell[sel])
+        return pc + 1
+
+    def _msg(self, sel, segments, b, c, pc):
+        lanes = self.lanes[sel].tolist()
+        columns = []
+        for slot, text in segments:
+            if slot is None:
+                columns.append([text] * len(lanes))
+                continue
+            column = [str(value) for value in self.values[slot][sel].tolist()]
+            if slot not in self.full:
+                assigned = self.assigned[slot][sel].tolist()
+                column = [value if flag else text for value, flag in zip(column, assigned)]
+            columns.append(column)
+        messages = map(''.join, zip(*columns)) if columns else [''] * len(lanes)
+        outputs = self.outputs
+        for lane, message in zip(lanes, messages):
+            if not message.endswith('\n'):
+                message += '\n'  # Ensure each msg ends with a newline
+            outputs[lane].append(message)
+        return pc + 1
+
+
+def _checked(operator, x, y):
+    """Applies an operator to int64 lanes. Returns the result and whether
+    any lane overflowed, in which case the result is meaningless"""
+    with np.errstate(all='ignore'):
+        if operator is add:
+            result = x + y
+            return result, (((x ^ result) & (y ^ result)) < 0).any()
+        if operator is sub:
+            result = x - y
+            return result, (((x ^ y) & (x ^ result)) < 0).any()
+        if operator is mul:
+            # Products under 2**62 are exact in int64 and far from float rounding
+            return x * y, (np.abs(x.astype(np.float64) * y) >= 2.0 ** 62).any()
+        return x // y, ((x == INT_MIN) & (y == -1)).any()
+
+
+def run_lanes(program, presets, max_steps=None):
+    """Runs a decoded, unoptimized program once per (registers, memory)
+    preset, all at once. Returns one result dict per preset with the status,
+    output, error, steps and registers a Machine run of it would end with;
+    the status is None for lanes stopped by max_steps."""
+    return VectorMachine(program, presets).run(max_steps)
@@ -0,0 +1,150 @@
+from assembly_decoder import *
+from assembly_helpers import parse_int, parse_address
+from assembly_machine import HANDLERS
+
+# The operands each command takes: 'r' a register, 'v' a register or an
+# integer, 'a' a memory address and 'l' a label. Labels and msg are checked
+# separately.
+OPERANDS = {
+    'inc': 'r', 'dec': 'r',
+    'mov': 'rv', 'add': 'rv', 'sub': 'rv', 'mul': 'rv', 'div': 'rv',
+    'cmp': 'vv', 'stw': 'va', 'mvw': 'ra',
+    'end': '', 'ret': '',
+}
+OPERANDS.update(dict.fromkeys(JUMPS, 'l'))
+
+CALLS = (OP_CALL, OP_CE, OP_CNE, OP_CG, OP_CGE, OP_CL, OP_CLE)
+BRANCHES = (OP_JE, OP_JNE, OP_JG, OP_JGE, OP_JL, OP_JLE)
+
+
+class VerificationError(ProgramError):
+    """Raised when a program fails verification, listing every problem found"""
+
+    def __init__(self, problems):
+        super().__init__(f"Program failed verification with {len(problems)} problem(s)")
+        self.problems = problems
+
+
+class VerifiedProgram(Program):
+    """A program that passed verify_program. It holds no error records, and
+    its rets are known to run with a call on the stack, so they run as
+    OP_RETURN records that skip the empty stack check"""
+
+
+def _op_return(machine, a, b, c, pc):
+    return machine.stack.pop() + 1
+
+
+OP_RETURN = len(HANDLERS)
+HANDLERS.append(_op_return)
+
+
+def verify_program(program):
+    """Checks a decoded program before it runs. Returns the problems found:
+    unknown commands and labels, wrong operand counts, invalid registers,
+    immediates and addresses, rets that can run outside of any call and
+    paths that run past the last line. The program must not be optimized."""
+
+    if program.lines is not None:
+        raise ValueError("Only decoded programs can be verified, not optimized ones")
+
+    problems = []
+    for i, line in enumerate(program.source):
+        op, message = program.code[i][:2]
+        if op == OP_ERROR:
+            problems.append((i, message))
+        else:
+            problems.extend((i, message) for message in _check_operands(i, line))
+
+    bad_returns, falls_off = _follow_calls(program.code)
+    problems.extend((i, f"'ret' outside of any call at line {i}") for i in bad_returns)
+    if falls_off:
+        last = len(program) - 1
+        problems.append((last, f"Execution can run past the last line ({last}) without 'end'"))
+
+    problems.sort(key=lambda problem: problem[0])
+    return [_locate(program, i, message) for i, message in problems]
+
+
+def verify(program):
+    """Returns the VerifiedProgram of a decoded program, or raises
+    VerificationError if verify_program finds any problem"""
+
+    problems = verify_program(program)
+    if problems:
+        raise VerificationError(problems)
+    code = [(OP_RETURN, None, None, None) if record[0] == OP_RET else record for record in program.code]
+    return VerifiedProgram(program.source, code, program.labels, program.register_names,
+                           program.lines, program.positions, program.files)
+
+
+def _locate(program, i, message):
+    position = program.position_of(i)
+    return message if position is None else f"{message} (file line {position})"
+
+
+def _check_operands(i, line):
+    """Yields the problems with the operands of a tokenized line"""
+
+    command, other = line[0], line[1:]
+    if command.endswith(':'):
+        if other:
+            yield f"Unexpected operands after label '{command}' at line {i}"
+        return
+    if command == 'msg':
+        return
+
+    kinds = OPERANDS[command]
+    if len(other) != len(kinds):
+        yield f"Wrong number of operands for '{command}' at line {i}: expected {len(kinds)}, got {len(other)}"
+        return
+
+    for kind, token in zip(kinds, other):
+        if kind == 'r' and not token.isidentifier():
+            yield f"Invalid register '{token}' at line {i}"
+        elif kind == 'v' and parse_int(token) is None and not token.isidentifier():
+            yield f"Invalid immediate '{token}' at line {i}"
+        elif kind == 'a':
+            base, offset = parse_address(token)
+            if base is not None and not base.isidentifier():
+                yield f"Invalid address '{token}' at line {i}"
+
+
+def _follow_calls(code):
+    """Follows every path from the first line, tracking whether a call is on
+    the stack. Returns the rets reachable with an empty stack and whether
+    any path reaches the end of the program"""
+
+    bad_returns = set()
+    falls_off = False
+    seen = set()
+    pending = [(0, False)]  # (line, inside a call)
+    while pending:
+        state = pending.pop()
+        if state in seen:
+            continue
+        seen.add(state)
+        pc, in_call = state
+        op, target = code[pc][:2]
+
+        if op == OP_RET:
+            if not in_call:
+                bad_returns.add(pc)
+            continue
+        if op == OP_FALLOFF:
+            falls_off = True
+            continue
+        if op in (OP_END, OP_EXIT, OP_ERROR):
+            continue
+        if op == OP_JMP:
+            pending.append((target, in_call))
+            continue
+
+        if op in CALLS:
+            pending.append((target, True))
+        elif op in BRANCHES:
+            pending.append((target, in_call))
+        # A call returns to the next line with the stack it started with
+        pending.append((pc + 1, in_call))
+
+    return sorted(bad_returns), falls_off
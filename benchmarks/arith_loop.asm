@@ -0,0 +1,13 @@
+; Tight arithmetic loop: linear register arithmetic on a counter
+mov i, 0
+mov acc, 0
+mov step, 3
+loop:
+    add acc, step
+    mul acc, 1
+    sub acc, 1
+    inc i
+    cmp i, 200000
+    jl loop
+msg 'acc: ', acc
+end
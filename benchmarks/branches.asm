@@ -0,0 +1,33 @@
+; Branch-heavy cmp/j* code: Collatz sequence lengths of 1..3000
+mov start, 1
+mov longest, 0
+next:
+    mov n, start
+    mov length, 0
+collatz:
+    cmp n, 1
+    je done
+    mov half, n
+    div half, 2
+    mov twice, half
+    mul twice, 2
+    cmp twice, n
+    jne odd
+    mov n, half
+    jmp counted
+odd:
+    mul n, 3
+    inc n
+counted:
+    inc length
+    jmp collatz
+done:
+    cmp length, longest
+    jle shorter
+    mov longest, length
+shorter:
+    inc start
+    cmp start, 3000
+    jle next
+msg 'longest: ', longest
+end
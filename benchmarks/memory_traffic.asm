@@ -0,0 +1,25 @@
+; Heavy stw/mvw traffic: fill a table, then sum it several times
+mov i, 0
+fill:
+    mov v, i
+    mul v, 7
+    stw v, i+10000
+    inc i
+    cmp i, 20000
+    jl fill
+
+mov total, 0
+mov pass, 0
+sum_pass:
+    mov i, 0
+sum:
+    mvw v, i+10000
+    add total, v
+    inc i
+    cmp i, 20000
+    jl sum
+    inc pass
+    cmp pass, 3
+    jl sum_pass
+msg 'total: ', total
+end
@@ -0,0 +1,8 @@
+; Output-heavy loop: one formatted msg per iteration
+mov i, 0
+loop:
+    msg 'line ', i, ' of the output-heavy benchmark, value: ', i, ' done'
+    inc i
+    cmp i, 100000
+    jl loop
+end
@@ -0,0 +1,18 @@
+; Deep call/ret recursion, repeated
+mov rounds, 0
+mov calls, 0
+outer:
+    mov n, 2000
+    call descend
+    inc rounds
+    cmp rounds, 40
+    jl outer
+msg 'calls: ', calls
+end
+
+descend:
+    inc calls
+    dec n
+    cmp n, 0
+    cg descend
+    ret
@@ -0,0 +1,13 @@
+from assembly_batch import Job, run_job
+
+PROGRAM = "mov acc, 0\nadd acc, n\nmsg 'n=', n, ' acc=', acc\nend\n"
+
+
+def test_msg_prints_register_set_only_by_preset():
+    result = run_job(Job(text=PROGRAM, registers={'n': 7}))
+    assert result['output'] == "n=7 acc=7\n"
+
+
+def test_msg_prints_name_without_preset():
+    result = run_job(Job(text=PROGRAM.replace("add acc, n\n", "")))
+    assert result['output'] == "n=n acc=0\n"
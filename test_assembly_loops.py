@@ -0,0 +1,68 @@
+import pytest
+
+from assembly_decoder import decode_program
+from assembly_loops import OP_LOOP, accelerate_loops, find_loop
+from assembly_machine import Machine
+
+
+def run(program, registers=None, max_steps=None):
+    machine = Machine(program, registers=registers)
+    machine.run(max_steps)
+    return machine
+
+
+def check(text, registers=None, accelerated=True):
+    """Runs a program with and without fast loops and checks both agree"""
+    program = decode_program(text)
+    fast = accelerate_loops(program)
+    assert any(record[0] == OP_LOOP for record in fast.code) == accelerated
+    plain, loops = run(program, registers), run(fast, registers)
+    assert (loops.status, loops.error, loops.output, loops.steps, loops.registers_dict()) == \
+           (plain.status, plain.error, plain.output, plain.steps, plain.registers_dict())
+    return loops
+
+
+@pytest.mark.parametrize('start, body, jump, limit', [
+    (0, 'inc i', 'je', 1),
+    (0, 'add i, 3', 'jne', 12),
+    (12, 'sub i, 3', 'jne', 0),
+    (10, 'dec i', 'jg', 2),
+    (10, 'sub i, 3', 'jge', 2),
+    (0, 'add i, 4', 'jl', 9),
+    (0, 'add i, 4', 'jle', 8),
+    (5, 'inc i', 'jl', 3),
+])
+def test_each_jump_matches_the_plain_program(start, body, jump, limit):
+    text = f"mov i, {start}\nmov acc, 0\nL0:\n{body}\nadd acc, 2\ncmp i, {limit}\n{jump} L0\nmsg 'i=', i, ' acc=', acc\nend\n"
+    assert check(text).status == 'end'
+
+
+def test_jne_past_the_limit_never_exits():
+    program = decode_program("mov i, 1\nL0:\nadd i, 2\ncmp i, 8\njne L0\nend\n")
+    head = program.labels['L0']
+    assert find_loop(program.code, head).iterations(1, 2, 8) is None
+    fast = accelerate_loops(program)
+    assert run(fast, max_steps=1000).steps == run(program, max_steps=1000).steps == 1000
+
+
+def test_register_limit():
+    check("mov i, 0\nmov n, 7\nL0:\ninc i\ncmp i, n\njl L0\nmsg i\nend\n")
+    check("mov i, 0\nL0:\nadd i, s\ncmp i, n\njle L0\nmsg i\nend\n", registers={'s': 3, 'n': 10})
+
+
+def test_unset_registers_fall_back_to_the_plain_loop():
+    # A limit, an added register or a counter that is unset fails as it would without fast loops
+    assert check("mov i, 0\nL0:\ninc i\ncmp i, n\njl L0\nend\n").status == 'error'
+    assert check("mov i, 0\nL0:\nadd i, s\ncmp i, 6\njne L0\nend\n").status == 'error'
+    assert check("L0:\ninc i\ncmp i, 3\njl L0\nend\n").status == 'error'
+    assert check("mov i, 0\nL0:\ninc acc\ninc i\ncmp i, 3\njl L0\nend\n").status == 'error'
+
+
+def test_inner_loop_entered_again():
+    machine = check("mov j, 0\nmov acc, 0\nL1:\nmov i, 0\nL0:\nadd acc, j\ninc i\ncmp i, 4\njl L0\ninc j\n"
+                    "cmp j, 3\njl L1\nmsg acc\nend\n")
+    assert machine.output == "12\n"
+
+
+def test_added_register_preset_on_the_machine():
+    check("mov i, 0\nL0:\nadd i, s\ncmp i, 12\njne L0\nmsg i\nend\n", registers={'s': 4})
@@ -0,0 +1,28 @@
+from assembly_decoder import decode_program
+from assembly_machine import Machine
+from assembly_optimizer import optimize_program, verify_optimization
+
+
+def run(program):
+    machine = Machine(program)
+    machine.run()
+    return machine
+
+
+def test_message_before_constant_mov_keeps_register_name():
+    program = decode_program("msg x\nmov x, 5\nmsg x\nend\n")
+    assert run(optimize_program(program)).output == "x\n5\n"
+    assert verify_optimization(program) == []
+
+
+def test_compare_before_constant_mov_still_fails():
+    program = decode_program("cmp x, 1\nmov x, 5\nend\n")
+    machine = run(optimize_program(program))
+    assert machine.status == 'error'
+    assert machine.error == "Register 'x' used before assignment at line 0"
+    assert verify_optimization(program) == []
+
+
+def test_constant_is_folded_after_its_mov():
+    program = decode_program("mov x, 5\nmsg x\nend\n")
+    assert optimize_program(program).code[1][1] == ((None, '5'),)
@@ -0,0 +1,16 @@
+import io
+
+from assembly_decoder import decode_program
+from assembly_machine import Machine
+from assembly_tracing import ExecutionTrace
+
+
+def test_trace_of_program_running_past_its_last_line():
+    program = decode_program("mov a, 1\njmp L0\nend\nL0:\nmvw c, 3\n")
+    stream = io.StringIO()
+    machine = Machine(program)
+    machine.tracer = ExecutionTrace(program, stream=stream)
+    machine.run()
+    assert machine.status == 'error'
+    assert machine.error == "Program reached end without 'end' statement"
+    assert stream.getvalue().splitlines()[-1] == "Step 0005: <end of program>"